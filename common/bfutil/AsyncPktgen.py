@@ -0,0 +1,185 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import bfrt_grpc.client as gc
+
+from bfutil.Pktgen import Pktgen
+
+class AsyncPktgen():
+    """
+    asyncio front end of a Pktgen, so one event loop can drive the pktgen
+    of several switches at once.
+
+    The bfrt_grpc stubs block, so every call runs on a thread of a
+    bounded executor, which can be shared by all the switches of a test
+    bed. Calls on the same switch are serialized, since Pktgen keeps its
+    app registry and buffer allocator in memory; calls on different
+    switches run concurrently.
+
+        switches = await asyncio.gather(*[
+            AsyncPktgen.connect(addr, 'prog', executor=executor)
+            for addr in addrs
+        ])
+        await asyncio.gather(*[ s.set_apps(apps) for s in switches ])
+        await start_together([ (s, app_ids) for s in switches ])
+    """
+
+    def __init__(self, pktgen, executor=None, max_workers=4):
+        self.pktgen = pktgen
+        self.logger = logging.getLogger('AsyncPktgen')
+
+        self.own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = asyncio.Lock()
+
+    @classmethod
+    async def connect(cls, grpc_addr, program_name, client_id=0, device_id=0,
+                      num_pipes=4, executor=None, max_workers=4):
+        """Connect to the switch at grpc_addr and bind program_name."""
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        def setup():
+            client = gc.ClientInterface(grpc_addr, client_id, device_id)
+            client.bind_pipeline_config(program_name)
+            return Pktgen(client, client.bfrt_info_get(program_name), num_pipes)
+
+        pktgen = await asyncio.get_running_loop().run_in_executor(executor, setup)
+
+        instance = cls(pktgen, executor)
+        instance.own_executor = own_executor
+        return instance
+
+    async def _call(self, fn, *args, **kwargs):
+        async with self.lock:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def close(self):
+        if hasattr(self.pktgen.gc, 'tear_down_stream'):
+            await self._call(self.pktgen.gc.tear_down_stream)
+        if self.own_executor:
+            self.executor.shutdown(wait=False)
+
+    @property
+    def apps(self):
+        return self.pktgen.apps
+
+    async def set_app(self, *args, **kwargs):
+        return await self._call(self.pktgen.set_app, *args, **kwargs)
+
+    async def set_apps(self, apps):
+        return await self._call(self.pktgen.set_apps, apps)
+
+    async def fan_out(self, *args, **kwargs):
+        return await self._call(self.pktgen.fan_out, *args, **kwargs)
+
+    async def update_app(self, *args, **kwargs):
+        return await self._call(self.pktgen.update_app, *args, **kwargs)
+
+    async def set_app_rate(self, *args, **kwargs):
+        return await self._call(self.pktgen.set_app_rate, *args, **kwargs)
+
+    async def remove_app(self, *args, **kwargs):
+        return await self._call(self.pktgen.remove_app, *args, **kwargs)
+
+    async def start(self, app_id, pipe=None):
+        return await self._call(self.pktgen.start, app_id, pipe)
+
+    async def stop(self, app_id, pipe=None):
+        return await self._call(self.pktgen.stop, app_id, pipe)
+
+    async def start_apps(self, app_ids):
+        return await self._call(self.pktgen.start_apps, app_ids)
+
+    async def stop_apps(self, app_ids):
+        return await self._call(self.pktgen.stop_apps, app_ids)
+
+    async def get_report(self, app_id, pipe=None):
+        return await self._call(self.pktgen.get_report, app_id, pipe)
+
+    async def get_reports(self, app_ids=None):
+        return await self._call(self.pktgen.get_reports, app_ids)
+
+    async def poll(self, period, app_ids=None):
+        """
+        Async generator of (timestamp, get_reports()) every period seconds,
+        scheduled on the monotonic clock so it does not drift.
+        """
+        next_poll = time.monotonic()
+        while True:
+            reports = await self.get_reports(app_ids)
+            yield time.monotonic(), reports
+
+            next_poll += period
+            await asyncio.sleep(max(0.0, next_poll - time.monotonic()))
+
+async def start_together(switches, timeout=5.0):
+    """
+    Enable apps on several switches so their traffic starts at the same
+    time. switches is a list of (AsyncPktgen, app_ids).
+
+    The enable requests are built first, then one dedicated thread per
+    switch waits on a common barrier and sends its request as soon as all
+    of them are ready, so the start skew is the spread of a single RPC
+    instead of the sum of the setup work.
+
+    A switch listed more than once gets the app_ids of every entry in a
+    single request. Returns a dict with the monotonic 'sent' and 'done'
+    times of each distinct switch, in order of first appearance, and the
+    'skew' between the first and last request.
+    """
+    loop = asyncio.get_running_loop()
+
+    merged = {}
+    for s, app_ids in switches:
+        merged.setdefault(id(s), (s, []))[1].extend(app_ids)
+    switches = list(merged.values())
+
+    barrier = threading.Barrier(len(switches), timeout=timeout)
+
+    # the barrier needs every switch on its own thread at the same time
+    executor = ThreadPoolExecutor(max_workers=len(switches))
+
+    def fire(pktgen, app_ids):
+        requests = pktgen._enable_requests(app_ids, True)
+        barrier.wait()
+        sent = time.monotonic()
+        pktgen._send_requests(requests)
+        return sent, time.monotonic()
+
+    # a stable order, so concurrent calls sharing switches do not deadlock
+    locks = [ s.lock for s, _ in sorted(switches, key=lambda switch: id(switch[0])) ]
+    acquired = []
+
+    try:
+        for lock in locks:
+            await lock.acquire()
+            acquired.append(lock)
+
+        times = await asyncio.gather(*[
+            loop.run_in_executor(executor, fire, s.pktgen, app_ids)
+            for s, app_ids in switches
+        ])
+    finally:
+        for lock in acquired:
+            lock.release()
+        executor.shutdown(wait=False)
+
+    sent = [ t[0] for t in times ]
+    done = [ t[1] for t in times ]
+
+    logging.getLogger('AsyncPktgen').info(
+        'Started {} switches, skew {:.3f} ms'.format(len(switches), (max(sent) - min(sent)) * 1e3))
+
+    return {
+        'sent': sent,
+        'done': done,
+        'skew': max(sent) - min(sent),
+    }
@@ -0,0 +1,209 @@
+import logging
+import mmap
+import select
+import socket
+import struct
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# linux/if_packet.h
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+ETH_P_ALL = 0x0003
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# struct tpacket_block_desc: version, offset_to_priv, then tpacket_hdr_v1
+BLOCK_STATUS_OFFSET = 8
+BLOCK_HDR_FMT = '=III'      # block_status, num_pkts, offset_to_first_pkt
+
+# struct tpacket3_hdr up to tp_mac
+PKT_HDR_FMT = '=IIIIIIH'    # next_offset, sec, nsec, snaplen, len, status, mac
+
+# Timestamps the P4 program appends to every packet, see
+# get_timestamped_pkt_from_iface
+TIMESTAMP_TRAILER_FMT = '!QQIIQQ'
+TIMESTAMP_TRAILER_LEN = struct.calcsize(TIMESTAMP_TRAILER_FMT)
+TIMESTAMP_FIELDS = [
+    'ingress_mac',
+    'ingress_global',
+    'enqueue',
+    'dequeue_delta',
+    'egress_global',
+    'egress_tx',
+]
+
+class RingCapture():
+    """
+    Packet capture from an interface through an AF_PACKET socket with a
+    TPACKET_V3 ring, mmap'd so the kernel fills blocks of packets that are
+    read in place, with one poll per block instead of one recv per packet.
+    Needs CAP_NET_RAW; a veth pair is enough to try it out.
+
+        with RingCapture('veth1') as capture:
+            stamps = capture.timestamps(count=100000)
+
+    block_size * block_nr bytes of ring are locked in memory; a block is
+    handed over when full or after timeout_ms, whichever comes first.
+    """
+
+    def __init__(self, iface, block_size=1 << 22, block_nr=64, frame_size=2048, timeout_ms=10):
+        assert block_size % mmap.PAGESIZE == 0
+        assert block_size % frame_size == 0
+
+        self.iface = iface
+        self.block_size = block_size
+        self.block_nr = block_nr
+        self.frame_size = frame_size
+        self.timeout_ms = timeout_ms
+        self.logger = logging.getLogger('RingCapture')
+
+        self.sock = None
+        self.ring = None
+        self.block = 0
+
+    def open(self):
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+
+            frame_nr = self.block_size * self.block_nr // self.frame_size
+            self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, struct.pack(
+                '=IIIIIII', self.block_size, self.block_nr, self.frame_size, frame_nr,
+                self.timeout_ms, 0, 0))
+
+            self.ring = mmap.mmap(self.sock.fileno(), self.block_size * self.block_nr,
+                                  mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            self.sock.bind((self.iface, ETH_P_ALL))
+        except Exception:
+            self.close()
+            raise
+
+        self.poller = select.poll()
+        self.poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+        self.block = 0
+
+        self.logger.info('Capturing on {} with a {} MB ring'.format(
+            self.iface, self.block_size * self.block_nr >> 20))
+        return self
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        """Packets and drops since the last call, as counted by the kernel."""
+        packets, drops, _ = struct.unpack('=III', self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 12))
+        return { 'packets': packets, 'drops': drops }
+
+    def _block_ready(self, offset):
+        return struct.unpack_from('=I', self.ring, offset + BLOCK_STATUS_OFFSET)[0] & TP_STATUS_USER
+
+    def blocks(self, timeout=None):
+        """
+        Generator of lists of (ts_ns, packet) for each block the kernel
+        hands over, packets being memoryviews into the ring. They are only
+        valid until the next block is asked for, when the block goes back
+        to the kernel. Stops after timeout seconds without a block.
+        """
+        while True:
+            offset = self.block * self.block_size
+            if not self._block_ready(offset):
+                events = self.poller.poll(None if timeout is None else timeout * 1e3)
+                if not events and not self._block_ready(offset):
+                    return
+                if not self._block_ready(offset):
+                    continue
+
+            packets = []
+            view = memoryview(self.ring)
+            try:
+                _, num_pkts, pkt_offset = struct.unpack_from(BLOCK_HDR_FMT, self.ring, offset + BLOCK_STATUS_OFFSET)
+
+                pkt = offset + pkt_offset
+                for _ in range(num_pkts):
+                    next_offset, sec, nsec, snaplen, _, _, mac = struct.unpack_from(PKT_HDR_FMT, self.ring, pkt)
+                    packets.append((sec * 1000000000 + nsec, view[pkt + mac:pkt + mac + snaplen]))
+                    pkt += next_offset
+
+                yield packets
+            finally:
+                struct.pack_into('=I', self.ring, offset + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+                self.block = (self.block + 1) % self.block_nr
+
+    def packets(self, timeout=None):
+        """Generator of (ts_ns, packet bytes), one packet at a time."""
+        for block in self.blocks(timeout):
+            for ts, pkt in block:
+                yield ts, bytes(pkt)
+
+    def timestamps(self, count=None, duration=None, min_len=TIMESTAMP_TRAILER_LEN):
+        """
+        Collect the timestamp trailers of count packets, or of every packet
+        for duration seconds, whichever comes first. Packets shorter than
+        min_len are skipped. Returns what parse_timestamp_trailers does,
+        plus the kernel receive time of each packet in 'rx_ns' and the
+        number of packets skipped in 'skipped'.
+        """
+        assert count is not None or duration is not None
+
+        trailers = bytearray()
+        rx_ns = []
+        skipped = 0
+        end = None if duration is None else time.monotonic() + duration
+
+        for block in self.blocks(timeout=duration if duration is not None else None):
+            for ts, pkt in block:
+                if len(pkt) < min_len:
+                    skipped += 1
+                    continue
+                trailers += pkt[-TIMESTAMP_TRAILER_LEN:]
+                rx_ns.append(ts)
+                if count is not None and len(rx_ns) == count:
+                    break
+
+            if count is not None and len(rx_ns) >= count:
+                break
+            if end is not None and time.monotonic() >= end:
+                break
+
+        stamps = parse_timestamp_trailers(trailers)
+        stamps['rx_ns'] = np.array(rx_ns, dtype=np.uint64) if np is not None else rx_ns
+        stamps['skipped'] = skipped
+        return stamps
+
+def parse_timestamp_trailers(trailers):
+    """
+    Parse back to back TIMESTAMP_TRAILER_FMT trailers into a dict of field
+    name to the values of every packet: numpy arrays if numpy is there,
+    lists otherwise.
+    """
+    if np is not None:
+        records = np.frombuffer(bytes(trailers), dtype=np.dtype([
+            (name, '>u8' if fmt == 'Q' else '>u4')
+            for name, fmt in zip(TIMESTAMP_FIELDS, TIMESTAMP_TRAILER_FMT[1:])
+        ]))
+        return { name: records[name].astype(np.uint64) for name in TIMESTAMP_FIELDS }
+
+    columns = list(zip(*struct.iter_unpack(TIMESTAMP_TRAILER_FMT, bytes(trailers))))
+    if not columns:
+        columns = [ () ] * len(TIMESTAMP_FIELDS)
+    return { name: list(values) for name, values in zip(TIMESTAMP_FIELDS, columns) }
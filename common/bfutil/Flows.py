@@ -0,0 +1,160 @@
+import logging
+import socket
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# src_addr, dst_addr, src_port, dst_port: 12 bytes per flow
+FLOW_FIELDS = [
+    ('src_addr', 'u4'),
+    ('dst_addr', 'u4'),
+    ('src_port', 'u2'),
+    ('dst_port', 'u2'),
+]
+
+class Uniform():
+    """Values drawn uniformly from [low, high]."""
+
+    def __init__(self, low, high):
+        assert low <= high
+        self.low = low
+        self.high = high
+
+    def sample(self, rng, start, n):
+        return rng.integers(self.low, self.high, size=n, endpoint=True, dtype=np.uint64)
+
+class Zipf():
+    """
+    Values from [low, high] with Zipf distributed popularity: low is the
+    most frequent, low + 1 the next one and so on. s is the exponent and
+    must be above 1.
+    """
+
+    def __init__(self, low, high, s=1.2):
+        assert low <= high
+        assert s > 1
+        self.low = low
+        self.high = high
+        self.s = s
+
+    def sample(self, rng, start, n):
+        span = self.high - self.low + 1
+        ranks = rng.zipf(self.s, size=n)
+
+        # redraw the ranks past the end of the range
+        over = ranks > span
+        while over.any():
+            ranks[over] = rng.zipf(self.s, size=int(over.sum()))
+            over = ranks > span
+
+        return ranks.astype(np.uint64) - 1 + self.low
+
+class Sequential():
+    """
+    start, start + step, ... wrapping around within [low, high]. The
+    value of flow i only depends on i, so chunks can be made in any order.
+    step may be negative to count down.
+    """
+
+    def __init__(self, low, high, start=None, step=1):
+        assert low <= high
+        self.low = low
+        self.high = high
+        self.start = low if start is None else start
+        self.step = step
+
+    def sample(self, rng, start, n):
+        span = self.high - self.low + 1
+
+        # everything is reduced modulo span first, so a negative step or
+        # start below low work and the uint64 products cannot overflow
+        offset = np.uint64((self.start - self.low) % span)
+        step = np.uint64(self.step % span)
+        index = np.arange(start, start + n, dtype=np.uint64) % np.uint64(span)
+        return (offset + index * step) % np.uint64(span) + np.uint64(self.low)
+
+class FlowGenerator():
+    """
+    Reproducible sets of n 5-tuple style flows (src/dst address and port),
+    generated in NumPy structured arrays of FLOW_FIELDS, chunk_size flows
+    at a time, so millions of flows never become millions of dicts.
+
+    Each field takes a distribution: Uniform, Zipf or Sequential. Addresses
+    are IPv4 addresses as integers. Iterating twice over the same
+    generator gives the same flows.
+
+        flows = FlowGenerator(10**6, seed=1, dst_addr=Zipf(0x0a000000, 0x0affffff))
+        table.bulk_load((({ 'dst_addr': flow['dst_addr'] }, { 'port': 1 })
+                         for flow in flow_dicts(flows)), action='forward')
+    """
+
+    def __init__(self, n, seed=0, chunk_size=1 << 20, src_addr=None, dst_addr=None,
+                 src_port=None, dst_port=None):
+        if np is None:
+            raise ImportError('FlowGenerator needs numpy')
+
+        self.n = n
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.logger = logging.getLogger('FlowGenerator')
+
+        # same ranges as create_random_flows by default
+        self.distributions = {
+            'src_addr': src_addr or Uniform(0, 0xFFFFFFFF),
+            'dst_addr': dst_addr or Uniform(0, 0xFFFFFFFF),
+            'src_port': src_port or Uniform(1, 10000),
+            'dst_port': dst_port or Uniform(1, 10000),
+        }
+        self.dtype = np.dtype(FLOW_FIELDS)
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        return self.chunks()
+
+    def chunks(self):
+        """Generator of structured arrays of up to chunk_size flows."""
+        rng = np.random.default_rng(self.seed)
+
+        for start in range(0, self.n, self.chunk_size):
+            n = min(self.chunk_size, self.n - start)
+
+            chunk = np.empty(n, dtype=self.dtype)
+            for field, distribution in self.distributions.items():
+                chunk[field] = distribution.sample(rng, start, n)
+
+            yield chunk
+
+    def array(self):
+        """Every flow in a single structured array."""
+        flows = np.empty(self.n, dtype=self.dtype)
+
+        pos = 0
+        for chunk in self.chunks():
+            flows[pos:pos + len(chunk)] = chunk
+            pos += len(chunk)
+
+        return flows
+
+def addr_to_str(addr):
+    return socket.inet_ntoa(struct.pack('!L', int(addr)))
+
+def flow_dicts(flows):
+    """
+    Generator of the flows of a structured array (or FlowGenerator) as the
+    dicts create_random_flows returns, for code that needs them.
+    """
+    chunks = flows.chunks() if isinstance(flows, FlowGenerator) else [ flows ]
+
+    for chunk in chunks:
+        for src_addr, dst_addr, src_port, dst_port in chunk.tolist():
+            yield {
+                'src_addr': addr_to_str(src_addr),
+                'dst_addr': addr_to_str(dst_addr),
+                'src_port': src_port,
+                'dst_port': dst_port,
+            }
@@ -0,0 +1,355 @@
+import json
+import os
+import threading
+import time
+
+from collections import namedtuple
+
+RpcRecord = namedtuple('RpcRecord', [
+    'table',            # table name as passed to table_get
+    'op',               # the method called: entry_add, entry_get, ...
+    'start',            # host monotonic time of the call, in seconds
+    'seconds',          # wall time of the call
+    'entries',          # keys in the request, 0 for a whole table read
+    'from_hw',          # for reads, whether they went to hardware
+    'thread',           # ident of the calling thread
+    'request_bytes',    # field bytes of the keys and data sent, if sized
+    'response_bytes',   # field bytes of the entries read, if sized
+])
+
+# table methods that are one RPC each
+RPC_PREFIXES = ( 'entry_', 'default_entry_' )
+
+def _call_args(op, args, kwargs):
+    """Number of keys and from_hw flag of a call to a bfrt table method."""
+    if op.startswith('default_entry_'):
+        entries = 1
+        flags = kwargs.get('flags', args[1] if len(args) > 1 else None)
+    else:
+        key_list = kwargs.get('key_list', args[1] if len(args) > 1 else None)
+        entries = len(key_list) if key_list is not None else 0
+        flags = kwargs.get('flags', args[2] if len(args) > 2 else None)
+
+    if not op.endswith('_get'):
+        return entries, None
+
+    # bfrt_grpc reads from hardware unless told otherwise
+    return entries, bool((flags or {}).get('from_hw', True))
+
+def _value_bytes(value):
+    if isinstance(value, dict):
+        return sum(_value_bytes(v) for v in value.values())
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(_value_bytes(v) for v in value)
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, int):
+        return max(1, (value.bit_length() + 7) // 8)
+    return 8
+
+def payload_bytes(objects):
+    """
+    Approximate size of the field values of bfrt keys or data objects (or
+    (data, key) responses), from their to_dict(). Protobuf framing is not
+    counted.
+    """
+    total = 0
+    for obj in objects or ():
+        if isinstance(obj, tuple):
+            total += payload_bytes(obj)
+            continue
+        fields = obj.to_dict()
+        total += sum(_value_bytes(value) for name, value in fields.items()
+                     if name not in ('action_name', 'is_default_entry'))
+    return total
+
+def _request_bytes(op, args, kwargs):
+    if op.startswith('default_entry_'):
+        data = kwargs.get('data', args[1] if len(args) > 1 and op == 'default_entry_set' else None)
+        return payload_bytes([ data ] if data is not None else [])
+
+    key_list = kwargs.get('key_list', args[1] if len(args) > 1 else None)
+    data_list = None
+    if op in ('entry_add', 'entry_mod'):
+        data_list = kwargs.get('data_list', args[2] if len(args) > 2 else None)
+    return payload_bytes(key_list) + payload_bytes(data_list)
+
+class _Responses():
+    """Iterator over the responses of a read, calling done once when they run out or are dropped."""
+
+    def __init__(self, responses, done, sized=False):
+        self._responses = iter(responses)
+        self._done = done
+        self.sized = sized
+        self.bytes = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            response = next(self._responses)
+        except StopIteration:
+            self.close()
+            raise
+
+        if self.sized:
+            self.bytes += payload_bytes([ response ])
+        return response
+
+    def close(self):
+        if self._done is not None:
+            done, self._done = self._done, None
+            done(self.bytes if self.sized else None)
+
+    def __del__(self):
+        self.close()
+
+class InstrumentedTable():
+    """
+    Forwards everything to a bfrt table, handing an RpcRecord of every RPC
+    to each observer. Reads are timed until their responses are consumed,
+    since they stream from the switch.
+
+    Payloads are only sized (with payload_bytes, which is not free) when
+    an observer has a true `sizes` attribute.
+    """
+
+    def __init__(self, table, name, observers):
+        self._table = table
+        self._name = name
+        self._observers = observers
+
+    def __getattr__(self, name):
+        attr = getattr(self._table, name)
+        if not name.startswith(RPC_PREFIXES):
+            return attr
+
+        def rpc(*args, **kwargs):
+            entries, from_hw = _call_args(name, args, kwargs)
+            sized = any(getattr(observer, 'sizes', False) for observer in self._observers)
+            request = _request_bytes(name, args, kwargs) if sized else None
+
+            start = time.monotonic()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                self._record(name, start, entries, from_hw, request, None)
+                raise
+
+            if name.endswith('_get') and result is not None:
+                return _Responses(result, lambda response: self._record(
+                    name, start, entries, from_hw, request, response), sized)
+
+            self._record(name, start, entries, from_hw, request, 0 if sized else None)
+            return result
+
+        return rpc
+
+    def _record(self, op, start, entries, from_hw, request, response):
+        record = RpcRecord(self._name, op, start, time.monotonic() - start, entries, from_hw,
+                           threading.get_ident(), request, response)
+        for observer in list(self._observers):
+            observer(record)
+
+class InstrumentedBfrtInfo():
+    """
+    A bfrt_info whose table_get returns InstrumentedTables, so Pktgen,
+    Table subclasses or anything else built on it report their RPCs:
+
+        metrics = RpcMetrics()
+        pktgen = Pktgen(client, InstrumentedBfrtInfo(bfrt_info, [ metrics ]))
+    """
+
+    def __init__(self, bfrt_info, observers=None):
+        self._bfrt_info = bfrt_info
+        self.observers = list(observers or [])
+
+    def __getattr__(self, name):
+        return getattr(self._bfrt_info, name)
+
+    def table_get(self, name):
+        return InstrumentedTable(self._bfrt_info.table_get(name), name, self.observers)
+
+def instrument(obj, observers=()):
+    """
+    Wrap the bfrt tables an existing object already holds (a Pktgen's
+    port_cfg, app_cfg and pkt_buffer, a Table's table) in InstrumentedTables,
+    and its bfrt_info for the tables it looks up later. Returns obj.
+    Objects already instrumented get observers added to their lists.
+    """
+    observers = list(observers)
+
+    for observer_list in _observer_lists(obj):
+        observer_list.extend(observers)
+
+    for attr, value in list(vars(obj).items()):
+        if attr == 'bfrt_info':
+            if not isinstance(value, InstrumentedBfrtInfo):
+                setattr(obj, attr, InstrumentedBfrtInfo(value, observers))
+        elif not isinstance(value, InstrumentedTable) and hasattr(value, 'entry_get') \
+                and hasattr(value, 'make_key'):
+            try:
+                name = value.info.name_get()
+            except AttributeError:
+                name = attr
+            setattr(obj, attr, InstrumentedTable(value, name, observers))
+
+    return obj
+
+def _observer_lists(obj):
+    """The distinct observer lists of the instrumented tables and bfrt_info of obj."""
+    lists = {}
+    for value in list(vars(obj).values()):
+        if isinstance(value, InstrumentedBfrtInfo):
+            lists[id(value.observers)] = value.observers
+        elif isinstance(value, InstrumentedTable):
+            lists[id(value._observers)] = value._observers
+    return list(lists.values())
+
+class RpcProfiler():
+    """
+    Observer for InstrumentedTable that keeps every RpcRecord, for a report
+    per table, operation and from_hw flag, and a Chrome trace of the
+    RPC timeline (chrome://tracing or Perfetto).
+
+        with RpcProfiler().attach(pktgen) as profiler:
+            pktgen.set_apps(apps)
+        print(profiler.format_report())
+        profiler.write_chrome_trace(open('rpcs.json', 'w'))
+
+    sizes makes the tables size request and response payloads, which costs
+    a to_dict() of every key, data and response. At most max_records are
+    kept for the trace; the report counts every RPC.
+    """
+
+    def __init__(self, sizes=True, max_records=1 << 20):
+        self.sizes = sizes
+        self.max_records = max_records
+        self.records = []
+        self.dropped = 0
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._attached = []
+
+    def __call__(self, record):
+        with self._lock:
+            if len(self.records) < self.max_records:
+                self.records.append(record)
+            else:
+                self.dropped += 1
+
+            key = (record.table, record.op, record.from_hw)
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = {
+                    'calls': 0, 'entries': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                    'request_bytes': 0, 'response_bytes': 0,
+                }
+            stats['calls'] += 1
+            stats['entries'] += record.entries
+            stats['seconds'] += record.seconds
+            stats['max_seconds'] = max(stats['max_seconds'], record.seconds)
+            stats['request_bytes'] += record.request_bytes or 0
+            stats['response_bytes'] += record.response_bytes or 0
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+            self.dropped = 0
+            self.stats = {}
+
+    def attach(self, *objs):
+        """
+        Instrument objs if needed and observe their RPCs until detach(), or
+        the end of the with block when used as a context manager.
+        """
+        for obj in objs:
+            instrument(obj)
+            for observer_list in _observer_lists(obj):
+                if not any(observer is self for observer in observer_list):
+                    observer_list.append(self)
+                    self._attached.append(observer_list)
+        return self
+
+    def detach(self):
+        for observer_list in self._attached:
+            observer_list[:] = [ observer for observer in observer_list if observer is not self ]
+        self._attached = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.detach()
+
+    def report(self):
+        """
+        List of dicts, one per table, op and from_hw, by decreasing total
+        time: calls, entries, seconds, mean_ms, max_ms and the payload bytes.
+        """
+        with self._lock:
+            stats = { key: dict(value) for key, value in self.stats.items() }
+
+        rows = []
+        for (table, op, from_hw), value in stats.items():
+            value.update({
+                'table': table,
+                'op': op,
+                'from_hw': from_hw,
+                'mean_ms': 1e3 * value['seconds'] / value['calls'],
+                'max_ms': 1e3 * value.pop('max_seconds'),
+            })
+            rows.append(value)
+
+        return sorted(rows, key=lambda row: -row['seconds'])
+
+    def format_report(self):
+        lines = [ '{:<24} {:<18} {:<7} {:>8} {:>9} {:>10} {:>9} {:>9} {:>11} {:>11}'.format(
+            'table', 'op', 'from_hw', 'calls', 'entries', 'total_ms', 'mean_ms', 'max_ms',
+            'req_bytes', 'resp_bytes') ]
+
+        for row in self.report():
+            lines.append('{:<24} {:<18} {:<7} {:>8} {:>9} {:>10.3f} {:>9.3f} {:>9.3f} {:>11} {:>11}'.format(
+                row['table'][-24:], row['op'], '-' if row['from_hw'] is None else str(row['from_hw']),
+                row['calls'], row['entries'], 1e3 * row['seconds'], row['mean_ms'], row['max_ms'],
+                row['request_bytes'], row['response_bytes']))
+
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        """The records as a dict of Chrome trace events, one complete event per RPC."""
+        with self._lock:
+            records = list(self.records)
+
+        pid = os.getpid()
+        events = []
+        for record in records:
+            args = { 'entries': record.entries }
+            if record.from_hw is not None:
+                args['from_hw'] = record.from_hw
+            if record.request_bytes is not None:
+                args['request_bytes'] = record.request_bytes
+            if record.response_bytes is not None:
+                args['response_bytes'] = record.response_bytes
+
+            events.append({
+                'name': '{}.{}'.format(record.table, record.op),
+                'cat': 'bfrt',
+                'ph': 'X',
+                'ts': record.start * 1e6,
+                'dur': record.seconds * 1e6,
+                'pid': pid,
+                'tid': record.thread,
+                'args': args,
+            })
+
+        return { 'traceEvents': events, 'displayTimeUnit': 'ms' }
+
+    def write_chrome_trace(self, f):
+        json.dump(self.chrome_trace(), f)
+        f.write('\n')
@@ -0,0 +1,309 @@
+import json
+import logging
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from bfutil.Capture import TIMESTAMP_FIELDS
+
+# ingress_global and egress_global are 48 bit, the TM timestamps 32 bit
+GLOBAL_TS_MASK = (1 << 48) - 1
+TM_TS_MASK = (1 << 32) - 1
+
+class LatencyHistogram():
+    """
+    HDR style histogram of non-negative integer values (nanoseconds).
+
+    Values below 2^precision are counted exactly; above that, each power
+    of two is split in 2^(precision - 1) buckets, so the relative error of
+    every bucket is under 2^-(precision - 1) (under 1.6% with the default
+    7) and the memory used is fixed, about 3800 counters for any 64 bit
+    value.
+    """
+
+    def __init__(self, precision=7):
+        assert 1 < precision < 16
+        self.precision = precision
+        self.half = 1 << (precision - 1)
+        self.counts = [ 0 ] * ((1 << precision) + (64 - precision) * self.half)
+        self.reset()
+
+    def reset(self):
+        self.counts = [ 0 ] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = value.bit_length() - self.precision
+        if shift <= 0:
+            return value
+        return (1 << self.precision) + (shift - 1) * self.half + (value >> shift) - self.half
+
+    def _value(self, index):
+        """Highest value counted in bucket index."""
+        if index < (1 << self.precision):
+            return index
+
+        shift = (index - (1 << self.precision)) // self.half + 1
+        mantissa = (index - (1 << self.precision)) % self.half + self.half
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value, count=1):
+        value = int(value)
+        assert value >= 0
+
+        self.counts[self._index(value)] += count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def record_many(self, values):
+        """Record a sequence of values; vectorized when numpy is there."""
+        if np is None:
+            for value in values:
+                self.record(value)
+            return
+
+        values = np.asarray(values, dtype=np.int64)
+        if not len(values):
+            return
+        assert values.min() >= 0
+
+        # bit_length of every value, exact below 2^53
+        _, bits = np.frexp(values.astype(np.float64))
+        shift = np.maximum(bits - self.precision, 0)
+        index = np.where(
+            shift == 0,
+            values,
+            (1 << self.precision) + (shift - 1) * self.half + (values >> shift) - self.half
+        )
+
+        for i, n in zip(*np.unique(index, return_counts=True)):
+            self.counts[int(i)] += int(n)
+
+        self.count += len(values)
+        self.total += int(values.sum())
+        low, high = int(values.min()), int(values.max())
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def merge(self, other):
+        assert other.precision == self.precision
+
+        for i, n in enumerate(other.counts):
+            if n:
+                self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, p):
+        """Value at percentile p in [0, 100], to the bucket precision."""
+        if not self.count:
+            return None
+
+        rank = max(1, int(round(p / 100.0 * self.count + 0.5)))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self._value(i), self.max)
+
+        return self.max
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'min': self.min,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'p99.9': self.percentile(99.9),
+            'max': self.max,
+        }
+
+class LatencyStats():
+    """
+    Per stage latency of packets carrying the timestamp trailer, as
+    collected by RingCapture.timestamps or parse_timestamp_trailers.
+
+    Stages, in nanoseconds:
+        mac_to_ingress    ingress MAC to the start of ingress processing
+        ingress_pipeline  ingress processing up to the TM enqueue
+        queueing          time in the TM queue (dequeue delta)
+        egress_pipeline   TM dequeue to the egress global timestamp
+        pipeline          ingress to egress without the queueing
+        total             ingress to egress
+
+    Each stage has a LatencyHistogram, so memory stays bounded whatever
+    the number of packets. With a period, report() is handed to every
+    callback once per period from add(), and to the callbacks on a timer
+    thread while started:
+
+        stats = LatencyStats(period=1.0)
+        stats.add_callback(lambda report: print(report['total']['p99']))
+        with RingCapture('veth1') as capture:
+            for _ in range(60):
+                stats.add(capture.timestamps(duration=1.0))
+    """
+
+    STAGES = [
+        'mac_to_ingress',
+        'ingress_pipeline',
+        'queueing',
+        'egress_pipeline',
+        'pipeline',
+        'total',
+    ]
+
+    def __init__(self, precision=7, period=None):
+        self.precision = precision
+        self.period = period
+        self.logger = logging.getLogger('LatencyStats')
+
+        self.histograms = { stage: LatencyHistogram(precision) for stage in self.STAGES }
+        self.packets = 0
+        self.skipped = 0
+
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._last_export = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_callback(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        with self._lock:
+            self._callbacks.remove(callback)
+
+    def stages(self, stamps):
+        """
+        The latency of every stage for a dict of trailer fields to values,
+        as lists, or numpy arrays when numpy is there.
+        """
+        if np is not None:
+            ts = { field: np.asarray(stamps[field], dtype=np.int64) for field in TIMESTAMP_FIELDS }
+            mask = lambda values, bits: values & bits
+        else:
+            ts = { field: stamps[field] for field in TIMESTAMP_FIELDS }
+            mask = lambda values, bits: [ v & bits for v in values ]
+
+        def sub(a, b, bits):
+            if np is not None:
+                return mask(a - b, bits)
+            return mask([ x - y for x, y in zip(a, b) ], bits)
+
+        total = sub(ts['egress_global'], ts['ingress_global'], GLOBAL_TS_MASK)
+        ingress = sub(ts['enqueue'], ts['ingress_global'], TM_TS_MASK)
+        queueing = ts['dequeue_delta']
+        pipeline = sub(total, queueing, GLOBAL_TS_MASK)
+        egress = sub(pipeline, ingress, GLOBAL_TS_MASK)
+
+        return {
+            'mac_to_ingress': sub(ts['ingress_global'], ts['ingress_mac'], GLOBAL_TS_MASK),
+            'ingress_pipeline': ingress,
+            'queueing': queueing,
+            'egress_pipeline': egress,
+            'pipeline': pipeline,
+            'total': total,
+        }
+
+    def add(self, stamps):
+        """
+        Account for a batch of packets, a dict of trailer field to values.
+        Its 'skipped' count, the packets RingCapture.timestamps dropped for
+        lack of a trailer, adds to skipped.
+        """
+        n = len(stamps[TIMESTAMP_FIELDS[0]])
+        skipped = stamps.get('skipped', 0)
+        if not n and not skipped:
+            return
+
+        with self._lock:
+            if n:
+                for stage, values in self.stages(stamps).items():
+                    self.histograms[stage].record_many(values)
+            self.packets += n
+            self.skipped += skipped
+
+        if self.period is not None and time.monotonic() - self._last_export >= self.period:
+            self.export()
+
+    def report(self):
+        """
+        Dict of stage to the stats() of its histogram, plus the packet count
+        and the packets skipped without a trailer.
+        """
+        with self._lock:
+            report = { stage: histogram.stats() for stage, histogram in self.histograms.items() }
+            report['packets'] = self.packets
+            report['skipped'] = self.skipped
+        return report
+
+    def reset(self):
+        with self._lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
+            self.packets = 0
+            self.skipped = 0
+
+    def export(self):
+        """Hand the current report to every callback."""
+        self._last_export = time.monotonic()
+        report = self.report()
+
+        with self._lock:
+            callbacks = list(self._callbacks)
+
+        for callback in callbacks:
+            try:
+                callback(report)
+            except Exception:
+                self.logger.exception('Latency callback failed')
+
+        return report
+
+    def write_json(self, f):
+        json.dump(self.report(), f, indent=2)
+        f.write('\n')
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Export every period seconds on a background thread."""
+        assert self.period is not None
+        assert self._thread is None, 'exporter already running'
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='LatencyStats', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        next_export = time.monotonic() + self.period
+        while not self._stop.wait(max(0.0, next_export - time.monotonic())):
+            self.export()
+            next_export += self.period
@@ -0,0 +1,270 @@
+import bisect
+import logging
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bfutil.Pktgen import PktgenTrigger
+
+# seconds, from a fast local write to a slow table dump
+RPC_BUCKETS = ( 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                0.1, 0.25, 0.5, 1.0, 2.5 )
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+class Histogram():
+    """Prometheus style histogram: cumulative counts under fixed bucket bounds."""
+
+    def __init__(self, buckets=RPC_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [ 0 ] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """List of (upper bound, observations at or under it), +Inf last."""
+        result = []
+        seen = 0
+        for bound, n in zip(self.buckets + (float('inf'), ), self.counts):
+            seen += n
+            result.append((bound, seen))
+        return result
+
+class RpcMetrics():
+    """
+    Observer for InstrumentedTable: a Histogram of RPC wall time per table
+    and operation.
+
+        rpc_metrics = RpcMetrics()
+        pktgen = Pktgen(client, InstrumentedBfrtInfo(bfrt_info, [ rpc_metrics ]))
+    """
+
+    def __init__(self, buckets=RPC_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            histogram = self.histograms.get((record.table, record.op))
+            if histogram is None:
+                histogram = self.histograms[(record.table, record.op)] = Histogram(self.buckets)
+            histogram.observe(record.seconds)
+
+    def snapshot(self):
+        """Dict of (table, op) to (cumulative buckets, count, sum)."""
+        with self._lock:
+            return {
+                key: (histogram.cumulative(), histogram.count, histogram.sum)
+                for key, histogram in self.histograms.items()
+            }
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in labels) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def configured_pps(config):
+    """The rate a PktgenConfig asks of a periodic app, None if unbounded."""
+    cfg = config.get_config()
+    if not cfg['timer_nanosec']:
+        return None
+    return cfg['packets_per_batch_cfg'] * cfg['batch_count_cfg'] * 1e9 / cfg['timer_nanosec']
+
+class MetricsExporter():
+    """
+    Serves pktgen counters and controller RPC timings over HTTP for
+    Prometheus, in its text format or in OpenMetrics if the scraper asks
+    for it.
+
+    Scrapes never reach the switch: the counters come from the RateSamples
+    of a CounterPoller, taken as a snapshot at each poll and served as is
+    until the next one, and the RPC histograms from an RpcMetrics, which
+    only lives in memory.
+
+        rpc_metrics = RpcMetrics()
+        pktgen = Pktgen(client, InstrumentedBfrtInfo(bfrt_info, [ rpc_metrics ]))
+        poller = CounterPoller(pktgen, period=1.0)
+        with MetricsExporter(poller, pktgen, rpc_metrics, port=9100):
+            poller.start()
+            ...
+
+    Exported families:
+        pktgen_packets, pktgen_batches, pktgen_triggers   counters per app
+        pktgen_tx_pps, pktgen_tx_bps                      rates per app
+        pktgen_configured_pps                             what a periodic app's config asks for
+        pktgen_snapshot_timestamp_seconds                 unix time of the last poll
+        bfrt_rpc_duration_seconds                         histogram per table and op
+    """
+
+    def __init__(self, poller=None, pktgen=None, rpc_metrics=None, addr='', port=9100):
+        self.poller = poller
+        self.pktgen = pktgen
+        self.rpc_metrics = rpc_metrics
+        self.addr = addr
+        self.port = port
+        self.logger = logging.getLogger('MetricsExporter')
+
+        self.snapshot = None
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def _app_labels(self, key):
+        if isinstance(key, tuple):
+            pipe, app_id = key
+        else:
+            pipe, app_id = 'all', key
+        return [ ('app', app_id), ('pipe', pipe) ]
+
+    def update(self, samples):
+        """
+        Take a snapshot of samples, a dict of app key to RateSample; called
+        by the poller after every poll. Only periodic apps get a configured
+        rate: the timer of one-shot and event apps does not pace them.
+        """
+        configured = {}
+        if self.pktgen is not None:
+            for key in samples:
+                app = getattr(self.pktgen, 'apps', {}).get(key)
+                if app is not None and app['trigger'] == PktgenTrigger.PERIODIC:
+                    configured[key] = configured_pps(app['config'])
+
+        with self._lock:
+            self.snapshot = (time.time(), dict(samples), configured)
+
+    def render(self, openmetrics=False):
+        """The metrics text, from the last snapshot and the RPC histograms."""
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            # Prometheus text names counters by their sample, OpenMetrics
+            # by the family without _total
+            family_name = name if openmetrics or kind != 'counter' else name + '_total'
+            lines.append('# HELP {} {}'.format(family_name, help_text))
+            lines.append('# TYPE {} {}'.format(family_name, kind))
+            for suffix, labels, value in samples:
+                lines.append('{}{}{} {}'.format(name, suffix, _labels(labels), _number(value)))
+
+        with self._lock:
+            snapshot = self.snapshot
+
+        if snapshot is not None:
+            timestamp, samples, configured = snapshot
+            keys = sorted(samples, key=str)
+
+            for name, field, help_text in (
+                ('pktgen_packets', 'pkt_counter', 'Packets sent by the app.'),
+                ('pktgen_batches', 'batch_counter', 'Batches sent by the app.'),
+                ('pktgen_triggers', 'trigger_counter', 'Times the app was triggered.'),
+            ):
+                family(name, 'counter', help_text, [
+                    ('_total', self._app_labels(key), getattr(samples[key], field)) for key in keys
+                ])
+
+            family('pktgen_tx_pps', 'gauge', 'Packets per second over the poller window.', [
+                ('', self._app_labels(key), samples[key].pps) for key in keys
+            ])
+            family('pktgen_tx_bps', 'gauge', 'Bits per second over the poller window.', [
+                ('', self._app_labels(key), samples[key].bps) for key in keys
+            ])
+            family('pktgen_configured_pps', 'gauge', 'Packets per second the app is configured for.', [
+                ('', self._app_labels(key), configured[key])
+                for key in keys if configured.get(key) is not None
+            ])
+            family('pktgen_snapshot_timestamp_seconds', 'gauge', 'Unix time of the last counter poll.', [
+                ('', [], timestamp)
+            ])
+
+        if self.rpc_metrics is not None:
+            samples = []
+            for (table, op), (buckets, count, total) in sorted(self.rpc_metrics.snapshot().items()):
+                labels = [ ('table', table), ('op', op) ]
+                for bound, n in buckets:
+                    samples.append(('_bucket', labels + [ ('le', _number(bound)) ], n))
+                samples.append(('_count', labels, count))
+                samples.append(('_sum', labels, total))
+
+            family('bfrt_rpc_duration_seconds', 'histogram', 'Wall time of bfrt RPCs.', samples)
+
+        if openmetrics:
+            lines.append('# EOF')
+
+        return '\n'.join(lines) + '\n'
+
+    def _handler(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+
+                openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+                body = exporter.render(openmetrics).encode()
+
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                exporter.logger.debug(fmt % args)
+
+        return Handler
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Serve /metrics on a background thread."""
+        assert self._server is None, 'exporter already running'
+
+        if self.poller is not None:
+            self.poller.add_callback(self.update)
+
+        self._server = ThreadingHTTPServer((self.addr, self.port), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MetricsExporter',
+                                        daemon=True)
+        self._thread.start()
+
+        self.logger.info('Serving metrics on port {}'.format(self.port))
+
+    def stop(self):
+        if self._server is None:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+        if self.poller is not None:
+            self.poller.remove_callback(self.update)
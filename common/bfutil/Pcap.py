@@ -0,0 +1,315 @@
+import logging
+import mmap
+import struct
+import time
+import weakref
+
+from collections import namedtuple
+
+from bfutil.Pktgen import PktgenConfig, PktgenTrigger
+from bfutil.Rate import wire_bits, ETH_FCS_LEN
+
+LINKTYPE_ETHERNET = 1
+
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_OPT_IF_TSRESOL = 9
+
+# packets packed per write
+WRITE_CHUNK = 4096
+
+def _pad4(n):
+    return (4 - n % 4) % 4
+
+def _stamped(packets, timestamps):
+    if timestamps is None:
+        now = time.time_ns()
+        return ((now, pkt) for pkt in packets)
+    return zip(timestamps, packets)
+
+def write_pcap(f, packets, timestamps=None, snaplen=65535, linktype=LINKTYPE_ETHERNET):
+    """
+    Write packets (bytes-like, e.g. from iter_pkt_buffer) to the binary
+    file f as a nanosecond pcap. timestamps are in ns, the current time by
+    default. Returns the number of packets written.
+    """
+    f.write(struct.pack('<IHHiIII', PCAP_MAGIC_NSEC, 2, 4, 0, 0, snaplen, linktype))
+
+    n = 0
+    parts = []
+    for ts, pkt in _stamped(packets, timestamps):
+        caplen = min(len(pkt), snaplen)
+        parts.append(struct.pack('<IIII', ts // 1000000000, ts % 1000000000, caplen, len(pkt)))
+        parts.append(pkt[:caplen])
+        n += 1
+
+        if len(parts) >= 2 * WRITE_CHUNK:
+            f.write(b''.join(parts))
+            parts = []
+
+    f.write(b''.join(parts))
+    return n
+
+def write_pcapng(f, packets, timestamps=None, snaplen=65535, linktype=LINKTYPE_ETHERNET):
+    """
+    Same as write_pcap, in pcapng: one section with a single interface with
+    nanosecond timestamps and an enhanced packet block per packet.
+    """
+    f.write(struct.pack('<IIIHHqI', PCAPNG_SHB, 28, PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1, 28))
+
+    options = struct.pack('<HHB3x', PCAPNG_OPT_IF_TSRESOL, 1, 9) + struct.pack('<HH', 0, 0)
+    idb_len = 20 + len(options)
+    f.write(struct.pack('<IIHHI', PCAPNG_IDB, idb_len, linktype, 0, snaplen) + options
+            + struct.pack('<I', idb_len))
+
+    n = 0
+    parts = []
+    for ts, pkt in _stamped(packets, timestamps):
+        caplen = min(len(pkt), snaplen)
+        pad = _pad4(caplen)
+        block_len = 32 + caplen + pad
+
+        parts.append(struct.pack('<IIIIIII', PCAPNG_EPB, block_len, 0, ts >> 32, ts & 0xFFFFFFFF,
+                                 caplen, len(pkt)))
+        parts.append(pkt[:caplen])
+        parts.append(b'\x00' * pad + struct.pack('<I', block_len))
+        n += 1
+
+        if len(parts) >= 3 * WRITE_CHUNK:
+            f.write(b''.join(parts))
+            parts = []
+
+    f.write(b''.join(parts))
+    return n
+
+class PcapFile():
+    """
+    A pcap or pcapng file, memory-mapped so captures of any size are read
+    without loading them. Packets come out as bytes copied from the map,
+    like RingCapture.packets, so they outlive the file; close() ends the
+    iterations still going.
+
+        with PcapFile('trace.pcapng') as pcap:
+            for ts_ns, pkt in pcap:
+                ...
+
+    Only the first section of a pcapng file is read, and the simple packet
+    blocks in it get no timestamp (None).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.logger = logging.getLogger('PcapFile')
+        self.file = None
+        self.map = None
+        self._iterators = weakref.WeakSet()
+
+    def open(self):
+        self.file = open(self.path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def close(self):
+        for iterator in list(self._iterators):
+            iterator.close()
+        self._iterators.clear()
+
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        magic = struct.unpack_from('<I', self.map)[0]
+        iterator = self._pcapng() if magic == PCAPNG_SHB else self._pcap()
+        self._iterators.add(iterator)
+        return iterator
+
+    def _pcap(self):
+        for endian in ('<', '>'):
+            magic = struct.unpack_from(endian + 'I', self.map)[0]
+            if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+                break
+        else:
+            raise ValueError('{} is not a pcap file'.format(self.path))
+
+        scale = 1 if magic == PCAP_MAGIC_NSEC else 1000
+        record = struct.Struct(endian + 'IIII')
+
+        pos = 24
+        while pos + record.size <= len(self.map):
+            sec, frac, caplen, _ = record.unpack_from(self.map, pos)
+            pos += record.size
+            yield sec * 1000000000 + frac * scale, self.map[pos:pos + caplen]
+            pos += caplen
+
+    def _pcapng(self):
+        endian = '<' if struct.unpack_from('<I', self.map, 8)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+        header = struct.Struct(endian + 'II')
+
+        # ns per timestamp unit of each interface, as (numerator, denominator)
+        units = []
+
+        pos = 0
+        while pos + header.size <= len(self.map):
+            block_type, block_len = header.unpack_from(self.map, pos)
+            if block_len < 12:
+                raise ValueError('bad pcapng block at {}'.format(pos))
+
+            if block_type == PCAPNG_SHB and pos:
+                return
+
+            if block_type == PCAPNG_IDB:
+                units.append(self._tsresol(self.map[pos + 16:pos + block_len - 4], endian))
+
+            elif block_type == PCAPNG_EPB:
+                iface, high, low, caplen, _ = struct.unpack_from(endian + 'IIIII', self.map, pos + 8)
+                if iface >= len(units):
+                    raise ValueError('pcapng packet at {} refers to interface {} before its description'.format(
+                        pos, iface))
+                num, den = units[iface]
+                yield ((high << 32) | low) * num // den, self.map[pos + 28:pos + 28 + caplen]
+
+            elif block_type == PCAPNG_SPB:
+                orig_len = struct.unpack_from(endian + 'I', self.map, pos + 8)[0]
+                caplen = min(orig_len, block_len - 16)
+                yield None, self.map[pos + 12:pos + 12 + caplen]
+
+            pos += block_len
+
+    def _tsresol(self, options, endian):
+        pos = 0
+        while pos + 4 <= len(options):
+            code, length = struct.unpack_from(endian + 'HH', options, pos)
+            if code == 0:
+                break
+            if code == PCAPNG_OPT_IF_TSRESOL:
+                value = options[pos + 4]
+                if value & 0x80:
+                    return 10 ** 9, 1 << (value & 0x7F)
+                return 10 ** 9, 10 ** value
+            pos += 4 + length + _pad4(length)
+
+        # microseconds unless told otherwise
+        return 1000, 1
+
+TrafficTemplate = namedtuple('TrafficTemplate', [
+    'packet',           # bytes of the representative packet, without FCS
+    'weight',           # share of the packets of the profile
+    'count',            # packets of the capture in its class
+    'protocol',         # 'tcp', 'udp', 'icmp', 'ipv4', 'ipv6', 'arp' or the ethertype
+    'size',             # upper bound of its size bin
+])
+
+SIZE_BINS = [ 64, 128, 256, 512, 1024, 1518, 9216 ]
+
+def packet_protocol(pkt):
+    """Rough protocol class of an Ethernet frame, for template selection."""
+    if len(pkt) < 14:
+        return 'short'
+
+    ethertype = struct.unpack_from('!H', pkt, 12)[0]
+    offset = 14
+    while ethertype in (0x8100, 0x88a8) and len(pkt) >= offset + 4:
+        ethertype = struct.unpack_from('!H', pkt, offset + 2)[0]
+        offset += 4
+
+    if ethertype == 0x0800 and len(pkt) > offset + 9:
+        return { 6: 'tcp', 17: 'udp', 1: 'icmp' }.get(pkt[offset + 9], 'ipv4')
+    if ethertype == 0x86dd and len(pkt) > offset + 6:
+        return { 6: 'tcp', 17: 'udp', 58: 'icmp' }.get(pkt[offset + 6], 'ipv6')
+    if ethertype == 0x0806:
+        return 'arp'
+    return '0x{:04x}'.format(ethertype)
+
+def pick_templates(packets, max_templates=8, min_len=60, max_len=None):
+    """
+    Reduce a stream of packets (e.g. a PcapFile) to at most max_templates
+    representative ones. Packets are classed by protocol and size bin
+    (SIZE_BINS, frame size with FCS); the most frequent classes are kept,
+    each represented by its first packet of the median size seen, and
+    weighted by their share of the kept packets.
+
+    Packets shorter than min_len (without FCS) are padded, those longer
+    than max_len are skipped.
+    """
+    classes = {}
+
+    for _, pkt in packets:
+        if max_len is not None and len(pkt) > max_len:
+            continue
+
+        frame_size = max(len(pkt), min_len) + ETH_FCS_LEN
+        size = next((b for b in SIZE_BINS if frame_size <= b), SIZE_BINS[-1])
+        key = (packet_protocol(pkt), size)
+
+        entry = classes.get(key)
+        if entry is None:
+            # the first packet of every length seen in the class
+            entry = classes[key] = { 'count': 0, 'lengths': {} }
+        entry['count'] += 1
+        if len(pkt) not in entry['lengths']:
+            entry['lengths'][len(pkt)] = [ bytes(pkt), 0 ]
+        entry['lengths'][len(pkt)][1] += 1
+
+    kept = sorted(classes.items(), key=lambda item: -item[1]['count'])[:max_templates]
+    total = sum(entry['count'] for _, entry in kept)
+
+    templates = []
+    for (protocol, size), entry in kept:
+        # median length of the class
+        lengths = sorted(entry['lengths'].items())
+        seen = 0
+        for length, (pkt, n) in lengths:
+            seen += n
+            if 2 * seen >= entry['count']:
+                break
+
+        pkt = pkt + b'\x00' * max(0, min_len - len(pkt))
+        templates.append(TrafficTemplate(pkt, entry['count'] / total, entry['count'], protocol, size))
+
+    return templates
+
+def replay_profile(pktgen, templates, pps=None, gbps=None, ports=range(68, 72), first_app_id=0,
+                   pipe=None, trigger=PktgenTrigger.PERIODIC, port_gbps=100):
+    """
+    Program one app per template, sending its packet at its weight's share
+    of the aggregate rate: pps packets per second, or gbps on the wire.
+    Apps go round robin over ports, app ids from first_app_id, on pipe (all
+    pipes by default). Returns the app keys, the set_apps report and the
+    RatePlan of each app.
+    """
+    assert (pps is None) != (gbps is None), 'give either pps or gbps'
+    assert first_app_id + len(templates) <= 8, 'only 8 apps per pipe'
+
+    weights = sum(t.weight for t in templates)
+    if gbps is not None:
+        bits = sum(t.weight / weights * wire_bits(len(t.packet) + ETH_FCS_LEN) for t in templates)
+        pps = gbps * 1e9 / bits
+
+    apps = []
+    plans = []
+    for i, template in enumerate(templates):
+        config = PktgenConfig()
+        config.set_packet(template.packet)
+        plans.append(config.set_rate(pps * template.weight / weights, port_gbps=port_gbps))
+        apps.append((first_app_id + i, ports[i % len(ports)], config, trigger, pipe))
+
+    report = pktgen.set_apps(apps)
+    keys = [ pktgen._app_key(app[0], pipe) for app in apps ]
+
+    return [ key for key in keys if key in pktgen.apps ], report, plans
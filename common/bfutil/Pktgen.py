@@ -1,6 +1,10 @@
+import copy
 import logging
+import time
 
-from bfutil.util import simple_eth_pkt
+from bfutil.util import PktBufferCache
+from bfutil.Rate import solve_rate, line_rate_pps, wire_bits, ETH_FCS_LEN
+from bfutil.Shadow import ShadowState, data_tuples
 from bfutil.Table import Table
 
 from pprint import pprint, pformat
@@ -16,7 +20,10 @@ class PktgenConfig():
         self.cfg = {
             'timer_nanosec': 1000000000,
             'pkt_len': 100,
-            'pkt_buffer_offset': 144,
+            # None lets Pktgen pick a free region of the packet buffer
+            'pkt_buffer_offset': None,
+            # None sends the default Ethernet/IPv4/UDP packet
+            'pkt_buffer': None,
             'increment_source_port': True,
             'batch_count_cfg': 1,
             'packets_per_batch_cfg': 1,
@@ -24,6 +31,15 @@ class PktgenConfig():
             'ibg_jitter': 0,
             'ipg': 0,
             'ipg_jitter': 0,
+
+            # fields of the event triggers, see TRIGGER_FIELDS
+            'port_mask_sel': 0,
+            'pattern_value': 0,
+            'pattern_mask': 0,
+            'pfc_hdr': bytes(16),
+            'pfc_timer_enable': False,
+            'pfc_timer': 0,
+            'pfc_max_msgs': 0,
         }
     
     def get_config(self):
@@ -43,10 +59,26 @@ class PktgenConfig():
     
     def get_packet_length(self):
         return self.cfg['pkt_len']
-        
+    
     def set_packet_length(self, pkt_len):
         self.cfg['pkt_len'] = pkt_len
-    
+        if self.cfg['pkt_buffer'] is not None and len(self.cfg['pkt_buffer']) != pkt_len:
+            # a custom packet is cut or zero padded to the new length
+            self.cfg['pkt_buffer'] = self.cfg['pkt_buffer'][:pkt_len].ljust(pkt_len, b'\x00')
+
+    def set_packet(self, pkt):
+        """
+        Send pkt (bytes, without FCS) instead of the default packet. The
+        packet length follows; pktgen replaces its first 6 bytes with its
+        header.
+        """
+        assert len(pkt) > 6
+        self.cfg['pkt_buffer'] = bytes(pkt)
+        self.cfg['pkt_len'] = len(pkt)
+
+    def get_packet(self):
+        return self.cfg['pkt_buffer']
+
     def get_pkt_buffer_offset(self):
         return self.cfg['pkt_buffer_offset']
     
@@ -60,6 +92,76 @@ class PktgenConfig():
         batch_frequency = int(1e9 * packets_per_batch * batch_count_cfg / pps)
         self.cfg['timer_nanosec'] = batch_frequency
     
+    def set_rate_plan(self, plan):
+        self.cfg['packets_per_batch_cfg'] = plan.packets_per_batch
+        self.cfg['batch_count_cfg'] = plan.batch_count
+        self.cfg['timer_nanosec'] = plan.timer_nanosec
+        self.cfg['ipg'] = plan.ipg
+        self.cfg['ibg'] = plan.ibg
+        self.cfg['ipg_jitter'] = 0
+        self.cfg['ibg_jitter'] = 0
+
+    def set_rate(self, pps=None, gbps=None, port_gbps=100, **kwargs):
+        """
+        Program the rate with solve_rate, for the current packet length.
+        Unlike set_timer_given_pps this also sets the batch sizes and
+        ipg/ibg. Returns the RatePlan, with the achieved rate and error.
+        """
+        plan = solve_rate(self.cfg['pkt_len'] + ETH_FCS_LEN, port_gbps, pps, gbps, **kwargs)
+        self.set_rate_plan(plan)
+        return plan
+
+    def set_port_down_mask(self, port_mask_sel):
+        """
+        For PORT_DOWN apps: which of the two port masks (Pktgen.set_port_mask)
+        selects the ports whose link going down triggers the app.
+        """
+        self.cfg['port_mask_sel'] = port_mask_sel
+
+    def set_pattern(self, value, mask=0xFFFFFFFF):
+        """
+        For RECIRCULATION and DEPARSER apps: the app triggers on a
+        recirculated packet (or deparser pktgen header) whose first 32 bits
+        match value under mask.
+        """
+        self.cfg['pattern_value'] = value
+        self.cfg['pattern_mask'] = mask
+
+    def set_pfc(self, pfc_hdr, timer=None, max_msgs=0):
+        """
+        For PFC apps: the 16 byte PFC header to match, and optionally the
+        pause timer (in quanta) after which the app triggers again, up to
+        max_msgs times.
+        """
+        self.cfg['pfc_hdr'] = bytes(pfc_hdr)
+        self.cfg['pfc_timer_enable'] = timer is not None
+        self.cfg['pfc_timer'] = timer or 0
+        self.cfg['pfc_max_msgs'] = max_msgs
+
+    def validate(self, trigger):
+        """
+        Raise ValueError if the config does not fit the app_cfg fields of
+        trigger.
+        """
+        assert isinstance(trigger, PktgenTrigger)
+
+        for name in TRIGGER_FIELDS[trigger]:
+            value = self.cfg[name]
+            bits = TRIGGER_FIELD_BITS[name]
+
+            if isinstance(value, (bytes, bytearray)):
+                if len(value) * 8 != bits:
+                    raise ValueError('{} needs {} bytes for {}, not {}'.format(
+                        name, bits // 8, trigger.name, len(value)))
+            elif not isinstance(value, bool) and not 0 <= value < 1 << bits:
+                raise ValueError('{} {} does not fit in {} bits for {}'.format(
+                    name, value, bits, trigger.name))
+
+        if trigger in (PktgenTrigger.RECIRCULATION, PktgenTrigger.DEPARSER) and \
+                self.cfg['pattern_value'] & ~self.cfg['pattern_mask']:
+            raise ValueError('pattern_value 0x{:x} has bits outside pattern_mask 0x{:x}'.format(
+                self.cfg['pattern_value'], self.cfg['pattern_mask']))
+
     def set_max_throughput(self):
         self.cfg['timer_nanosec'] = 0
         self.cfg['ibg'] = 0
@@ -67,37 +169,63 @@ class PktgenConfig():
         self.cfg['ipg'] = 0
         self.cfg['ipg_jitter'] = 0
     
-    def _build_table_data(self, local_port):
-        return [
-            gc.DataTuple('timer_nanosec', self.cfg['timer_nanosec']),
-            gc.DataTuple('app_enable', bool_val=False),
-            gc.DataTuple('pkt_len', self.cfg['pkt_len'] - 6),
-            gc.DataTuple('pkt_buffer_offset', self.cfg['pkt_buffer_offset']),
-            gc.DataTuple('pipe_local_source_port', local_port),
-            gc.DataTuple('increment_source_port', bool_val=self.cfg['increment_source_port']),
-            gc.DataTuple('batch_count_cfg', self.cfg['batch_count_cfg'] - 1),
-            gc.DataTuple('packets_per_batch_cfg', self.cfg['packets_per_batch_cfg'] - 1),
-            gc.DataTuple('ibg', self.cfg['ibg']),
-            gc.DataTuple('ibg_jitter', self.cfg['ibg_jitter']),
-            gc.DataTuple('ipg', self.cfg['ipg']),
-            gc.DataTuple('ipg_jitter', self.cfg['ipg_jitter']),
+    def _build_table_fields(self, local_port, pkt_buffer_offset=None, trigger=None):
+        """
+        The app_cfg fields for trigger, the timer triggers by default: the
+        common ones plus those of TRIGGER_FIELDS[trigger].
+        """
+        if pkt_buffer_offset is None:
+            pkt_buffer_offset = self.cfg['pkt_buffer_offset']
+        assert pkt_buffer_offset is not None
+
+        if trigger is None:
+            trigger = PktgenTrigger.PERIODIC
+
+        fields = { name: self.cfg[name] for name in TRIGGER_FIELDS[trigger] }
+        fields.update({
+            'app_enable': False,
+            'pkt_len': self.cfg['pkt_len'] - 6,
+            'pkt_buffer_offset': pkt_buffer_offset,
+            'pipe_local_source_port': local_port,
+            'increment_source_port': self.cfg['increment_source_port'],
+            'batch_count_cfg': self.cfg['batch_count_cfg'] - 1,
+            'packets_per_batch_cfg': self.cfg['packets_per_batch_cfg'] - 1,
+            'ibg': self.cfg['ibg'],
+            'ibg_jitter': self.cfg['ibg_jitter'],
+            'ipg': self.cfg['ipg'],
+            'ipg_jitter': self.cfg['ipg_jitter'],
 
             # These counters will be incremented when pktgen is executing,
             # they probably should not be modified beforehand.
-            gc.DataTuple('batch_counter', 0),
-            gc.DataTuple('pkt_counter', 0),
-            gc.DataTuple('trigger_counter', 0)
-        ]
+            'batch_counter': 0,
+            'pkt_counter': 0,
+            'trigger_counter': 0,
+        })
+
+        return fields
+
+    def _build_table_data(self, local_port, pkt_buffer_offset=None, trigger=None):
+        return data_tuples(self._build_table_fields(local_port, pkt_buffer_offset, trigger))
 
 class PktgenTrigger(Enum):
     """
-    Types of trigger:
-        trigger_timer_one_shot
-        trigger_timer_periodic
-        trigger_port_down        TODO: confirm
-        trigger_recirc_pattern   TODO: confirm
-        trigger_dprsr            TODO: confirm
-        trigger_pfc              TODO: confirm
+    Types of trigger, the app_cfg actions:
+        trigger_timer_one_shot   once, timer_nanosec after the app is enabled
+        trigger_timer_periodic   every timer_nanosec
+        trigger_port_down        when a port of the port mask port_mask_sel
+                                 goes down; the port must then be re-armed
+                                 with Pktgen.clear_port_down
+        trigger_recirc_pattern   when a packet recirculated through a pktgen
+                                 port with recirculation enabled
+                                 (Pktgen.set_recirculation) matches
+                                 pattern_value/pattern_mask
+        trigger_dprsr            when the deparser emits a pktgen header
+                                 matching pattern_value/pattern_mask
+        trigger_pfc              on a PFC frame matching pfc_hdr, again every
+                                 pfc_timer if pfc_timer_enable, at most
+                                 pfc_max_msgs times
+
+    TRIGGER_FIELDS lists the fields of each, set through PktgenConfig.
     """
 
     ONE_SHOT = 'trigger_timer_one_shot'
@@ -107,43 +235,382 @@ class PktgenTrigger(Enum):
     DEPARSER = 'trigger_dprsr'
     PFC = 'trigger_pfc'
 
+# app_cfg fields of each trigger action, besides the common ones
+TRIGGER_FIELDS = {
+    PktgenTrigger.ONE_SHOT: ( 'timer_nanosec', ),
+    PktgenTrigger.PERIODIC: ( 'timer_nanosec', ),
+    PktgenTrigger.PORT_DOWN: ( 'port_mask_sel', ),
+    PktgenTrigger.RECIRCULATION: ( 'pattern_value', 'pattern_mask' ),
+    PktgenTrigger.DEPARSER: ( 'pattern_value', 'pattern_mask' ),
+    PktgenTrigger.PFC: ( 'pfc_hdr', 'pfc_timer_enable', 'pfc_timer', 'pfc_max_msgs' ),
+}
+
+TRIGGER_FIELD_BITS = {
+    'timer_nanosec': 32,
+    'port_mask_sel': 1,
+    'pattern_value': 32,
+    'pattern_mask': 32,
+    'pfc_hdr': 128,
+    'pfc_timer_enable': 1,
+    'pfc_timer': 16,
+    'pfc_max_msgs': 10,
+}
+
+# names the pktgen tables go by, depending on the SDE
+PKTGEN_TABLE_NAMES = {
+    'port_cfg': ( 'port_cfg', '$PKTGEN_PORT_CFG' ),
+    'app_cfg': ( 'app_cfg', '$PKTGEN_APPLICATION_CFG' ),
+    'pkt_buffer': ( 'pkt_buffer', '$PKTGEN_PKT_BUFFER' ),
+    'port_mask': ( 'port_mask', '$PKTGEN_PORT_MASK' ),
+}
+
+# app_cfg fields the hardware updates itself
+APP_CFG_COUNTERS = ( 'batch_counter', 'pkt_counter', 'trigger_counter' )
+
+class PktBufferExhausted(Exception):
+    pass
+
+class PktgenVerifyError(Exception):
+    pass
+
+# How Pktgen checks its writes:
+#   none      not at all, nor reads port_cfg before enabling a port the
+#             shadow does not know about
+#   shadow    reads the written entries back from the driver's software
+#             copy (from_hw=False), one entry_get per table and pipe, which
+#             catches writes the driver did not take as sent
+#   hardware  the same read from hardware (from_hw=True)
+# pkt_buffer is never read back, not every SDE supports it.
+VERIFY_NONE = 'none'
+VERIFY_SHADOW = 'shadow'
+VERIFY_HARDWARE = 'hardware'
+
+class PktBufferAllocator():
+    """
+    Tracks which byte ranges of the pktgen packet buffer are in use.
+
+    Every region has a set of owners (app ids) and an optional template
+    key. Owners asking for a region with a template that is already placed
+    share that region instead of getting a new one, so apps sending the
+    same packet use the buffer space once. Regions start on `alignment`
+    byte boundaries (16 bytes on Tofino) and never overlap.
+
+    The allocator only does the bookkeeping; Pktgen writes the buffer
+    contents and moves them when compact() relocates regions.
+    """
+
+    def __init__(self, size=16384, alignment=16):
+        self.size = size
+        self.alignment = alignment
+
+        # offset -> { 'size', 'owners', 'template' }
+        self.regions = {}
+        # owner -> offset
+        self.owners = {}
+        # template -> offset
+        self.templates = {}
+
+    def _span(self, size):
+        return (size + self.alignment - 1) // self.alignment * self.alignment
+
+    def holes(self):
+        """List of (offset, size) of every free range, in offset order."""
+        holes = []
+        pos = 0
+
+        for offset in sorted(self.regions):
+            if offset > pos:
+                holes.append((pos, offset - pos))
+            pos = offset + self._span(self.regions[offset]['size'])
+
+        if pos < self.size:
+            holes.append((pos, self.size - pos))
+
+        return holes
+
+    def free_bytes(self):
+        return sum(size for _, size in self.holes())
+
+    def offset_of(self, owner):
+        return self.owners.get(owner)
+
+    def users(self, offset):
+        return len(self.regions[offset]['owners'])
+
+    def _take(self, owner, offset, size, template):
+        region = self.regions.get(offset)
+        if region is None:
+            region = { 'size': size, 'owners': set(), 'template': template }
+            self.regions[offset] = region
+            if template is not None:
+                self.templates.setdefault(template, offset)
+
+        region['owners'].add(owner)
+        self.owners[owner] = offset
+        return offset
+
+    def alloc(self, owner, size, template=None):
+        """
+        Give owner a region of size bytes and return its offset. An owner
+        has a single region: any previous one it held is released.
+        """
+        assert size > 0
+
+        offset = self.owners.get(owner)
+        if offset is not None:
+            region = self.regions[offset]
+            if template is not None and region['template'] == template:
+                return offset
+
+        if template is not None and template in self.templates:
+            self.free(owner)
+            return self._take(owner, self.templates[template], size, template)
+
+        # Best fit: the smallest hole that takes the region, counting the
+        # space the owner is about to release
+        old = self._release(owner)
+        fits = [ hole for hole in self.holes() if hole[1] >= self._span(size) ]
+
+        if not fits:
+            self._restore(owner, old)
+            if self.free_bytes() >= self._span(size):
+                raise PktBufferExhausted(
+                    'packet buffer fragmented: {} bytes free but no hole of {}, '
+                    'compact it first'.format(self.free_bytes(), size))
+            raise PktBufferExhausted('no room for {} bytes in the packet buffer'.format(size))
+
+        offset, _ = min(fits, key=lambda hole: hole[1])
+        return self._take(owner, offset, size, template)
+
+    def reserve(self, owner, offset, size, template=None):
+        """
+        Give owner the region at a fixed offset. Fails if it is not aligned,
+        does not fit or overlaps a region with different contents.
+        """
+        assert size > 0
+
+        if offset % self.alignment:
+            raise ValueError('pkt_buffer_offset {} is not {} byte aligned'.format(
+                offset, self.alignment))
+        if offset + size > self.size:
+            raise PktBufferExhausted('region [{}, {}) is past the end of the packet buffer'.format(
+                offset, offset + size))
+
+        old = self._release(owner)
+
+        region = self.regions.get(offset)
+        if region is not None and template is not None \
+                and region['template'] == template and region['size'] == size:
+            return self._take(owner, offset, size, template)
+
+        end = offset + self._span(size)
+        for other, region in self.regions.items():
+            if other < end and offset < other + self._span(region['size']):
+                self._restore(owner, old)
+                raise ValueError('region [{}, {}) overlaps the one of {}'.format(
+                    offset, offset + size, sorted(region['owners'])))
+
+        return self._take(owner, offset, size, template)
+
+    def _release(self, owner):
+        offset = self.owners.pop(owner, None)
+        if offset is None:
+            return None
+
+        region = self.regions[offset]
+        region['owners'].discard(owner)
+
+        if not region['owners']:
+            del self.regions[offset]
+            if self.templates.get(region['template']) == offset:
+                del self.templates[region['template']]
+
+        return (offset, region)
+
+    def _restore(self, owner, old):
+        if old is None:
+            return
+        offset, region = old
+        self._take(owner, offset, region['size'], region['template'])
+
+    def free(self, owner):
+        """Release the region of owner. Returns False if it had none."""
+        return self._release(owner) is not None
+
+    def transfer(self, owner, new_owner):
+        """
+        Hand the region of owner over to new_owner, which releases the
+        region it held before. Returns the offset.
+        """
+        offset = self.owners[owner]
+        if self.owners.get(new_owner) == offset:
+            self._release(owner)
+            return offset
+
+        self._release(new_owner)
+
+        del self.owners[owner]
+        self.owners[new_owner] = offset
+
+        owners = self.regions[offset]['owners']
+        owners.discard(owner)
+        owners.add(new_owner)
+
+        return offset
+
+    def compact(self):
+        """
+        Slide every region down so all free space ends up in one hole at
+        the end of the buffer. Returns a dict of old offset to new offset
+        for the regions that moved; their contents must be rewritten.
+        """
+        moves = {}
+        pos = 0
+
+        for offset in sorted(self.regions):
+            if offset != pos:
+                moves[offset] = pos
+            pos += self._span(self.regions[offset]['size'])
+
+        self.regions = {
+            moves.get(offset, offset): region
+            for offset, region in self.regions.items()
+        }
+        self.owners = {
+            owner: moves.get(offset, offset)
+            for owner, offset in self.owners.items()
+        }
+        self.templates = {
+            template: moves.get(offset, offset)
+            for template, offset in self.templates.items()
+        }
+
+        return moves
+
 class Pktgen():
 
-    def __init__(self, client, bfrt_info):
+    def __init__(self, client, bfrt_info, num_pipes=4, verify=VERIFY_SHADOW):
+        assert verify in (VERIFY_NONE, VERIFY_SHADOW, VERIFY_HARDWARE)
+
         self.gc = client
         self.bfrt_info = bfrt_info
         self.logger = logging.getLogger('Pktgen')
+        self.num_pipes = num_pipes
+        self.verify = verify
+
+        # Apps programmed on every pipe are keyed by app_id, apps of a
+        # single pipe by (pipe, app_id). Every method taking an app_id and
+        # a pipe also takes one of these keys as app_id.
         self.apps = {}
 
+        # pkt_buffer contents already built, by packet length
+        self.templates = PktBufferCache()
+
+        # which part of the packet buffer each app uses
+        self.buffers = PktBufferAllocator()
+
+        # what was last written to port_cfg, app_cfg and pkt_buffer, so
+        # unchanged fields are not written again nor read back
+        self.shadow = ShadowState()
+
         self.logger.info("Setting up port_cfg table...")
-        self.port_cfg = self.bfrt_info.table_get("port_cfg")
+        self.port_cfg = self._table_get('port_cfg')
         
         self.logger.info("Setting up app_cfg table...")
-        self.app_cfg = self.bfrt_info.table_get("app_cfg")
+        self.app_cfg = self._table_get('app_cfg')
 
         self.logger.info("Setting up pkt_buffer table...")
-        self.pkt_buffer = self.bfrt_info.table_get("pkt_buffer")
+        self.pkt_buffer = self._table_get('pkt_buffer')
+
+        # only needed by port down triggers, looked up on first use
+        self.port_mask = None
+
+        # app_cfg action of each trigger this device has
+        actions = set(self.app_cfg.info.action_name_list_get())
+        self.trigger_actions = {}
+        for trigger in PktgenTrigger:
+            for action in (trigger.value, '$PKTGEN_' + trigger.value.upper()):
+                if action in actions:
+                    self.trigger_actions[trigger] = action
+
+    def _table_get(self, name):
+        """The pktgen table name, under whichever of PKTGEN_TABLE_NAMES the program has."""
+        for table_name in PKTGEN_TABLE_NAMES[name]:
+            try:
+                return self.bfrt_info.table_get(table_name)
+            except Exception:
+                continue
+        raise KeyError('no pktgen {} table, tried {}'.format(name, PKTGEN_TABLE_NAMES[name]))
+
+    def _target(self, pipe=None):
+        if pipe is None:
+            return gc.Target(device_id=0)
+
+        assert pipe in range(self.num_pipes)
+        return gc.Target(device_id=0, pipe_id=pipe)
+
+    def _app_key(self, app_id, pipe=None):
+        if pipe is None:
+            return app_id
+        return (pipe, app_id)
+
+    def _key_pipe(self, key):
+        return key[0] if isinstance(key, tuple) else None
+
+    def _check_scope(self, key, keys=None):
+        """
+        Raise ValueError if key would share its app_cfg entry with an app of
+        the other scope: an app on all pipes and one on a single pipe with
+        the same app_id program the same hardware app.
+        """
+        keys = self.apps if keys is None else keys
+        if isinstance(key, tuple):
+            clash = key[1] in keys
+        else:
+            clash = any(isinstance(other, tuple) and other[1] == key for other in keys)
+
+        if clash:
+            raise ValueError('app {} overlaps app_id {} already set in the other pipe scope'.format(
+                key, key[1] if isinstance(key, tuple) else key))
+
+    def _dev_port(self, local_port, pipe=None):
+        if pipe is None:
+            return local_port
+        return (pipe << 7) | local_port
     
-    def get_app_port(self, app_id):
-        assert app_id in self.apps.keys()
-        return self.apps[app_id]['source_port']
+    def get_app_port(self, app_id, pipe=None):
+        key = self._app_key(app_id, pipe)
+        assert key in self.apps.keys()
+        return self.apps[key]['source_port']
+
+    def get_app_packet_length(self, app_id, pipe=None):
+        key = self._app_key(app_id, pipe)
+        assert key in self.apps.keys()
+        return self.apps[key]['pkt_len']
+
+    def _get_pktgen_port_status(self, local_port, pipe=None, from_hw=False):
+        key_fields = { 'dev_port': self._dev_port(local_port, pipe) }
+
+        known = self.shadow.get('port_cfg', key_fields)
+        if not from_hw and known is not None and 'pktgen_enable' in known:
+            return known['pktgen_enable']
 
-    def _get_pktgen_port_status(self, local_port):
         target = gc.Target(device_id=0)
 
         resp = self.port_cfg.entry_get(
             target,
             [
-                self.port_cfg.make_key([ gc.KeyTuple('dev_port', local_port) ])
+                self.port_cfg.make_key([ gc.KeyTuple('dev_port', key_fields['dev_port']) ])
             ],
-            { "from_hw": False },
+            { "from_hw": from_hw },
             self.port_cfg.make_data([ gc.DataTuple("pktgen_enable")], get=True)
         )
 
         data_dict = next(resp)[0].to_dict()
+        self.shadow.update('port_cfg', key_fields, { 'pktgen_enable': data_dict["pktgen_enable"] })
         return data_dict["pktgen_enable"]
     
-    def _enable_pktgen_port(self, local_port):
+    def _enable_pktgen_port(self, local_port, pipe=None):
         """
         Given a pipe return a port in that pipe which is usable for packet
         generation.  Note that Tofino allows ports 68-71 in each pipe to be used for
@@ -156,8 +623,15 @@ class Pktgen():
         
         assert local_port in range(min_port, max_port + 1)
 
-        # Check if port is already enabled for pktgen
-        if self._get_pktgen_port_status(local_port):
+        key_fields = { 'dev_port': self._dev_port(local_port, pipe) }
+
+        # Check if port is already enabled for pktgen; without verification
+        # an unknown port is enabled rather than read
+        if self.verify == VERIFY_NONE:
+            known = self.shadow.get('port_cfg', key_fields)
+            if known is not None and known.get('pktgen_enable'):
+                return
+        elif self._get_pktgen_port_status(local_port, pipe):
             return
 
         target = gc.Target(device_id=0)
@@ -165,159 +639,1026 @@ class Pktgen():
         self.port_cfg.entry_add(
             target,
             [
-                self.port_cfg.make_key([ gc.KeyTuple('dev_port', local_port) ])
+                self.port_cfg.make_key([ gc.KeyTuple('dev_port', key_fields['dev_port']) ])
             ],
             [
                 self.port_cfg.make_data([ gc.DataTuple('pktgen_enable', bool_val=True)])
             ]
         )
+        self.shadow.update('port_cfg', key_fields, { 'pktgen_enable': True })
 
-        assert self._get_pktgen_port_status(local_port)
+        self._verify(self.port_cfg, 'port_cfg', target, [ (key_fields, { 'pktgen_enable': True }) ])
 
         return
-    
-    def _add_app(self, app_id, local_port, config, trigger):
-        assert isinstance(config, PktgenConfig)
-        assert isinstance(trigger, PktgenTrigger)
 
-        target = gc.Target(device_id=0)
-
-        table_data = config._build_table_data(local_port)
-        pktlen = config.get_packet_length()
-        pkt_buffer_offset = config.get_pkt_buffer_offset()
+    def _check_writes(self, table, table_name, target, entries, pipe=None):
+        """
+        Check entries, a list of (key fields, fields written), by reading
+        them back in one entry_get, from the driver or from hardware as the
+        verify level says. Our own ShadowState is never used here: it holds
+        what was just written, so it would always agree. Returns a dict of
+        entry index to the mismatches found.
+        """
+        if self.verify == VERIFY_NONE or not entries:
+            return {}
 
-        self.app_cfg.entry_add(
+        resp = table.entry_get(
             target,
             [
-                self.app_cfg.make_key([ gc.KeyTuple('app_id', app_id) ])
+                table.make_key([ gc.KeyTuple(name, value) for name, value in key_fields.items() ])
+                for key_fields, _ in entries
             ],
-            [
-                self.app_cfg.make_data(table_data, trigger.value)
-            ]
+            { "from_hw": self.verify == VERIFY_HARDWARE }
         )
+        found = [ data.to_dict() for data, _ in resp ]
 
-        # Configure pkt_buffer table
-        pkt = simple_eth_pkt(pktlen=pktlen)
+        mismatches = {}
+        for i, ((key_fields, fields), got) in enumerate(zip(entries, found)):
+            for name, value in fields.items():
+                if name in APP_CFG_COUNTERS or name == 'action_name':
+                    continue
 
-        self.pkt_buffer.entry_add(
-            target,
-            [
-                self.pkt_buffer.make_key([
-                    gc.KeyTuple('pkt_buffer_offset', pkt_buffer_offset),
-                    gc.KeyTuple('pkt_buffer_size', (pktlen - 6))
-                ])
-            ],
-            [
-                self.pkt_buffer.make_data([
-                    gc.DataTuple('buffer', bytearray(bytes(pkt)[6:]))
-                ])
-            ]
-        )
+                have = got.get(name)
+                if isinstance(value, (bytes, bytearray)) and have is not None:
+                    have = bytes(have)
+
+                if have != value:
+                    mismatches.setdefault(i, []).append('{} {} {}: wrote {!r}, found {!r}'.format(
+                        table_name, key_fields, name, value, have))
+
+        return mismatches
+
+    def _verify(self, table, table_name, target, entries, pipe=None):
+        """_check_writes, raising PktgenVerifyError on any mismatch."""
+        mismatches = self._check_writes(table, table_name, target, entries, pipe)
+        if mismatches:
+            raise PktgenVerifyError('; '.join(sum(mismatches.values(), [])))
     
-    def _set_app(self, app_id, local_port, config, trigger):
-        assert isinstance(config, PktgenConfig)
-        assert isinstance(trigger, PktgenTrigger)
+    def _place_buffer(self, key, config, owner=None):
+        """
+        Pick the region of the packet buffer the app `key` uses for config.
+        Returns the offset and whether the buffer must be written, which
+        is not the case when the app shares an identical template another
+        programmed app already wrote to the same pipes.
 
-        target = gc.Target(device_id=0)
+        The region is held by owner, key by default; a different owner
+        lets the app keep its current region until it switches over.
+        """
+        pktlen = config.get_packet_length()
+        template = self._template(config)
+        offset = config.get_pkt_buffer_offset()
+        owner = key if owner is None else owner
 
-        table_data = config._build_table_data(local_port)
+        if offset is None:
+            offset = self.buffers.alloc(owner, pktlen - 6, template)
+        else:
+            offset = self.buffers.reserve(owner, offset, pktlen - 6, template)
+
+        pipe = self._key_pipe(key)
+        for other in self.buffers.regions[offset]['owners']:
+            if other in (key, owner) or other not in self.apps:
+                continue
+            # apps of all pipes wrote the buffer everywhere
+            other_pipe = self._key_pipe(other)
+            if other_pipe is None or (pipe is not None and other_pipe == pipe):
+                return offset, False
+
+        # the same bytes may still be there from an earlier app
+        known = self.shadow.get('pkt_buffer', self._pkt_buffer_key_fields(offset, pktlen - 6), pipe)
+        if known is not None and known.get('template') == template:
+            return offset, False
+
+        return offset, True
+
+    def _buffer_owner(self, key, config):
+        """
+        Owner for _place_buffer, and what to restore if the writes fail. A
+        new app, or one asking for the offset it already has, holds its
+        region itself; a programmed app otherwise gets the new region under
+        (key, 'update') and keeps the old one until the writes succeed.
+        """
+        if key not in self.apps:
+            return key, None
+
+        app = self.apps[key]
+        offset = app['pkt_buffer_offset']
+        if config.get_pkt_buffer_offset() != offset:
+            return (key, 'update'), None
+        if self._template(config) == self._template(app['config']):
+            return key, None
+
+        return key, (offset, self.buffers.regions[offset]['size'])
+
+    def _keep_buffer(self, key, owner):
+        """The writes of key succeeded: it switches over to its new region."""
+        if owner != key:
+            self.buffers.transfer(owner, key)
+
+    def _drop_buffer(self, key, owner, previous):
+        """The writes of key failed: undo _place_buffer."""
+        if owner != key:
+            self.buffers.free(owner)
+        elif key not in self.apps:
+            self.buffers.free(key)
+        elif previous is not None:
+            # rewritten in place: the region holds the old bytes or the
+            # new ones, so it must not be shared as either template
+            offset, size = previous
+            self.buffers.reserve(key, offset, size)
+
+    def _app_cfg_fields(self, app_id, local_port, config, trigger, pkt_buffer_offset, pipe=None):
+        """
+        The app_cfg fields to write for app_id. An app the shadow knows,
+        with the same trigger, only gets the fields that changed and keeps
+        its counters; None means there is nothing to write.
+        """
+        fields = config._build_table_fields(local_port, pkt_buffer_offset, trigger)
+
+        if self._app_key(app_id, pipe) not in self.apps:
+            return fields
+
+        known = self.shadow.get('app_cfg', { 'app_id': app_id }, pipe)
+        if known is None or known.get('action_name') != self._action(trigger):
+            return fields
+
+        for counter in APP_CFG_COUNTERS:
+            del fields[counter]
+
+        return self.shadow.diff('app_cfg', { 'app_id': app_id }, fields, pipe) or None
+
+    def _record_app_cfg(self, app_id, trigger, fields, pipe=None):
+        # a write with the counters is a whole entry, anything else a change
+        replace = APP_CFG_COUNTERS[0] in fields
+
+        fields = { name: value for name, value in fields.items() if name not in APP_CFG_COUNTERS }
+        fields['action_name'] = self._action(trigger)
+        self.shadow.update('app_cfg', { 'app_id': app_id }, fields, pipe, replace)
+
+    def _app_cfg_entry(self, app_id, trigger, fields):
+        key = self.app_cfg.make_key([ gc.KeyTuple('app_id', app_id) ])
+        data = self.app_cfg.make_data(data_tuples(fields), self._action(trigger))
+        return key, data
+
+    def _pkt_buffer_key_fields(self, pkt_buffer_offset, pkt_buffer_size):
+        return {
+            'pkt_buffer_offset': pkt_buffer_offset,
+            'pkt_buffer_size': pkt_buffer_size,
+        }
+
+    def _check_trigger(self, trigger):
+        if trigger not in self.trigger_actions:
+            raise ValueError('app_cfg has no {} action on this device'.format(trigger.value))
+
+    def _action(self, trigger):
+        return self.trigger_actions.get(trigger, trigger.value)
+
+    def _template(self, config):
+        """
+        Key of the packet buffer contents of config: (pktlen, None) for the
+        default packet, (pktlen, packet bytes) for a custom one.
+        """
+        return (config.get_packet_length(), config.get_packet())
+
+    def _template_buffer(self, template):
+        pktlen, pkt = template
+        if isinstance(pkt, bytes):
+            return bytearray(pkt[6:])
+        return self.templates.get(pktlen, pkt)
+
+    def _pkt_buffer_entry(self, config, pkt_buffer_offset):
         pktlen = config.get_packet_length()
-        pkt_buffer_offset = config.get_pkt_buffer_offset()
 
-        self.app_cfg.entry_mod(
-            target,
-            [
-                self.app_cfg.make_key([ gc.KeyTuple('app_id', app_id) ])
-            ],
-            [
-                self.app_cfg.make_data(table_data, trigger.value)
-            ]
-        )
+        key = self.pkt_buffer.make_key([
+            gc.KeyTuple('pkt_buffer_offset', pkt_buffer_offset),
+            gc.KeyTuple('pkt_buffer_size', (pktlen - 6))
+        ])
+        data = self.pkt_buffer.make_data([
+            gc.DataTuple('buffer', self._template_buffer(self._template(config)))
+        ])
+        return key, data
 
-        # Configure pkt_buffer table
-        pkt = simple_eth_pkt(pktlen=pktlen)
+    def _record_pkt_buffer(self, pkt_buffer_offset, pkt_buffer_size, template, pipe=None):
+        # whatever was written over these bytes is gone
+        end = pkt_buffer_offset + pkt_buffer_size
+        for table, _, ident in list(self.shadow.entries):
+            if table != 'pkt_buffer':
+                continue
+            other = dict(ident)
+            if other['pkt_buffer_offset'] < end and \
+                    pkt_buffer_offset < other['pkt_buffer_offset'] + other['pkt_buffer_size']:
+                self.shadow.invalidate('pkt_buffer', other)
 
-        self.pkt_buffer.entry_add(
-            target,
-            [
-                self.pkt_buffer.make_key([
-                    gc.KeyTuple('pkt_buffer_offset', pkt_buffer_offset),
-                    gc.KeyTuple('pkt_buffer_size', (pktlen - 6))
-                ])
-            ],
-            [
-                self.pkt_buffer.make_data([
-                    gc.DataTuple('buffer', bytearray(bytes(pkt)[6:]))
-                ])
-            ]
-        )
+        self.shadow.update('pkt_buffer', self._pkt_buffer_key_fields(pkt_buffer_offset, pkt_buffer_size),
+                           { 'template': template }, pipe)
 
-    def set_app(self, app_id, local_port, config, trigger):
+    def _write_app(self, write, app_id, local_port, config, trigger, pkt_buffer_offset,
+                   write_buffer=True, pipe=None):
         assert isinstance(config, PktgenConfig)
         assert isinstance(trigger, PktgenTrigger)
 
-        target = gc.Target(device_id=0)
-        self._enable_pktgen_port(local_port)
-        
-        if app_id not in self.apps:
-            self._add_app(app_id, local_port, config, trigger)           
-        else:
-            self._set_app(app_id, local_port, config, trigger)
-        
-        self.apps[app_id] = {
+        target = self._target(pipe)
+
+        # the buffer goes first, so the app never points at a region
+        # that was not written
+        if write_buffer:
+            key, data = self._pkt_buffer_entry(config, pkt_buffer_offset)
+            self.pkt_buffer.entry_add(target, [ key ], [ data ])
+            pktlen = config.get_packet_length()
+            self._record_pkt_buffer(pkt_buffer_offset, pktlen - 6, self._template(config), pipe)
+
+        fields = self._app_cfg_fields(app_id, local_port, config, trigger, pkt_buffer_offset, pipe)
+        if fields is not None:
+            key, data = self._app_cfg_entry(app_id, trigger, fields)
+            write(target, [ key ], [ data ])
+            self._record_app_cfg(app_id, trigger, fields, pipe)
+            self._verify(self.app_cfg, 'app_cfg', target, [ ({ 'app_id': app_id }, fields) ], pipe)
+
+    def _add_app(self, app_id, local_port, config, trigger, pkt_buffer_offset,
+                 write_buffer=True, pipe=None):
+        self._write_app(self.app_cfg.entry_add, app_id, local_port, config, trigger,
+                        pkt_buffer_offset, write_buffer, pipe)
+    
+    def _set_app(self, app_id, local_port, config, trigger, pkt_buffer_offset,
+                 write_buffer=True, pipe=None):
+        self._write_app(self.app_cfg.entry_mod, app_id, local_port, config, trigger,
+                        pkt_buffer_offset, write_buffer, pipe)
+
+    def _register_app(self, app_id, pipe, local_port, config, trigger, pkt_buffer_offset):
+        self.apps[self._app_key(app_id, pipe)] = {
+            'app_id': app_id,
+            'pipe': pipe,
             'source_port': local_port,
             'trigger': trigger,
+            'pkt_len': config.get_packet_length(),
+            'pkt_buffer_offset': pkt_buffer_offset,
+            'config': copy.deepcopy(config),
+        }
+
+    def set_app(self, app_id, local_port, config, trigger, pipe=None):
+        """
+        Program app_id to send from local_port (68-71). Without a pipe the
+        app is programmed on every pipe; with one, only on that pipe.
+
+        Reprogramming an app writes only the app_cfg fields that differ
+        from the last write (stopping it if it runs, but keeping its
+        counters) and skips the packet buffer if it holds the same bytes.
+        """
+        assert isinstance(config, PktgenConfig)
+        assert isinstance(trigger, PktgenTrigger)
+
+        self._check_trigger(trigger)
+        config.validate(trigger)
+
+        key = self._app_key(app_id, pipe)
+        self._check_scope(key)
+        self._enable_pktgen_port(local_port, pipe)
+
+        owner, previous = self._buffer_owner(key, config)
+        pkt_buffer_offset, write_buffer = self._place_buffer(key, config, owner)
+
+        try:
+            if key not in self.apps:
+                self._add_app(app_id, local_port, config, trigger, pkt_buffer_offset, write_buffer, pipe)
+            else:
+                self._set_app(app_id, local_port, config, trigger, pkt_buffer_offset, write_buffer, pipe)
+        except Exception:
+            self._drop_buffer(key, owner, previous)
+            raise
+
+        self._keep_buffer(key, owner)
+        self._register_app(app_id, pipe, local_port, config, trigger, pkt_buffer_offset)
+
+    def update_app(self, app_id, config, pipe=None):
+        """
+        Change a programmed app to config without stopping it. Only the
+        app_cfg fields that differ from its current config are modified,
+        in a single entry_mod, so a running app keeps running and counting
+        and its traffic has no gap; app_enable and the counters are never
+        written. The trigger and source port stay as they are.
+
+        A new packet or length gets a new region of the packet buffer, written
+        before the app switches over to it, so the old packet keeps being
+        sent until then. The region the app is sending from cannot be
+        rewritten in place: a new packet with the app's current
+        pkt_buffer_offset raises ValueError (use set_app for that).
+
+        Returns the dict of fields that were modified.
+        """
+        assert isinstance(config, PktgenConfig)
+
+        key = self._app_key(app_id, pipe)
+        assert key in self.apps.keys()
+
+        app = self.apps[key]
+        app_id = app['app_id']
+        pipe = app['pipe']
+        target = self._target(pipe)
+
+        config.validate(app['trigger'])
+
+        old_fields = app['config']._build_table_fields(app['source_port'], app['pkt_buffer_offset'],
+                                                       app['trigger'])
+
+        pkt_buffer_offset = app['pkt_buffer_offset']
+        new_template = self._template(config) != self._template(app['config'])
+        if new_template and config.get_pkt_buffer_offset() == pkt_buffer_offset:
+            raise ValueError('update_app cannot rewrite the packet at pkt_buffer_offset {} while app {} '
+                             'sends it: leave the offset unset, pick another one or use set_app'.format(
+                                 pkt_buffer_offset, key))
+
+        if new_template or config.get_pkt_buffer_offset() not in (None, pkt_buffer_offset):
+            pkt_buffer_offset, write_buffer = self._place_buffer(key, config, owner=(key, 'update'))
+
+            if write_buffer:
+                try:
+                    buffer_key, buffer_data = self._pkt_buffer_entry(config, pkt_buffer_offset)
+                    self.pkt_buffer.entry_add(target, [ buffer_key ], [ buffer_data ])
+                except Exception:
+                    self.buffers.free((key, 'update'))
+                    raise
+
+                pktlen = config.get_packet_length()
+                self._record_pkt_buffer(pkt_buffer_offset, pktlen - 6, self._template(config), pipe)
+
+        new_fields = config._build_table_fields(app['source_port'], pkt_buffer_offset, app['trigger'])
+
+        fields = {
+            name: value for name, value in new_fields.items()
+            if name != 'app_enable' and name not in APP_CFG_COUNTERS and old_fields[name] != value
         }
+
+        if fields:
+            entry_key, entry_data = self._app_cfg_entry(app_id, app['trigger'], fields)
+            try:
+                self.app_cfg.entry_mod(target, [ entry_key ], [ entry_data ])
+            except Exception:
+                self.buffers.free((key, 'update'))
+                raise
+            self._record_app_cfg(app_id, app['trigger'], fields, pipe)
+
+        # the app uses the new region from here on, even if the check
+        # below fails
+        if pkt_buffer_offset != app['pkt_buffer_offset']:
+            self.buffers.transfer((key, 'update'), key)
+        else:
+            self.buffers.free((key, 'update'))
+
+        app['pkt_len'] = config.get_packet_length()
+        app['pkt_buffer_offset'] = pkt_buffer_offset
+        app['config'] = copy.deepcopy(config)
+
+        if fields:
+            self._verify(self.app_cfg, 'app_cfg', target, [ ({ 'app_id': app_id }, fields) ], pipe)
+
+        self.logger.info('Updated pktgen app {}: {}'.format(key, fields))
+
+        return fields
+
+    def set_app_rate(self, app_id, pps=None, gbps=None, port_gbps=100, pipe=None):
+        """
+        Change the rate of a programmed app while it runs, planned with
+        PktgenConfig.set_rate for its packet length. Returns the RatePlan.
+        """
+        key = self._app_key(app_id, pipe)
+        assert key in self.apps.keys()
+
+        config = copy.deepcopy(self.apps[key]['config'])
+        plan = config.set_rate(pps, gbps, port_gbps)
+        self.update_app(key, config)
+
+        return plan
+
+    def _batch_write(self, op, table, table_name, target, entries, errors):
+        """
+        Send every (label, key, data) in entries as a single write request.
+        Failed entries are appended to errors as (table_name, label, message)
+        and their labels are returned.
+        """
+        if not entries:
+            return set()
+
+        labels = [ label for label, _, _ in entries ]
+        write = table.entry_add if op == 'add' else table.entry_mod
+
+        try:
+            write(
+                target,
+                [ key for _, key, _ in entries ],
+                [ data for _, _, data in entries ]
+            )
+        except gc.BfruntimeRpcException as e:
+            entry_errors = getattr(e, 'errors', None)
+            if not entry_errors:
+                # the server did not say which entry failed
+                entry_errors = [ (idx, e) for idx in range(len(entries)) ]
+
+            failed = set()
+            for idx, err in entry_errors:
+                message = getattr(err, 'message', None) or str(err)
+                errors.append((table_name, labels[idx], message))
+                failed.add(labels[idx])
+
+            self.logger.error('{} {} failed for {}'.format(table_name, op, sorted(failed, key=str)))
+            return failed
+
+        return set()
+
+    def set_apps(self, apps):
+        """
+        Program several apps at once. apps is a list of
+        (app_id, local_port, config, trigger) or
+        (app_id, local_port, config, trigger, pipe) tuples, the same
+        arguments set_app takes.
+
+        Every port_cfg, app_cfg and pkt_buffer change is collected and sent
+        as one batched request per table (and per pipe, for pipe scoped
+        apps), instead of the 3 to 5 RPCs per app that set_app needs. A
+        failing entry does not abort the others; it is reported and its
+        app is left unregistered.
+
+        Returns a dict with:
+            'rpcs':        RPCs issued by this call
+            'legacy_rpcs': RPCs the same changes cost through set_app
+            'errors':      list of (table, app key or dev_port, message),
+                           writes that failed verification included
+        """
+        apps = [ tuple(app) + (None, ) * (5 - len(app)) for app in apps ]
+
+        for app_id, local_port, config, trigger, pipe in apps:
+            assert isinstance(config, PktgenConfig)
+            assert isinstance(trigger, PktgenTrigger)
+            assert local_port in range(68, 72)
+
+        keys = [ self._app_key(app[0], app[4]) for app in apps ]
+        assert len(keys) == len(set(keys)), 'duplicated app in set_apps'
+        for key in keys:
+            self._check_scope(key, list(self.apps) + keys)
+
+        target = gc.Target(device_id=0)
+        errors = []
+        rpcs = 0
+
+        # One read for the status of every port involved the shadow does
+        # not know about
+        ports = sorted(set(self._dev_port(app[1], app[4]) for app in apps))
+        disabled_ports = []
+        unknown_ports = []
+
+        for port in ports:
+            known = self.shadow.get('port_cfg', { 'dev_port': port })
+            if known is None or 'pktgen_enable' not in known:
+                unknown_ports.append(port)
+            elif not known['pktgen_enable']:
+                disabled_ports.append(port)
+
+        # without verification unknown ports are enabled rather than read
+        if self.verify == VERIFY_NONE:
+            disabled_ports += unknown_ports
+            unknown_ports = []
+
+        if unknown_ports:
+            resp = self.port_cfg.entry_get(
+                target,
+                [ self.port_cfg.make_key([ gc.KeyTuple('dev_port', port) ]) for port in unknown_ports ],
+                { "from_hw": False },
+                self.port_cfg.make_data([ gc.DataTuple("pktgen_enable")], get=True)
+            )
+            rpcs += 1
+
+            for data, key in resp:
+                port = key.to_dict()['dev_port']['value']
+                enabled = data.to_dict()['pktgen_enable']
+                self.shadow.update('port_cfg', { 'dev_port': port }, { 'pktgen_enable': enabled })
+                if not enabled:
+                    disabled_ports.append(port)
+
+        rpcs += bool(disabled_ports)
+        failed_ports = self._batch_write('add', self.port_cfg, 'port_cfg', target, [
+            (
+                port,
+                self.port_cfg.make_key([ gc.KeyTuple('dev_port', port) ]),
+                self.port_cfg.make_data([ gc.DataTuple('pktgen_enable', bool_val=True) ])
+            )
+            for port in disabled_ports
+        ], errors)
+
+        enabled_ports = [ port for port in disabled_ports if port not in failed_ports ]
+        for port in enabled_ports:
+            self.shadow.update('port_cfg', { 'dev_port': port }, { 'pktgen_enable': True })
+
+        rpcs += self.verify != VERIFY_NONE and bool(enabled_ports)
+        mismatches = self._check_writes(self.port_cfg, 'port_cfg', target, [
+            ({ 'dev_port': port }, { 'pktgen_enable': True }) for port in enabled_ports
+        ])
+        for i, messages in mismatches.items():
+            errors.append(('port_cfg', enabled_ports[i], '; '.join(messages)))
+            failed_ports.add(enabled_ports[i])
+
+        # set_app reads the port status for every app, enables (and reads
+        # back) each disabled port once, then writes app_cfg and pkt_buffer
+        legacy_rpcs = len(apps) * 3 + len(disabled_ports) * 2
+
+        apps = [ app for app in apps if self._dev_port(app[1], app[4]) not in failed_ports ]
+
+        # Place every buffer before writing anything
+        placed = []
+        owners = {}
+        for app_id, local_port, config, trigger, pipe in apps:
+            key = self._app_key(app_id, pipe)
+            try:
+                self._check_trigger(trigger)
+                config.validate(trigger)
+            except ValueError as e:
+                errors.append(('app_cfg', key, str(e)))
+                continue
+            try:
+                owner, previous = self._buffer_owner(key, config)
+                pkt_buffer_offset, write_buffer = self._place_buffer(key, config, owner)
+            except (PktBufferExhausted, ValueError) as e:
+                errors.append(('pkt_buffer', key, str(e)))
+                continue
+            owners[key] = (owner, previous)
+            placed.append((key, app_id, local_port, config, trigger, pipe, pkt_buffer_offset, write_buffer))
+
+        failed_apps = set()
+
+        for pipe in sorted(set(app[5] for app in placed), key=lambda pipe: -1 if pipe is None else pipe):
+            pipe_target = self._target(pipe)
+            pipe_apps = [ app for app in placed if app[5] == pipe ]
+
+            # Buffers go first, so no app points at a region that was not
+            # written; apps of this call sharing a template write it once
+            buffers = []
+            written = {}
+            for key, _, _, config, _, _, pkt_buffer_offset, write_buffer in pipe_apps:
+                if not write_buffer or pkt_buffer_offset in written:
+                    continue
+                written[pkt_buffer_offset] = (key, config)
+                buffers.append((key, ) + self._pkt_buffer_entry(config, pkt_buffer_offset))
+
+            rpcs += bool(buffers)
+            failed_buffers = self._batch_write('add', self.pkt_buffer, 'pkt_buffer', pipe_target, buffers, errors)
+
+            for pkt_buffer_offset, (key, config) in written.items():
+                if key not in failed_buffers:
+                    self._record_pkt_buffer(pkt_buffer_offset, config.get_packet_length() - 6,
+                                            self._template(config), pipe)
+
+            # apps sharing a buffer that could not be written fail with it
+            failed_offsets = { offset: key for offset, (key, _) in written.items() if key in failed_buffers }
+            for key, _, _, _, _, _, pkt_buffer_offset, write_buffer in pipe_apps:
+                if write_buffer and pkt_buffer_offset in failed_offsets:
+                    if key not in failed_buffers:
+                        errors.append(('pkt_buffer', key, 'shares the buffer of {}, which failed'.format(
+                            failed_offsets[pkt_buffer_offset])))
+                    failed_apps.add(key)
+
+            # Entries for apps that are not programmed yet must be added, the
+            # rest are modified in place, with only the fields that changed
+            new_apps = []
+            existing_apps = []
+            app_fields = {}
+
+            for key, app_id, local_port, config, trigger, _, pkt_buffer_offset, _ in pipe_apps:
+                if key in failed_apps:
+                    continue
+                fields = self._app_cfg_fields(app_id, local_port, config, trigger, pkt_buffer_offset, pipe)
+                if fields is None:
+                    continue
+
+                app_fields[key] = fields
+                entry = (key, ) + self._app_cfg_entry(app_id, trigger, fields)
+                if key in self.apps:
+                    existing_apps.append(entry)
+                else:
+                    new_apps.append(entry)
+
+            rpcs += bool(new_apps) + bool(existing_apps)
+            failed_apps |= self._batch_write('add', self.app_cfg, 'app_cfg', pipe_target, new_apps, errors)
+            failed_apps |= self._batch_write('mod', self.app_cfg, 'app_cfg', pipe_target, existing_apps, errors)
+
+            written_apps = []
+            for key, app_id, _, _, trigger, _, _, _ in pipe_apps:
+                if key in app_fields and key not in failed_apps:
+                    self._record_app_cfg(app_id, trigger, app_fields[key], pipe)
+                    written_apps.append((key, app_id))
+
+            rpcs += self.verify != VERIFY_NONE and bool(written_apps)
+            mismatches = self._check_writes(self.app_cfg, 'app_cfg', pipe_target, [
+                ({ 'app_id': app_id }, app_fields[key]) for key, app_id in written_apps
+            ], pipe)
+            for i, messages in mismatches.items():
+                key = written_apps[i][0]
+                errors.append(('app_cfg', key, '; '.join(messages)))
+                failed_apps.add(key)
+
+        for key, app_id, local_port, config, trigger, pipe, pkt_buffer_offset, _ in placed:
+            if key in failed_apps:
+                self._drop_buffer(key, *owners[key])
+                continue
+
+            self._keep_buffer(key, owners[key][0])
+            self._register_app(app_id, pipe, local_port, config, trigger, pkt_buffer_offset)
+
+        self.logger.info('Programmed {} apps with {} RPCs (set_app would need {})'.format(
+            len(placed) - len(failed_apps), rpcs, legacy_rpcs))
+
+        return {
+            'rpcs': rpcs,
+            'legacy_rpcs': legacy_rpcs,
+            'errors': errors,
+        }
+
+    def fan_out(self, config, trigger, pps=None, gbps=None, pipes=None,
+                ports=range(68, 72), apps_per_port=1, first_app_id=0, port_gbps=100):
+        """
+        Spread an aggregate rate over every pktgen port of every pipe.
+
+        One app with a copy of config is programmed per port (apps_per_port
+        per port, if more), on each pipe of pipes (all by default), with
+        pipe scoped targets. Each app gets an equal share of pps, or of
+        gbps on the wire, planned with PktgenConfig.set_rate. App ids on
+        each pipe start at first_app_id.
+
+        Returns the list of app keys, which start_apps, stop_apps,
+        get_reports and get_pipe_reports take, and the set_apps report.
+        """
+        assert (pps is None) != (gbps is None), 'give either pps or gbps'
+
+        if pipes is None:
+            pipes = range(self.num_pipes)
+
+        apps_per_pipe = len(ports) * apps_per_port
+        assert first_app_id + apps_per_pipe <= 8, 'only 8 apps per pipe'
+
+        n_apps = len(pipes) * apps_per_pipe
+        frame_size = config.get_packet_length() + ETH_FCS_LEN
+        if gbps is not None:
+            pps = gbps * 1e9 / wire_bits(frame_size)
+
+        app_pps = pps / n_apps
+        if app_pps * apps_per_port > line_rate_pps(frame_size, port_gbps):
+            raise ValueError('{:.0f} pps over {} ports is more than line rate'.format(
+                pps, len(pipes) * len(ports)))
+
+        app_config = copy.deepcopy(config)
+        plan = app_config.set_rate(app_pps, port_gbps=port_gbps)
+
+        apps = []
+        for pipe in pipes:
+            app_id = first_app_id
+            for local_port in ports:
+                for _ in range(apps_per_port):
+                    apps.append((app_id, local_port, app_config, trigger, pipe))
+                    app_id += 1
+
+        self.logger.info('Fanning out {:.0f} pps over {} apps, {:.0f} pps each'.format(
+            pps, n_apps, plan.achieved_pps))
+
+        report = self.set_apps(apps)
+        keys = [ self._app_key(app[0], app[4]) for app in apps ]
+
+        return [ key for key in keys if key in self.apps ], report
+
+    def _enable_requests(self, app_ids, enable):
+        """
+        Build the app_enable writes for app_ids without sending them.
+        Returns a list of (target, keys, data, pipe, apps, enable), one per
+        pipe, apps being the (app_id, trigger) the shadow records.
+        """
+        by_pipe = {}
+        for key in app_ids:
+            assert key in self.apps.keys()
+            by_pipe.setdefault(self.apps[key]['pipe'], []).append(key)
+
+        return [
+            (
+                self._target(pipe),
+                [
+                    self.app_cfg.make_key([ gc.KeyTuple('app_id', self.apps[key]['app_id']) ])
+                    for key in keys
+                ],
+                [
+                    self.app_cfg.make_data(
+                        [ gc.DataTuple('app_enable', bool_val=enable) ],
+                        self._action(self.apps[key]['trigger'])
+                    )
+                    for key in keys
+                ],
+                pipe,
+                [ (self.apps[key]['app_id'], self.apps[key]['trigger']) for key in keys ],
+                enable
+            )
+            for pipe, keys in by_pipe.items()
+        ]
+
+    def _send_requests(self, requests):
+        for target, keys, data, pipe, apps, enable in requests:
+            self.app_cfg.entry_mod(target, keys, data)
+
+            for app_id, trigger in apps:
+                self._record_app_cfg(app_id, trigger, { 'app_enable': enable }, pipe)
+
+    def _set_enable(self, app_ids, enable):
+        self._send_requests(self._enable_requests(app_ids, enable))
        
-    def start(self, app_id):
-        assert app_id in self.apps.keys()
+    def start(self, app_id, pipe=None):
+        key = self._app_key(app_id, pipe)
+        assert key in self.apps.keys()
 
-        self.logger.info('Enabling pktgen app {}'.format(app_id))
+        self.logger.info('Enabling pktgen app {}'.format(key))
+
+        self._set_enable([ key ], True)
+    
+    def stop(self, app_id, pipe=None):
+        key = self._app_key(app_id, pipe)
+        assert key in self.apps.keys()
+
+        self.logger.info('Disabling pktgen app {}'.format(key))
+
+        self._set_enable([ key ], False)
+
+    def start_apps(self, app_ids):
+        """Enable several apps, with one request per pipe."""
+        self.logger.info('Enabling pktgen apps {}'.format(list(app_ids)))
+        self._set_enable(app_ids, True)
+
+    def stop_apps(self, app_ids):
+        """Disable several apps, with one request per pipe."""
+        self.logger.info('Disabling pktgen apps {}'.format(list(app_ids)))
+        self._set_enable(app_ids, False)
+
+    def _set_port_cfg(self, local_port, pipe, fields):
+        key_fields = { 'dev_port': self._dev_port(local_port, pipe) }
+        if not self.shadow.diff('port_cfg', key_fields, fields):
+            return
 
         target = gc.Target(device_id=0)
 
-        self.app_cfg.entry_mod(
+        self.port_cfg.entry_add(
             target,
             [
-                self.app_cfg.make_key([ gc.KeyTuple('app_id', app_id) ])
+                self.port_cfg.make_key([ gc.KeyTuple('dev_port', key_fields['dev_port']) ])
             ],
             [
-                self.app_cfg.make_data(
-                    [ gc.DataTuple('app_enable', bool_val=True) ],
-                    self.apps[app_id]['trigger'].value
-                )
+                self.port_cfg.make_data(data_tuples(fields))
             ]
         )
-    
-    def stop(self, app_id):
-        assert app_id in self.apps.keys()
+        self.shadow.update('port_cfg', key_fields, fields)
 
-        self.logger.info('Disabling pktgen app {}'.format(app_id))
+        self._verify(self.port_cfg, 'port_cfg', target, [ (key_fields, fields) ])
 
-        target = gc.Target(device_id=0)
+    def set_recirculation(self, local_port, enable=True, pipe=None):
+        """
+        Match the packets recirculated through local_port (68-71) against
+        the patterns of the RECIRCULATION apps.
+        """
+        assert local_port in range(68, 72)
+        self._set_port_cfg(local_port, pipe, { 'recirculation_enable': enable })
 
-        self.app_cfg.entry_mod(
-            target,
+    def clear_port_down(self, local_port, pipe=None):
+        """
+        Re-arm PORT_DOWN apps for local_port: a port that went down does
+        not trigger again until cleared.
+        """
+        self.port_cfg.entry_add(
+            gc.Target(device_id=0),
             [
-                self.app_cfg.make_key([ gc.KeyTuple('app_id', app_id) ])
+                self.port_cfg.make_key([ gc.KeyTuple('dev_port', self._dev_port(local_port, pipe)) ])
             ],
             [
-                self.app_cfg.make_data(
-                    [ gc.DataTuple('app_enable', bool_val=False) ],
-                    self.apps[app_id]['trigger'].value
-                )
+                self.port_cfg.make_data([ gc.DataTuple('clear_port_down_enable', bool_val=True) ])
             ]
         )
-    
-    def get_report(self, app_id):
-        assert app_id in self.apps.keys()
 
-        target = gc.Target(device_id=0)
+    def set_port_mask(self, port_mask_sel, local_ports, pipe=None):
+        """
+        Set port mask port_mask_sel (0 or 1) to local_ports: PORT_DOWN apps
+        with that mask selected trigger when one of them goes down.
+        """
+        assert port_mask_sel in (0, 1)
+
+        if self.port_mask is None:
+            self.port_mask = self._table_get('port_mask')
+
+        mask = 0
+        for port in local_ports:
+            assert port in range(72)
+            mask |= 1 << port
+
+        self.port_mask.entry_add(
+            self._target(pipe),
+            [
+                self.port_mask.make_key([ gc.KeyTuple('port_mask_sel', port_mask_sel) ])
+            ],
+            [
+                self.port_mask.make_data([ gc.DataTuple('mask', bytearray(mask.to_bytes(9, 'big'))) ])
+            ]
+        )
+
+    def measure_trigger_latency(self, app_id, fire, pipe=None, repeats=10, timeout=1.0,
+                                rearm=None, capture=None):
+        """
+        Time from an event to the first packet of the event triggered app
+        app_id, which must be enabled. fire() causes the event (takes a
+        port down, sends the recirculated pattern, ...) and rearm(), if
+        given, undoes it between repeats.
+
+        Without capture, the first packet shows as pkt_counter going up,
+        polled from hardware, so the result includes an RPC round trip and
+        is an upper bound. With a RingCapture on an interface the app's
+        packets reach, the kernel receive time of the first packet after
+        fire() is used instead.
+
+        Returns a dict with the latencies in ns ('samples_ns'), the repeats
+        with no packet within timeout seconds ('missed') and min, p50, mean
+        and max.
+        """
+        key = self._app_key(app_id, pipe)
+        assert key in self.apps.keys()
+        assert self.apps[key]['trigger'] not in (PktgenTrigger.ONE_SHOT, PktgenTrigger.PERIODIC)
+
+        samples = []
+        missed = 0
+
+        for i in range(repeats):
+            if i and rearm is not None:
+                rearm()
+
+            if capture is None:
+                before = self.get_report(key)['pkt_counter']
+                fired = time.monotonic_ns()
+                fire()
+
+                first = None
+                while time.monotonic_ns() - fired < timeout * 1e9:
+                    if self.get_report(key)['pkt_counter'] > before:
+                        first = time.monotonic_ns()
+                        break
+            else:
+                # kernel timestamps are on the realtime clock
+                fired = time.time_ns()
+                fire()
+
+                first = None
+                for block in capture.blocks(timeout):
+                    first = next((ts for ts, _ in block if ts >= fired), None)
+                    if first is not None or time.time_ns() - fired >= timeout * 1e9:
+                        break
+
+            if first is None:
+                missed += 1
+            else:
+                samples.append(first - fired)
+
+        ordered = sorted(samples)
+        report = {
+            'samples_ns': samples,
+            'missed': missed,
+            'min': ordered[0] if ordered else None,
+            'p50': ordered[len(ordered) // 2] if ordered else None,
+            'mean': sum(ordered) / len(ordered) if ordered else None,
+            'max': ordered[-1] if ordered else None,
+        }
+
+        self.logger.info('Trigger latency of app {}: p50 {} ns over {} events, {} missed'.format(
+            key, report['p50'], len(samples), missed))
+
+        return report
+
+    def remove_app(self, app_id, compact=False, pipe=None):
+        """
+        Disable app_id and release its part of the packet buffer. With
+        compact, the remaining buffers are packed right away (see
+        compact_buffers).
+        """
+        key = self._app_key(app_id, pipe)
+        self.stop(key)
+
+        self.buffers.free(key)
+        del self.apps[key]
+
+        if compact:
+            self.compact_buffers()
+
+    def compact_buffers(self):
+        """
+        Pack the packet buffer so its free space is contiguous, rewriting
+        the moved templates and the pkt_buffer_offset of the apps using
+        them. Regions only move towards offset 0 and may overlap their old
+        place, so apps using a moved region should be stopped first.
+        Returns the dict of old offset to new offset.
+        """
+        moves = self.buffers.compact()
+        if not moves:
+            return moves
+
+        # Rewrite each moved template on the pipes its apps are on
+        buffers = {}
+        for new_offset in sorted(moves.values()):
+            region = self.buffers.regions[new_offset]
+
+            pipes = set(self._key_pipe(owner) for owner in region['owners'])
+            if None in pipes:
+                pipes = { None }
+
+            for pipe in pipes:
+                buffers.setdefault(pipe, []).append((
+                    self.pkt_buffer.make_key([
+                        gc.KeyTuple('pkt_buffer_offset', new_offset),
+                        gc.KeyTuple('pkt_buffer_size', region['size'])
+                    ]),
+                    self.pkt_buffer.make_data([
+                        gc.DataTuple('buffer', self._template_buffer(region['template']))
+                    ]),
+                    (new_offset, region)
+                ))
+
+        for pipe, entries in buffers.items():
+            self.pkt_buffer.entry_add(
+                self._target(pipe),
+                [ key for key, _, _ in entries ],
+                [ data for _, data, _ in entries ]
+            )
+
+            for _, _, (offset, region) in entries:
+                self._record_pkt_buffer(offset, region['size'], region['template'], pipe)
+
+        apps = {}
+        for app in self.apps.values():
+            if app['pkt_buffer_offset'] not in moves:
+                continue
+
+            app['pkt_buffer_offset'] = moves[app['pkt_buffer_offset']]
+            apps.setdefault(app['pipe'], []).append(app)
+
+        for pipe, pipe_apps in apps.items():
+            self.app_cfg.entry_mod(
+                self._target(pipe),
+                [
+                    self.app_cfg.make_key([ gc.KeyTuple('app_id', app['app_id']) ])
+                    for app in pipe_apps
+                ],
+                [
+                    self.app_cfg.make_data(
+                        [ gc.DataTuple('pkt_buffer_offset', app['pkt_buffer_offset']) ],
+                        self._action(app['trigger'])
+                    )
+                    for app in pipe_apps
+                ]
+            )
+
+            for app in pipe_apps:
+                self._record_app_cfg(app['app_id'], app['trigger'],
+                                     { 'pkt_buffer_offset': app['pkt_buffer_offset'] }, pipe)
+
+        self.logger.info('Compacted packet buffer, moved {} regions'.format(len(moves)))
+
+        return moves
+
+    def invalidate_shadow(self):
+        """
+        Forget what was written to the pktgen tables, for when something
+        else may have changed them: the next set_app reads the port status
+        again and writes every field and packet buffer.
+        """
+        self.shadow.invalidate()
+
+    def resync_shadow(self):
+        """
+        Reload the shadow from the driver: the port_cfg entries of the
+        pktgen ports and the app_cfg entries of the registered apps. The
+        packet buffers are not read back and will be written again.
+        """
+        self.shadow.invalidate()
+
+        ports = [
+            self._dev_port(local_port, pipe)
+            for pipe in range(self.num_pipes) for local_port in range(68, 72)
+        ]
+        self.shadow.resync('port_cfg', self.port_cfg, gc.Target(device_id=0), key_list=[
+            self.port_cfg.make_key([ gc.KeyTuple('dev_port', port) ]) for port in ports
+        ])
+
+        by_pipe = {}
+        for app in self.apps.values():
+            by_pipe.setdefault(app['pipe'], []).append(app['app_id'])
+
+        for pipe, app_ids in by_pipe.items():
+            self.shadow.resync('app_cfg', self.app_cfg, self._target(pipe), pipe, [
+                self.app_cfg.make_key([ gc.KeyTuple('app_id', app_id) ]) for app_id in app_ids
+            ])
+
+    def get_report(self, app_id, pipe=None):
+        key = self._app_key(app_id, pipe)
+        assert key in self.apps.keys()
+
+        target = self._target(self.apps[key]['pipe'])
 
         resp = self.app_cfg.entry_get(
             target,
             [
-                self.app_cfg.make_key([ gc.KeyTuple('app_id', app_id) ])
+                self.app_cfg.make_key([ gc.KeyTuple('app_id', self.apps[key]['app_id']) ])
             ],
             { "from_hw": True }
         )
@@ -329,3 +1670,55 @@ class Pktgen():
             'pkt_counter': data_dict['pkt_counter'],
             'trigger_counter': data_dict['trigger_counter'],
         }
+
+    def get_reports(self, app_ids=None):
+        """
+        Read the counters of several apps (all registered apps by default)
+        from hardware, with a single entry_get per pipe. Returns a dict of
+        app key to the same dict get_report returns.
+        """
+        if app_ids is None:
+            app_ids = list(self.apps.keys())
+
+        by_pipe = {}
+        for key in app_ids:
+            assert key in self.apps.keys()
+            by_pipe.setdefault(self.apps[key]['pipe'], {})[self.apps[key]['app_id']] = key
+
+        reports = {}
+        for pipe, keys in by_pipe.items():
+            resp = self.app_cfg.entry_get(
+                self._target(pipe),
+                [
+                    self.app_cfg.make_key([ gc.KeyTuple('app_id', app_id) ])
+                    for app_id in keys
+                ],
+                { "from_hw": True }
+            )
+
+            for data, key in resp:
+                data_dict = data.to_dict()
+                reports[keys[key.to_dict()['app_id']['value']]] = {
+                    'batch_counter': data_dict['batch_counter'],
+                    'pkt_counter': data_dict['pkt_counter'],
+                    'trigger_counter': data_dict['trigger_counter'],
+                }
+
+        return reports
+
+    def get_pipe_reports(self, app_ids=None):
+        """
+        Counters of get_reports summed per pipe. Apps programmed on every
+        pipe are summed under None.
+        """
+        totals = {}
+        for key, report in self.get_reports(app_ids).items():
+            total = totals.setdefault(self.apps[key]['pipe'], {
+                'batch_counter': 0,
+                'pkt_counter': 0,
+                'trigger_counter': 0,
+            })
+            for counter, value in report.items():
+                total[counter] += value
+
+        return totals
@@ -0,0 +1,218 @@
+import logging
+import queue
+import threading
+import time
+
+from collections import deque, namedtuple
+
+RateSample = namedtuple('RateSample', [
+    'timestamp',        # host monotonic time of the read, in seconds
+    'app_id',
+    'batch_counter',
+    'pkt_counter',
+    'trigger_counter',
+    'pps',              # packets per second over the rate window
+    'bps',              # bits per second over the rate window (frame bytes, no FCS/IFG)
+])
+
+class CounterPoller():
+    """
+    Polls the counters of every active pktgen app on a background thread.
+
+    Each period, the counters of all apps are read with a single
+    pktgen.get_reports() call and appended to a ring buffer of the last
+    `history` reads. Rates are the counter deltas between the newest read
+    and the one `window` reads before it, so the period can be short
+    without the rates getting noisy.
+
+    Results are handed out either through callbacks, called from the
+    polling thread with a dict of app_id to RateSample, or through
+    stream(), a generator over the same dicts:
+
+        with CounterPoller(pktgen, period=0.01) as poller:
+            for samples in poller.stream():
+                print(samples[1].pps)
+
+    pktgen may be anything with get_reports(app_ids) and
+    get_app_packet_length(app_id), as Pktgen has.
+    """
+
+    def __init__(self, pktgen, period=0.01, history=1024, window=10, app_ids=None):
+        assert period > 0
+        assert 1 <= window < history
+
+        self.pktgen = pktgen
+        self.period = period
+        self.window = window
+        self.app_ids = app_ids
+        self.logger = logging.getLogger('CounterPoller')
+
+        # (timestamp, { app_id: counters }) of the last reads
+        self.samples = deque(maxlen=history)
+        self.latest = {}
+        self.overruns = 0
+
+        self._callbacks = []
+        self._streams = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def add_callback(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        with self._lock:
+            self._callbacks.remove(callback)
+
+    def start(self):
+        assert self._thread is None, 'poller already running'
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='CounterPoller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+        # end every stream()
+        with self._lock:
+            streams = self._streams
+            self._streams = []
+        for q in streams:
+            self._offer(q, None)
+
+    @staticmethod
+    def _offer(q, item):
+        """Queue item for a stream, dropping its oldest result if it is full."""
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                # slow consumer
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def poll(self):
+        """
+        Read the counters once, update the ring buffer and return the dict
+        of app_id to RateSample. Called by the polling thread, but can also
+        be driven by hand.
+        """
+        t0 = time.monotonic()
+        reports = self.pktgen.get_reports(self.app_ids)
+        t1 = time.monotonic()
+
+        # the counters were sampled somewhere inside the RPC
+        timestamp = (t0 + t1) / 2
+
+        with self._lock:
+            self.samples.append((timestamp, reports))
+            old_timestamp, old_reports = self.samples[max(0, len(self.samples) - 1 - self.window)]
+
+            result = {}
+            for app_id, counters in reports.items():
+                pps = 0.0
+                bps = 0.0
+                old = old_reports.get(app_id)
+                elapsed = timestamp - old_timestamp
+
+                if old is not None and elapsed > 0:
+                    pps = (counters['pkt_counter'] - old['pkt_counter']) / elapsed
+                    bps = pps * self.pktgen.get_app_packet_length(app_id) * 8
+
+                result[app_id] = RateSample(
+                    timestamp,
+                    app_id,
+                    counters['batch_counter'],
+                    counters['pkt_counter'],
+                    counters['trigger_counter'],
+                    pps,
+                    bps
+                )
+
+            self.latest = result
+            callbacks = list(self._callbacks)
+            streams = list(self._streams)
+
+        for callback in callbacks:
+            callback(result)
+
+        for q in streams:
+            self._offer(q, result)
+
+        return result
+
+    def _run(self):
+        next_poll = time.monotonic()
+
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception:
+                self.logger.exception('Counter poll failed')
+
+            # schedule from the previous deadline so the period does not
+            # drift with the RPC time; skip deadlines that already passed
+            next_poll += self.period
+            now = time.monotonic()
+            if next_poll < now:
+                missed = int((now - next_poll) / self.period) + 1
+                self.overruns += missed
+                next_poll += missed * self.period
+
+            self._stop.wait(next_poll - now)
+
+    def stream(self, maxsize=1024):
+        """
+        Generator over the result of every poll from this call on, until
+        stop() is called; on a poller that is not running it ends at once.
+        At most maxsize results are buffered for a slow consumer.
+        """
+        # subscribe now rather than when the generator first runs, so no
+        # poll in between is missed
+        q = queue.Queue(maxsize)
+        with self._lock:
+            if self._thread is not None and not self._stop.is_set():
+                self._streams.append(q)
+            else:
+                q.put(None)
+
+        return self._stream(q)
+
+    def _stream(self, q):
+        try:
+            while True:
+                result = q.get()
+                if result is None:
+                    return
+                yield result
+        finally:
+            with self._lock:
+                if q in self._streams:
+                    self._streams.remove(q)
+
+    def history(self, app_id):
+        """List of (timestamp, counters) of app_id in the ring buffer."""
+        with self._lock:
+            return [
+                (timestamp, reports[app_id])
+                for timestamp, reports in self.samples
+                if app_id in reports
+            ]
@@ -0,0 +1,126 @@
+from collections import namedtuple
+
+# preamble, start of frame delimiter and inter frame gap
+ETH_WIRE_OVERHEAD = 20
+# frame sizes count the FCS, which the MAC appends to pkt_len
+ETH_FCS_LEN = 4
+
+# widths of the app_cfg fields
+MAX_PACKETS_PER_BATCH = 1 << 16
+MAX_BATCH_COUNT = 1 << 16
+MAX_TIMER_NANOSEC = (1 << 32) - 1
+# shortest timer period a periodic app keeps up with; faster rates send
+# more packets per tick instead
+MIN_TIMER_NANOSEC = 1000
+
+RatePlan = namedtuple('RatePlan', [
+    'packets_per_batch',
+    'batch_count',
+    'timer_nanosec',
+    'ipg',
+    'ibg',
+    'target_pps',
+    'achieved_pps',
+    'achieved_gbps',    # on the wire, counting preamble and IFG
+    'error',            # (achieved - target) / target
+    'error_bound',      # relative error of one timer tick of uncertainty
+    'burst_pps',        # instantaneous rate while a batch is sent
+])
+
+def wire_bits(frame_size):
+    """Bits one frame (with FCS) takes on the wire."""
+    return (frame_size + ETH_WIRE_OVERHEAD) * 8
+
+def line_rate_pps(frame_size, port_gbps):
+    """Packets per second of a port at full line rate, frame_size with FCS."""
+    return port_gbps * 1e9 / wire_bits(frame_size)
+
+def _split(packets):
+    """
+    Split the packets of one timer tick into (packets_per_batch,
+    batch_count), using as few batches as possible.
+    """
+    batch_count = -(-packets // MAX_PACKETS_PER_BATCH)
+    while packets % batch_count:
+        batch_count += 1
+    return packets // batch_count, batch_count
+
+def solve_rate(frame_size, port_gbps=100, pps=None, gbps=None, max_error=1e-4,
+               timer_granularity_ns=1, min_timer_nanosec=MIN_TIMER_NANOSEC,
+               max_packets_per_tick=MAX_PACKETS_PER_BATCH):
+    """
+    Choose the app_cfg rate fields that send frame_size byte frames (with
+    FCS) at pps packets per second, or at gbps on the wire.
+
+    The timer fires every timer_nanosec and sends batch_count batches of
+    packets_per_batch packets. Each tick sends N = packets_per_batch *
+    batch_count packets, so the achieved rate is N / timer_nanosec, and
+    timer_nanosec only comes in timer_granularity_ns steps. Rounding the
+    timer costs up to granularity / (2 * timer) of relative error, so the
+    solver looks for the smallest N whose rounding error is below
+    max_error, the smallest N keeping bursts short. ipg and ibg then
+    spread the N packets evenly over the tick instead of sending them
+    back to back at line rate. The timer never fires more often than
+    every min_timer_nanosec; faster rates send more packets per tick.
+
+    Rates at or above line rate give a plan with timer_nanosec 0, the
+    same as PktgenConfig.set_max_throughput.
+    """
+    assert (pps is None) != (gbps is None), 'give either pps or gbps'
+
+    if gbps is not None:
+        pps = gbps * 1e9 / wire_bits(frame_size)
+    assert pps > 0
+
+    wire_ns = wire_bits(frame_size) / port_gbps
+    max_pps = line_rate_pps(frame_size, port_gbps)
+
+    if pps >= max_pps:
+        return RatePlan(1, 1, 0, 0, 0, pps, max_pps, port_gbps,
+                        (max_pps - pps) / pps, 0.0, max_pps)
+
+    best = None
+    for packets in range(1, max_packets_per_tick + 1):
+        exact = packets * 1e9 / pps
+        timer = max(1, round(exact / timer_granularity_ns)) * timer_granularity_ns
+
+        if timer > MAX_TIMER_NANOSEC:
+            break
+        if timer < min_timer_nanosec:
+            continue
+        if timer < packets * wire_ns:
+            # rounding down pushed the tick past line rate
+            timer += timer_granularity_ns
+
+        error = abs(packets * 1e9 / timer - pps) / pps
+        if best is None or error < best[0]:
+            best = (error, packets, timer)
+        if error <= max_error:
+            break
+
+    if best is None:
+        raise ValueError('{} pps is too slow for the 32 bit timer'.format(pps))
+
+    _, packets, timer = best
+    packets_per_batch, batch_count = _split(packets)
+
+    # spread the packets evenly over the tick; the remainder of the
+    # integer division is idle time at the end of the tick
+    gap = int(timer / packets - wire_ns)
+    gap = max(0, gap)
+
+    achieved_pps = packets * 1e9 / timer
+
+    return RatePlan(
+        packets_per_batch,
+        batch_count,
+        timer,
+        gap,
+        gap,
+        pps,
+        achieved_pps,
+        achieved_pps * wire_bits(frame_size) / 1e9,
+        (achieved_pps - pps) / pps,
+        timer_granularity_ns / timer,
+        1e9 / (wire_ns + gap)
+    )
@@ -0,0 +1,275 @@
+import csv
+import logging
+import math
+import threading
+import time
+
+from collections import namedtuple
+
+ScheduleSample = namedtuple('ScheduleSample', [
+    'timestamp',        # seconds since the start of the profile
+    'app_id',
+    'planned_pps',      # rate of the timeline at that time
+    'programmed_pps',   # rate the app was programmed with (RatePlan.achieved_pps)
+    'measured_pps',     # rate from the pkt_counter deltas since the last sample
+])
+
+class Step():
+    """Constant pps for duration seconds."""
+
+    def __init__(self, pps, duration):
+        self.pps = pps
+        self.duration = duration
+
+    def rate(self, t):
+        return self.pps
+
+class Ramp():
+    """Linear change from start_pps to end_pps over duration seconds."""
+
+    def __init__(self, start_pps, end_pps, duration):
+        self.start_pps = start_pps
+        self.end_pps = end_pps
+        self.duration = duration
+
+    def rate(self, t):
+        return self.start_pps + (self.end_pps - self.start_pps) * t / self.duration
+
+class Sine():
+    """
+    mean_pps + amplitude_pps * sin(2 pi t / period + phase), e.g. a diurnal
+    curve compressed to a period of minutes.
+    """
+
+    def __init__(self, mean_pps, amplitude_pps, period, duration, phase=0.0):
+        self.mean_pps = mean_pps
+        self.amplitude_pps = amplitude_pps
+        self.period = period
+        self.duration = duration
+        self.phase = phase
+
+    def rate(self, t):
+        return self.mean_pps + self.amplitude_pps * math.sin(2 * math.pi * t / self.period + self.phase)
+
+class Burst():
+    """Train of on seconds at high_pps and off seconds at low_pps."""
+
+    def __init__(self, high_pps, on, off, duration, low_pps=0):
+        self.high_pps = high_pps
+        self.low_pps = low_pps
+        self.on = on
+        self.off = off
+        self.duration = duration
+
+    def rate(self, t):
+        return self.high_pps if t % (self.on + self.off) < self.on else self.low_pps
+
+class Replay():
+    """
+    Rates from a log of (seconds, pps), each held until the next one. The
+    segment lasts until the last entry, or duration if given.
+    """
+
+    def __init__(self, samples, duration=None):
+        self.samples = sorted(samples)
+        assert self.samples, 'empty rate log'
+        self.times = [ t for t, _ in self.samples ]
+        self.duration = duration if duration is not None else self.times[-1]
+
+    @classmethod
+    def from_csv(cls, f, time_column='time', rate_column='pps', duration=None):
+        """Replay of a CSV rate log with time and rate columns."""
+        return cls([
+            (float(row[time_column]), float(row[rate_column])) for row in csv.DictReader(f)
+        ], duration)
+
+    def rate(self, t):
+        lo, hi = 0, len(self.times)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[mid] <= t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self.samples[max(lo - 1, 0)][1]
+
+class Timeline():
+    """Segments one after the other."""
+
+    def __init__(self, segments):
+        self.segments = list(segments)
+        self.duration = sum(segment.duration for segment in self.segments)
+
+    def rate(self, t):
+        """Planned pps at t seconds, None past the end."""
+        for segment in self.segments:
+            if t < segment.duration:
+                return max(0.0, segment.rate(t))
+            t -= segment.duration
+        return None
+
+class ProfileScheduler():
+    """
+    Plays a Timeline per app: every tick the planned rate of each app is
+    looked up and, when it moved by more than min_change (relative),
+    programmed with Pktgen.set_app_rate, which modifies app_cfg in place
+    so the app keeps running. A planned rate of 0 stops the app until the
+    rate comes back.
+
+    Ticks are scheduled on the monotonic clock from the start time, so
+    late ticks do not shift the ones after them; ticks missed entirely are
+    skipped and counted in overruns. Every sample_every ticks the counters
+    are read with get_reports and a ScheduleSample of planned, programmed
+    and measured rate is logged per app.
+
+        scheduler = ProfileScheduler(pktgen, {
+            0: Timeline([ Ramp(1e6, 10e6, 30), Sine(5e6, 4e6, 60, 300) ]),
+            1: Timeline([ Burst(20e6, on=0.1, off=0.9, duration=330) ]),
+        })
+        scheduler.run()
+        scheduler.write_csv(open('profile.csv', 'w'))
+
+    The apps must be programmed beforehand; their packet length is kept.
+    """
+
+    def __init__(self, pktgen, timelines, tick=0.01, sample_every=10, min_change=0.001,
+                 port_gbps=100):
+        assert tick > 0
+
+        self.pktgen = pktgen
+        self.timelines = timelines
+        self.tick = tick
+        self.sample_every = sample_every
+        self.min_change = min_change
+        self.port_gbps = port_gbps
+        self.logger = logging.getLogger('ProfileScheduler')
+
+        self.log = []
+        self.overruns = 0
+        # last rate asked of set_app_rate and the RatePlan.achieved_pps of it
+        self.requested = {}
+        self.programmed = {}
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def duration(self):
+        return max(timeline.duration for timeline in self.timelines.values())
+
+    def _apply(self, app_id, pps):
+        """Program pps on app_id if it moved enough. Returns False if it is stopped."""
+        current = self.requested.get(app_id)
+
+        if not pps:
+            # None is the first tick, where the app may still be running
+            if current != 0:
+                self.pktgen.stop(app_id)
+            self.requested[app_id] = 0.0
+            self.programmed[app_id] = 0.0
+            return False
+
+        if current and abs(pps - current) <= self.min_change * current:
+            return True
+
+        plan = self.pktgen.set_app_rate(app_id, pps, port_gbps=self.port_gbps)
+        self.requested[app_id] = pps
+        self.programmed[app_id] = plan.achieved_pps
+
+        if not current and current is not None:
+            self.pktgen.start(app_id)
+        return True
+
+    def _sample(self, t, planned, last):
+        reports = self.pktgen.get_reports(list(self.timelines))
+        now = time.monotonic()
+
+        for app_id, report in reports.items():
+            measured = None
+            if last is not None:
+                measured = (report['pkt_counter'] - last[1][app_id]['pkt_counter']) / (now - last[0])
+
+            sample = ScheduleSample(t, app_id, planned[app_id], self.programmed.get(app_id), measured)
+            self.log.append(sample)
+
+            if measured is not None:
+                self.logger.debug('{:.2f}s app {}: planned {:.0f} pps, programmed {:.0f} pps, measured {:.0f} pps'.format(
+                    t, app_id, sample.planned_pps, sample.programmed_pps, measured))
+
+        return now, reports
+
+    def run(self):
+        """Play the timelines to their end, or until stop(). Returns the log."""
+        self.requested = {}
+        self.programmed = {}
+
+        planned = {}
+        running = []
+        for app_id, timeline in self.timelines.items():
+            planned[app_id] = timeline.rate(0)
+            if self._apply(app_id, planned[app_id]):
+                running.append(app_id)
+
+        if running:
+            self.pktgen.start_apps(running)
+
+        start = time.monotonic()
+        last = self._sample(0.0, planned, None)
+        tick = 0
+        last_sample_tick = 0
+
+        try:
+            while not self._stop.is_set():
+                tick += 1
+                wait = start + tick * self.tick - time.monotonic()
+                if wait > 0:
+                    if self._stop.wait(wait):
+                        break
+                else:
+                    # skip whole ticks we are late for
+                    missed = int(-wait // self.tick)
+                    self.overruns += missed
+                    tick += missed
+
+                t = time.monotonic() - start
+                if t >= self.duration:
+                    break
+
+                for app_id, timeline in self.timelines.items():
+                    pps = timeline.rate(t)
+                    if pps is None:
+                        continue
+                    planned[app_id] = pps
+                    self._apply(app_id, pps)
+
+                # not tick % sample_every, which overruns can step over
+                if tick - last_sample_tick >= self.sample_every:
+                    last = self._sample(t, planned, last)
+                    last_sample_tick = tick
+        finally:
+            self.pktgen.stop_apps(list(self.timelines))
+
+        self.logger.info('Played {:.1f}s of profile on {} apps, {} ticks overrun'.format(
+            time.monotonic() - start, len(self.timelines), self.overruns))
+
+        return self.log
+
+    def start(self):
+        """Run on a background thread."""
+        assert self._thread is None, 'scheduler already running'
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='ProfileScheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def write_csv(self, f):
+        """Write the planned versus achieved log to the open file f."""
+        writer = csv.writer(f)
+        writer.writerow(ScheduleSample._fields)
+        writer.writerows(self.log)
@@ -0,0 +1,124 @@
+import logging
+
+import bfrt_grpc.client as gc
+
+def data_tuples(fields):
+    """DataTuples for a dict of field name to value."""
+    return [
+        gc.DataTuple(name, bool_val=value) if isinstance(value, bool) else gc.DataTuple(name, value)
+        for name, value in fields.items()
+    ]
+
+def key_ident(key_fields):
+    """Hashable form of a dict of key field name to value."""
+    return tuple(sorted(key_fields.items()))
+
+class ShadowState():
+    """
+    What this controller last wrote to (or read from) each table entry.
+
+    Entries are dicts of field name to value, stored per (table name,
+    pipe, key). pipe None stands for a write to all pipes, which replaces
+    whatever was recorded for single pipes of the same key and answers
+    for every pipe until one of them is written on its own.
+
+    The shadow only knows about its own writes: anything else changing
+    the switch (another controller, a driver restart, fields the hardware
+    updates itself such as counters) goes unnoticed until the state is
+    invalidated or resynced.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.logger = logging.getLogger('ShadowState')
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, table, ident, pipe):
+        fields = self.entries.get((table, pipe, ident))
+        if fields is None and pipe is not None:
+            # a write to every pipe covers this one too
+            fields = self.entries.get((table, None, ident))
+        return fields
+
+    def get(self, table, key_fields, pipe=None):
+        """Recorded fields of an entry, or None when it is unknown."""
+        fields = self._lookup(table, key_ident(key_fields), pipe)
+        if fields is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return fields
+
+    def diff(self, table, key_fields, fields, pipe=None):
+        """
+        The part of fields that differs from what was recorded. Everything
+        differs when the entry is unknown.
+        """
+        known = self._lookup(table, key_ident(key_fields), pipe)
+        if known is None:
+            return dict(fields)
+
+        return {
+            name: value for name, value in fields.items()
+            if name not in known or known[name] != value
+        }
+
+    def update(self, table, key_fields, fields, pipe=None, replace=False):
+        """Record a write of fields to an entry."""
+        ident = key_ident(key_fields)
+
+        known = {}
+        if pipe is None:
+            for other in [ k for k in self.entries if k[0] == table and k[2] == ident ]:
+                if other[1] is not None:
+                    del self.entries[other]
+        else:
+            known = self.entries.pop((table, None, ident), {})
+
+        entry = self.entries.setdefault((table, pipe, ident), dict(known))
+        if replace:
+            entry.clear()
+        entry.update(fields)
+
+    def invalidate(self, table=None, key_fields=None, pipe=None):
+        """
+        Forget entries: all of them, those of a table, or a single key
+        (of any pipe unless pipe is given).
+        """
+        ident = key_ident(key_fields) if key_fields is not None else None
+
+        for k in list(self.entries):
+            if table is not None and k[0] != table:
+                continue
+            if ident is not None and k[2] != ident:
+                continue
+            if pipe is not None and k[1] != pipe:
+                continue
+            del self.entries[k]
+
+    def resync(self, table, bfrt_table, target, pipe=None, key_list=None):
+        """
+        Replace what is recorded for a table with what the driver holds,
+        read with from_hw False (every entry unless key_list is given).
+        """
+        if key_list is None:
+            self.invalidate(table, pipe=pipe)
+
+        resp = bfrt_table.entry_get(target, key_list or [], { "from_hw": False })
+
+        n = 0
+        for data, key in resp:
+            if not key:
+                continue
+
+            key_fields = { field: value['value'] for field, value in key.to_dict().items() }
+            fields = {
+                name: value for name, value in data.to_dict().items()
+                if name != 'is_default_entry'
+            }
+            self.update(table, key_fields, fields, pipe, replace=True)
+            n += 1
+
+        self.logger.info('Resynced {} entries of {}'.format(n, table))
+        return n
@@ -0,0 +1,146 @@
+import csv
+import json
+import logging
+import time
+
+from bfutil.Pktgen import PktgenConfig, PktgenTrigger
+from bfutil.Rate import line_rate_pps, wire_bits, ETH_FCS_LEN, MIN_TIMER_NANOSEC
+
+RFC2544_FRAME_SIZES = [ 64, 128, 256, 512, 1024, 1280, 1518 ]
+
+class ThroughputSweep():
+    """
+    RFC 2544 style throughput search.
+
+    For every frame size, binary searches the highest rate at which the
+    DUT forwards everything pktgen sends, within loss_tolerance (a
+    fraction of the packets sent). Each trial reprograms the app with
+    Pktgen.set_app, runs it for `duration` seconds, waits `settle`
+    seconds for packets in flight and compares the TX count from
+    Pktgen.get_report with the receive side.
+
+    rx_counter is a callable returning the cumulative count of packets
+    received from the DUT, e.g. a port counter of the switch on the
+    other side. latency, if given, is called as latency(frame_size, pps)
+    once the throughput of a frame size is known and may return a number
+    or a dict, which goes into the result row.
+
+    config_factory(frame_size, pps) builds the PktgenConfig of a trial;
+    the default lets PktgenConfig.set_rate pick the batch sizes, timer
+    and gaps, with ticks no shorter than min_timer_nanosec.
+    """
+
+    def __init__(self, pktgen, app_id, local_port, rx_counter, port_gbps=100,
+                 duration=1.0, settle=0.1, loss_tolerance=0.0, resolution=0.001,
+                 max_trials=20, latency=None, config_factory=None,
+                 min_timer_nanosec=MIN_TIMER_NANOSEC):
+        self.pktgen = pktgen
+        self.app_id = app_id
+        self.local_port = local_port
+        self.rx_counter = rx_counter
+        self.port_gbps = port_gbps
+        self.duration = duration
+        self.settle = settle
+        self.loss_tolerance = loss_tolerance
+        self.resolution = resolution
+        self.max_trials = max_trials
+        self.latency = latency
+        self.config_factory = config_factory or self.default_config
+        self.min_timer_nanosec = min_timer_nanosec
+        self.logger = logging.getLogger('ThroughputSweep')
+
+    def default_config(self, frame_size, pps):
+        config = PktgenConfig()
+        config.set_packet_length(frame_size - ETH_FCS_LEN)
+        config.set_rate(pps, port_gbps=self.port_gbps, min_timer_nanosec=self.min_timer_nanosec)
+        return config
+
+    def trial(self, frame_size, pps):
+        """Send at pps for one trial. Returns (tx, rx) packet counts."""
+        config = self.config_factory(frame_size, pps)
+        self.pktgen.set_app(self.app_id, self.local_port, config, PktgenTrigger.PERIODIC)
+
+        tx_start = self.pktgen.get_report(self.app_id)['pkt_counter']
+        rx_start = self.rx_counter()
+
+        self.pktgen.start(self.app_id)
+        time.sleep(self.duration)
+        self.pktgen.stop(self.app_id)
+        time.sleep(self.settle)
+
+        tx = self.pktgen.get_report(self.app_id)['pkt_counter'] - tx_start
+        rx = self.rx_counter() - rx_start
+
+        self.logger.info('{}B at {:.0f} pps: sent {}, received {}'.format(frame_size, pps, tx, rx))
+        return tx, rx
+
+    def _lossless(self, tx, rx):
+        if tx == 0:
+            return False
+        return (tx - rx) <= tx * self.loss_tolerance
+
+    def search(self, frame_size):
+        """Find the throughput of one frame size. Returns a result row."""
+        max_pps = line_rate_pps(frame_size, self.port_gbps)
+
+        low = 0.0
+        high = max_pps
+        best = None
+        trials = 0
+        pps = max_pps
+
+        while trials < self.max_trials:
+            tx, rx = self.trial(frame_size, pps)
+            trials += 1
+
+            if self._lossless(tx, rx):
+                low = pps
+                best = (pps, tx, rx)
+            else:
+                high = pps
+
+            if (high - low) <= max_pps * self.resolution:
+                break
+
+            pps = (low + high) / 2
+
+        row = {
+            'frame_size': frame_size,
+            'throughput_pps': best[0] if best else 0.0,
+            'throughput_gbps': (best[0] if best else 0.0) * wire_bits(frame_size) / 1e9,
+            'line_rate_percent': 100.0 * (best[0] if best else 0.0) / max_pps,
+            'tx_packets': best[1] if best else 0,
+            'rx_packets': best[2] if best else 0,
+            'trials': trials,
+        }
+
+        if self.latency is not None and best is not None:
+            latency = self.latency(frame_size, best[0])
+            if isinstance(latency, dict):
+                row.update(('latency_' + k, v) for k, v in latency.items())
+            else:
+                row['latency'] = latency
+
+        self.logger.info('{}B: throughput {:.0f} pps ({:.2f}% of line rate) after {} trials'.format(
+            frame_size, row['throughput_pps'], row['line_rate_percent'], trials))
+
+        return row
+
+    def run(self, frame_sizes=RFC2544_FRAME_SIZES):
+        """Search every frame size in turn. Returns the list of rows."""
+        return [ self.search(frame_size) for frame_size in frame_sizes ]
+
+def write_csv(rows, f):
+    """Write sweep rows to the open file f as CSV."""
+    fields = []
+    for row in rows:
+        fields += [ field for field in row if field not in fields ]
+
+    writer = csv.DictWriter(f, fieldnames=fields)
+    writer.writeheader()
+    writer.writerows(rows)
+
+def write_json(rows, f):
+    """Write sweep rows to the open file f as a JSON list."""
+    json.dump(rows, f, indent=2)
+    f.write('\n')
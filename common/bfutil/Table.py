@@ -17,9 +17,19 @@ except:
     import bfrt_grpc.client as gc
     import grpc
 
+import csv
+import json
 import logging
+import queue
+import threading
+import time
 from pprint import pprint, pformat
 
+from bfutil.Shadow import ShadowState, data_tuples
+
+# canonical gRPC code of adding an entry whose key is already there
+ALREADY_EXISTS = 6
+
 class Table(object):
 
     def __init__(self, client, bfrt_info):
@@ -34,6 +44,81 @@ class Table(object):
         # lowest possible  priority for ternary match rules
         self.lowest_priority = 1 << 24
 
+        # what write_entry last wrote to each entry of self.table
+        self.shadow = ShadowState()
+
+    def _target(self, pipe=None):
+        return gc.Target(device_id=0, pipe_id=0xffff if pipe is None else pipe)
+
+    def _shadow_name(self):
+        return self.table.info.name_get()
+
+    def write_entry(self, key_fields, data_fields, action=None, pipe=None):
+        """
+        Make the entry with key_fields (a dict of key field to value) hold
+        data_fields, a dict of data field to value. An entry the shadow
+        knows, with the same action, is modified with only the fields that
+        changed, or not written at all when none did. Returns the fields
+        that were written.
+        """
+        name = self._shadow_name()
+        target = self._target(pipe)
+        key = self.table.make_key([ gc.KeyTuple(field, value) for field, value in key_fields.items() ])
+
+        known = self.shadow.get(name, key_fields, pipe)
+        if known is not None and known.get('action_name') == action:
+            fields = self.shadow.diff(name, key_fields, data_fields, pipe)
+            if not fields:
+                return fields
+
+            self.table.entry_mod(target, [ key ], [ self.table.make_data(data_tuples(fields), action) ])
+            self.shadow.update(name, key_fields, fields, pipe)
+            return fields
+
+        data = self.table.make_data(data_tuples(data_fields), action)
+        try:
+            self.table.entry_add(target, [ key ], [ data ])
+        except gc.BfruntimeRpcException as e:
+            # the entry exists, written before the shadow knew about it;
+            # anything else (a full table, a bad value) is a real error
+            entry_errors = getattr(e, 'errors', None)
+            if not entry_errors or \
+                    any(getattr(err, 'canonical_code', None) != ALREADY_EXISTS for _, err in entry_errors):
+                raise
+            self.table.entry_mod(target, [ key ], [ data ])
+
+        fields = dict(data_fields)
+        fields['action_name'] = action
+        self.shadow.update(name, key_fields, fields, pipe, replace=True)
+        return data_fields
+
+    def read_entry(self, key_fields, from_hw=False, pipe=None):
+        """
+        The data of the entry with key_fields, as a dict. Unless from_hw
+        is set, an entry written by write_entry is answered from the
+        shadow without a read.
+        """
+        name = self._shadow_name()
+
+        known = self.shadow.get(name, key_fields, pipe)
+        if not from_hw and known is not None:
+            return dict(known)
+
+        resp = self.table.entry_get(
+            self._target(pipe),
+            [ self.table.make_key([ gc.KeyTuple(field, value) for field, value in key_fields.items() ]) ],
+            { "from_hw": from_hw }
+        )
+        data_dict = next(resp)[0].to_dict()
+
+        if not from_hw:
+            self.shadow.update(name, key_fields, data_dict, pipe, replace=True)
+        return data_dict
+
+    def resync_shadow(self, pipe=None):
+        """Replace the shadow with every entry the driver holds."""
+        return self.shadow.resync(self._shadow_name(), self.table, self._target(pipe), pipe)
+
     def ValueCheck(self, field, data_dict, expect_value):
         value = data_dict[field]
         if (value != expect_value):
@@ -41,27 +126,204 @@ class Table(object):
                 field, value, expect_value))
             assert False    
 
-    def clear(self):
-        """Remove all existing entries in self.table."""
+    def bulk_load(self, entries, action=None, batch_size=4096, queue_depth=4, mod=False, pipe=None):
+        """
+        Write a stream of entries to self.table in batches of batch_size
+        per request. entries is an iterable of (key_fields, data_fields)
+        dicts of field name to value, or (key_fields, data_fields, action)
+        to override action per entry. With mod the entries are modified
+        instead of added.
+
+        Keys and data of the next batches are built while a writer thread
+        has the previous one in flight, with at most queue_depth batches
+        waiting. A failing batch does not stop the load: the entries the
+        server rejects are reported and the rest are counted as written.
+
+        Returns a dict with:
+            'entries':         entries written
+            'failed':          list of (key_fields, message)
+            'rpcs':            write requests sent
+            'seconds':         wall time of the whole load
+            'entries_per_sec': entries written per second
+        """
+        target = self._target(pipe)
+        write = self.table.entry_mod if mod else self.table.entry_add
+
+        # entries loaded in bulk are not tracked one by one
+        self.shadow.invalidate()
+
+        batches = queue.Queue(maxsize=queue_depth)
+        result = { 'entries': 0, 'failed': [], 'rpcs': 0 }
+        crashed = []
+
+        def writer():
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    return
+                if crashed:
+                    continue
+
+                key_fields, keys, data = batch
+                try:
+                    write(target, keys, data)
+                except gc.BfruntimeRpcException as e:
+                    entry_errors = getattr(e, 'errors', None)
+                    if not entry_errors:
+                        # the server did not say which entry failed
+                        entry_errors = [ (idx, e) for idx in range(len(keys)) ]
+
+                    for idx, err in entry_errors:
+                        message = getattr(err, 'message', None) or str(err)
+                        result['failed'].append((key_fields[idx], message))
+                    result['entries'] += len(keys) - len(entry_errors)
+                except Exception as e:
+                    crashed.append(e)
+                else:
+                    result['entries'] += len(keys)
+                finally:
+                    result['rpcs'] += 1
+
+        thread = threading.Thread(target=writer, name='bulk_load', daemon=True)
+        start = time.perf_counter()
+        thread.start()
+
+        try:
+            batch = ([], [], [])
+            for entry in entries:
+                key_fields, data_fields = entry[0], entry[1]
+                entry_action = entry[2] if len(entry) > 2 else action
+
+                batch[0].append(key_fields)
+                batch[1].append(self.table.make_key([
+                    gc.KeyTuple(field, value) for field, value in key_fields.items()
+                ]))
+                batch[2].append(self.table.make_data(data_tuples(data_fields), entry_action))
+
+                if len(batch[0]) == batch_size:
+                    batches.put(batch)
+                    batch = ([], [], [])
+                    if crashed:
+                        break
+
+            if batch[0]:
+                batches.put(batch)
+        finally:
+            batches.put(None)
+            thread.join()
+
+        if crashed:
+            raise crashed[0]
+
+        result['seconds'] = time.perf_counter() - start
+        result['entries_per_sec'] = result['entries'] / result['seconds'] if result['seconds'] else None
+
+        self.logger.info('Loaded {} entries in {:.3f}s ({:.0f}/s), {} failed'.format(
+            result['entries'], result['seconds'], result['entries_per_sec'] or 0, len(result['failed'])))
+
+        return result
+
+    def clear(self, batch_size=4096):
+        """
+        Remove all existing entries in self.table.
+
+        Backends that support it wipe the table with a single keyless
+        entry_del. Otherwise the entries are read with a wildcard entry_get
+        and deleted batch_size keys per request.
+        """
         if self.table is not None:
+            self.shadow.invalidate()
+
             # target all pipes on device 0
             target = gc.Target(device_id=0, pipe_id=0xffff)
 
-            # get all keys in self.table
+            try:
+                self.table.entry_del(target)
+            except Exception as e:
+                self.logger.info('Keyless delete not supported ({}), deleting by key'.format(e))
+
+            # get all keys left in self.table
             resp = self.table.entry_get(target, [], {"from_hw": False})
 
-            # delete all keys in self.table
+            # delete them in batches
+            keys = []
+            deleted = 0
             for _, key in resp:
-                if key:
-                    self.table.entry_del(target, [key])
+                if not key:
+                    continue
+
+                keys.append(key)
+                if len(keys) == batch_size:
+                    self.table.entry_del(target, keys)
+                    deleted += len(keys)
+                    keys = []
+
+            if keys:
+                self.table.entry_del(target, keys)
+                deleted += len(keys)
+
+            if deleted:
+                self.logger.info('Deleted {} entries in batches of {}'.format(deleted, batch_size))
 
         # # try to reinsert default entry if it exists
         # try:
         #     self.table.default_entry_reset(target)
         # except:
         #     pass
+
+    def iter_entries(self, from_hw=False):
+        """
+        Generator over the entries of self.table as (key_dict, data_dict),
+        streamed from a wildcard entry_get. key_dict maps key fields to
+        their value, data_dict is the data's to_dict().
+        """
+        target = gc.Target(device_id=0, pipe_id=0xffff)
+
+        for data, key in self.table.entry_get(target, [], {"from_hw": from_hw}):
+            key_dict = { field: value['value'] for field, value in key.to_dict().items() } if key else {}
+            yield key_dict, data.to_dict()
+
+    def _json_value(self, value):
+        if isinstance(value, (bytes, bytearray)):
+            return value.hex()
+        return value
+
+    def dump_table(self, fmt='text', out=None, from_hw=False):
+        """
+        Print the table info and all its entries. fmt 'json' writes one
+        JSON object per entry (JSON lines), 'csv' one row per entry, with
+        the columns of the first entry. out defaults to stdout. Entries are
+        streamed, so memory stays flat whatever the table size.
+        """
+        if fmt == 'text':
+            self._dump_table_text(from_hw)
+            return
+
+        out = out or sys.stdout
+
+        if fmt == 'json':
+            for key_dict, data_dict in self.iter_entries(from_hw):
+                json.dump({
+                    'key': key_dict,
+                    'data': { field: self._json_value(value) for field, value in data_dict.items() }
+                }, out)
+                out.write('\n')
+
+        elif fmt == 'csv':
+            writer = None
+            for key_dict, data_dict in self.iter_entries(from_hw):
+                row = dict(key_dict)
+                row.update((field, self._json_value(value)) for field, value in data_dict.items())
+
+                if writer is None:
+                    writer = csv.DictWriter(out, fieldnames=list(row), extrasaction='ignore')
+                    writer.writeheader()
+                writer.writerow(row)
+
+        else:
+            raise ValueError('Unknown dump format {}'.format(fmt))
     
-    def dump_table(self):
+    def _dump_table_text(self, from_hw=False):
         PADDING=30
         print()
         print("====================================================")
@@ -101,23 +363,19 @@ class Table(object):
         for attribute in attributes:
             print("    Name {}".format(attribute))
 
-        target = gc.Target(device_id=0, pipe_id=0xffff)
-        keys = self.table.entry_get(target, [], {"from_hw": False})
-
         print("self.table entries:")
-        for data, key in keys:
+        for key_dict, data_dict in self.iter_entries(from_hw):
             print("  -------------------------------------------------")
-            for key_field in key.to_dict().keys():
-                print("  {} {}".format(key_field.ljust(PADDING), key.to_dict()[key_field]['value']))
+            for key_field, value in key_dict.items():
+                print("  {} {}".format(key_field.ljust(PADDING), value))
 
-            for data_field in data.to_dict().keys():
+            for data_field, value in data_dict.items():
                 if data_field in [ 'is_default_entry', 'action_name' ]:
                     continue
 
-                print("  {} {}".format(data_field.ljust(PADDING), data.to_dict()[data_field]))
+                print("  {} {}".format(data_field.ljust(PADDING), value))
 
-            print("  {} {}".format("Actions".ljust(PADDING), data.to_dict()['action_name']))
+            print("  {} {}".format("Actions".ljust(PADDING), data_dict['action_name']))
 
         print("====================================================")
         print()
-            
\ No newline at end of file
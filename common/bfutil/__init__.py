@@ -1,6 +1,11 @@
 import sys
 import os
 
+# run against the in-process bfrt_grpc stand-in instead of a switch
+if os.environ.get('BFUTIL_FAKE_BFRT'):
+    from bfutil import fake_bfrt
+    fake_bfrt.install()
+
 # add BF Python to search path
 try:
     # Import BFRT GRPC stuff
@@ -18,5 +23,17 @@ except:
     import grpc
 
 from bfutil.Pktgen import *
+from bfutil.AsyncPktgen import *
+from bfutil.Capture import *
+from bfutil.Flows import *
+from bfutil.Instrument import *
+from bfutil.Latency import *
+from bfutil.Metrics import *
+from bfutil.Pcap import *
+from bfutil.Poller import *
+from bfutil.Rate import *
+from bfutil.Schedule import *
+from bfutil.Shadow import *
+from bfutil.Sweep import *
 from bfutil.Table import * 
 from bfutil.util import * 
\ No newline at end of file
@@ -0,0 +1,725 @@
+"""
+In-process stand-in for the SDE's bfrt_grpc.client.
+
+Models the fixed pktgen tables (port_cfg, app_cfg, pkt_buffer, and their
+$PKTGEN_* aliases) closely enough to run, profile and benchmark the
+controller code in this package without a switch or run_switchd.
+
+Export BFUTIL_FAKE_BFRT=1 and import bfutil (or run pktgenTxCounter.py)
+as usual: install() then registers this module as bfrt_grpc.client before
+anything imports it. The ClientInterface behaves like the real one:
+
+    c = gc.ClientInterface('localhost:50052', 0, 0)
+    c.bind_pipeline_config('prog')
+    bfrt_info = c.bfrt_info_get('prog')
+
+Clients of the same grpc address talk to the same FakeSwitch, available as
+fake_bfrt.switch(addr) for injecting RPC latency, firing non-timer triggers
+and reading RPC counts. Counters advance with the monotonic clock from the
+timer, batch and gap settings of each enabled app, capped at line rate.
+"""
+
+import sys
+import time
+import types
+import threading
+
+ALL_PIPES = 0xffff
+
+# google.rpc.Code values used in the per-entry errors
+OK = 0
+INVALID_ARGUMENT = 3
+NOT_FOUND = 5
+ALREADY_EXISTS = 6
+RESOURCE_EXHAUSTED = 8
+
+
+class Target(object):
+
+    def __init__(self, device_id=0, pipe_id=ALL_PIPES, direction=0xff, prsr_id=0xff):
+        self.device_id = device_id
+        self.pipe_id = pipe_id
+        self.direction = direction
+        self.prsr_id = prsr_id
+
+
+class KeyTuple(object):
+
+    def __init__(self, name, value=None, mask=None, prefix_len=None, low=None, high=None):
+        self.name = name
+        self.value = value
+        self.mask = mask
+        self.prefix_len = prefix_len
+        self.low = low
+        self.high = high
+
+
+class DataTuple(object):
+
+    def __init__(self, name, val=None, bool_val=None, int_arr_val=None,
+                 bool_arr_val=None, str_val=None, float_val=None):
+        self.name = name
+        self.val = val
+        self.bool_val = bool_val
+        self.int_arr_val = int_arr_val
+        self.bool_arr_val = bool_arr_val
+        self.str_val = str_val
+        self.float_val = float_val
+
+    def value(self):
+        for v in (self.val, self.bool_val, self.int_arr_val,
+                  self.bool_arr_val, self.str_val, self.float_val):
+            if v is not None:
+                return v
+        return None
+
+
+class BfruntimeException(Exception):
+    pass
+
+
+class _Error(object):
+
+    def __init__(self, canonical_code, message):
+        self.canonical_code = canonical_code
+        self.message = message
+
+    def __repr__(self):
+        return '_Error({}, {!r})'.format(self.canonical_code, self.message)
+
+
+class BfruntimeRpcException(Exception):
+    """
+    Mirrors the real exception: errors is a list of (index, error) for every
+    entry of the request that failed.
+    """
+
+    def __init__(self, errors):
+        super(BfruntimeRpcException, self).__init__(
+            '; '.join('[{}] {}'.format(idx, err.message) for idx, err in errors))
+        self.errors = errors
+
+    def get_errors(self):
+        return self.errors
+
+
+class BfruntimeReadWriteRpcException(BfruntimeRpcException):
+    pass
+
+
+class _Key(object):
+
+    def __init__(self, table, fields):
+        self.table = table
+        self.fields = fields
+
+    def _ident(self):
+        return tuple(sorted(self.fields.items()))
+
+    def to_dict(self):
+        return { name: { 'value': value } for name, value in self.fields.items() }
+
+
+class _Data(object):
+
+    def __init__(self, table, fields, action_name=None, get=False):
+        self.table = table
+        self.fields = fields
+        self.action_name = action_name
+        self.get = get
+
+    def to_dict(self):
+        d = dict(self.fields)
+        d['action_name'] = self.action_name
+        d['is_default_entry'] = False
+        return d
+
+
+class _TableInfo(object):
+
+    def __init__(self, table):
+        self.table = table
+
+    def id_get(self):
+        return self.table.table_id
+
+    def name_get(self):
+        return self.table.name
+
+    def action_name_list_get(self):
+        return list(self.table.actions)
+
+    def data_field_name_list_get(self, action_name=None):
+        names = list(self.table.data_fields)
+        if action_name is not None:
+            names += list(self.table.actions.get(action_name, ()))
+        return names
+
+    def key_field_name_list_get(self):
+        return list(self.table.key_fields)
+
+    def attributes_supported_get(self):
+        return []
+
+    def data_field_size_get(self, name, action_name=None):
+        bits = self.table.data_fields.get(name)
+        if bits is None:
+            for fields in self.table.actions.values():
+                if name in fields:
+                    bits = fields[name]
+        bits = bits or 0
+        return ((bits + 7) // 8, bits)
+
+    def data_field_type_get(self, name, action_name=None):
+        return 'UINT64'
+
+    def key_field_size_get(self, name):
+        bits = self.table.key_fields[name]
+        return ((bits + 7) // 8, bits)
+
+    def key_field_type_get(self, name):
+        return 'EXACT'
+
+
+class FakeTable(object):
+    """
+    A generic exact-match table. Entries are kept per pipe; writes to
+    ALL_PIPES go to every pipe, reads from ALL_PIPES see pipe 0.
+    """
+
+    # fixed tables treat entry_add on an existing key as a modify
+    upsert = False
+    pipe_scoped = True
+
+    def __init__(self, switch, name, key_fields, data_fields=None, actions=None, size=None):
+        self.switch = switch
+        self.name = name
+        self.table_id = len(switch.tables) + 1
+        self.key_fields = key_fields
+        self.data_fields = data_fields or {}
+        self.actions = actions or {}
+        self.size = size
+        self.entries = [ {} for _ in range(switch.num_pipes) ]
+        self.info = _TableInfo(self)
+
+    # -- object construction --
+
+    def make_key(self, key_field_list_in):
+        return _Key(self, { k.name: k.value for k in key_field_list_in })
+
+    def make_data(self, data_field_list_in, action_name=None, get=False):
+        return _Data(
+            self,
+            { d.name: d.value() for d in data_field_list_in },
+            action_name,
+            get
+        )
+
+    # -- validation --
+
+    def _pipes(self, target):
+        if not self.pipe_scoped or target.pipe_id == ALL_PIPES:
+            return range(self.switch.num_pipes) if self.pipe_scoped else [0]
+        if target.pipe_id >= self.switch.num_pipes:
+            raise BfruntimeRpcException(
+                [(0, _Error(INVALID_ARGUMENT, 'invalid pipe {}'.format(target.pipe_id)))])
+        return [target.pipe_id]
+
+    def _check_key(self, key):
+        if set(key.fields) != set(self.key_fields):
+            return 'key fields {} do not match {}'.format(
+                sorted(key.fields), sorted(self.key_fields))
+        for name, value in key.fields.items():
+            if not isinstance(value, int) or value < 0 or value >= 1 << self.key_fields[name]:
+                return 'key field {} value {!r} out of range'.format(name, value)
+        return None
+
+    def _check_data(self, data):
+        allowed = dict(self.data_fields)
+        if self.actions:
+            if data.action_name not in self.actions:
+                return 'unknown action {!r}'.format(data.action_name)
+            allowed.update(self.actions[data.action_name])
+        for name, value in data.fields.items():
+            if name not in allowed:
+                return 'unknown data field {!r}'.format(name)
+            bits = allowed[name]
+            if isinstance(value, bool) or value is None:
+                continue
+            if isinstance(value, (bytes, bytearray)):
+                if bits and len(value) * 8 > bits:
+                    return 'data field {} too long'.format(name)
+                continue
+            if value < 0 or value >= 1 << bits:
+                return 'data field {} value {} out of range'.format(name, value)
+        return None
+
+    def _check_entry(self, pipe, key, data):
+        """Hook for table specific checks. Returns an error string or None."""
+        return None
+
+    # -- RPCs --
+
+    def _write(self, op, target, key_list, data_list):
+        self.switch._rpc(self.name, op, len(key_list))
+        pipes = self._pipes(target)
+        errors = []
+
+        with self.switch.lock:
+            for idx, key in enumerate(key_list):
+                data = data_list[idx] if data_list is not None else None
+
+                msg = self._check_key(key)
+                if msg is None and data is not None:
+                    msg = self._check_data(data)
+                if msg is not None:
+                    errors.append((idx, _Error(INVALID_ARGUMENT, msg)))
+                    continue
+
+                ident = key._ident()
+                code = OK
+                for pipe in pipes:
+                    entries = self.entries[pipe]
+                    exists = ident in entries
+
+                    if op == 'add' and exists and not self.upsert:
+                        code, msg = ALREADY_EXISTS, 'entry already exists'
+                    elif op in ('mod', 'del') and not exists and not self.upsert:
+                        code, msg = NOT_FOUND, 'entry not found'
+                    elif op == 'add' and not exists and self.size is not None \
+                            and len(entries) >= self.size:
+                        code, msg = RESOURCE_EXHAUSTED, 'table full'
+                    elif data is not None:
+                        msg = self._check_entry(pipe, key, data)
+                        if msg is not None:
+                            code = INVALID_ARGUMENT
+                    if code != OK:
+                        break
+
+                if code != OK:
+                    errors.append((idx, _Error(code, msg)))
+                    continue
+
+                for pipe in pipes:
+                    if op == 'del':
+                        self.entries[pipe].pop(ident, None)
+                        self._deleted(pipe, key)
+                    else:
+                        self._store(pipe, key, data, op == 'mod')
+
+        if errors:
+            raise BfruntimeRpcException(errors)
+
+    def _store(self, pipe, key, data, merge):
+        ident = key._ident()
+        entries = self.entries[pipe]
+        if merge and ident in entries:
+            old_key, old_data = entries[ident]
+            fields = dict(old_data.fields)
+            fields.update(data.fields)
+            action = data.action_name or old_data.action_name
+        else:
+            fields = dict(data.fields)
+            action = data.action_name
+        entries[ident] = (key, _Data(self, fields, action))
+
+    def _deleted(self, pipe, key):
+        pass
+
+    def _read(self, pipe, key, data, from_hw):
+        return data
+
+    def entry_add(self, target, key_list=None, data_list=None, p4_name=None):
+        self._write('add', target, key_list or [], data_list)
+
+    def entry_mod(self, target, key_list=None, data_list=None, flags={}, p4_name=None):
+        self._write('mod', target, key_list or [], data_list)
+
+    def entry_del(self, target, key_list=None, p4_name=None):
+        if not key_list:
+            self.switch._rpc(self.name, 'del', 0)
+            with self.switch.lock:
+                for pipe in self._pipes(target):
+                    self.entries[pipe].clear()
+            return
+        self._write('del', target, key_list, None)
+
+    def entry_get(self, target, key_list=None, flags={'from_hw': True},
+                  required_data=None, p4_name=None):
+        self.switch._rpc(self.name, 'get', len(key_list or []))
+        pipe = target.pipe_id if target.pipe_id != ALL_PIPES else 0
+        if not self.pipe_scoped:
+            pipe = 0
+        from_hw = flags.get('from_hw', True)
+        entries = self.entries[pipe]
+        wanted = list(required_data.fields) if required_data is not None else None
+
+        with self.switch.lock:
+            if key_list:
+                found = []
+                errors = []
+                for idx, key in enumerate(key_list):
+                    item = entries.get(key._ident())
+                    if item is None:
+                        errors.append((idx, _Error(NOT_FOUND, 'entry not found')))
+                    else:
+                        found.append(item)
+                if errors:
+                    raise BfruntimeRpcException(errors)
+            else:
+                found = list(entries.values())
+
+            result = []
+            for key, data in found:
+                data = self._read(pipe, key, data, from_hw)
+                fields = data.fields
+                if wanted:
+                    fields = { name: fields.get(name) for name in wanted }
+                result.append((_Data(self, dict(fields), data.action_name), key))
+
+        return iter(result)
+
+    def default_entry_reset(self, target):
+        pass
+
+
+class PortCfgTable(FakeTable):
+    upsert = True
+    pipe_scoped = False
+
+    def _check_key(self, key):
+        msg = FakeTable._check_key(self, key)
+        if msg is None and (key.fields['dev_port'] & 0x7f) not in self.switch.pktgen_ports:
+            msg = 'dev_port {} is not a pktgen port'.format(key.fields['dev_port'])
+        if msg is None and (key.fields['dev_port'] >> 7) >= self.switch.num_pipes:
+            msg = 'dev_port {} is on a pipe that does not exist'.format(key.fields['dev_port'])
+        return msg
+
+    def __init__(self, *args, **kwargs):
+        FakeTable.__init__(self, *args, **kwargs)
+        # fixed table: every pktgen port of every pipe has an entry
+        for pipe in range(self.switch.num_pipes):
+            for port in self.switch.pktgen_ports:
+                key = self.make_key([ KeyTuple('dev_port', (pipe << 7) | port) ])
+                FakeTable._store(self, 0, key, self.make_data([
+                    DataTuple(name, bool_val=False) for name in self.data_fields
+                ]), False)
+
+    def _store(self, pipe, key, data, merge):
+        FakeTable._store(self, pipe, key, data, True)
+
+
+class PktBufferTable(FakeTable):
+    upsert = True
+
+    def _check_key(self, key):
+        msg = FakeTable._check_key(self, key)
+        if msg is not None:
+            return msg
+        offset = key.fields['pkt_buffer_offset']
+        size = key.fields['pkt_buffer_size']
+        if offset % self.switch.buffer_alignment:
+            return 'pkt_buffer_offset {} is not {}B aligned'.format(
+                offset, self.switch.buffer_alignment)
+        if size == 0 or offset + size > self.switch.buffer_size:
+            return 'pkt_buffer region [{}, {}) out of range'.format(offset, offset + size)
+        return None
+
+    def _check_entry(self, pipe, key, data):
+        buf = data.fields.get('buffer')
+        if buf is not None and len(buf) != key.fields['pkt_buffer_size']:
+            return 'buffer length {} does not match pkt_buffer_size {}'.format(
+                len(buf), key.fields['pkt_buffer_size'])
+        return None
+
+    def _store(self, pipe, key, data, merge):
+        offset = key.fields['pkt_buffer_offset']
+        buf = bytes(data.fields.get('buffer', b''))
+        self.switch.buffers[pipe][offset:offset + len(buf)] = buf
+        # the hardware buffer has no notion of entries; forget any region
+        # that the new write overlaps
+        end = offset + len(buf)
+        entries = self.entries[pipe]
+        for ident, (k, _) in list(entries.items()):
+            o = k.fields['pkt_buffer_offset']
+            if o < end and offset < o + k.fields['pkt_buffer_size']:
+                del entries[ident]
+        entries[key._ident()] = (key, _Data(self, { 'buffer': bytearray(buf) }))
+
+
+class _AppState(object):
+
+    def __init__(self):
+        self.enabled_at = None
+        self.base = { 'batch_counter': 0, 'pkt_counter': 0, 'trigger_counter': 0 }
+        self.events = []
+
+
+class AppCfgTable(FakeTable):
+    upsert = True
+
+    COUNTERS = ('batch_counter', 'pkt_counter', 'trigger_counter')
+
+    def __init__(self, *args, **kwargs):
+        FakeTable.__init__(self, *args, **kwargs)
+        self.state = [ {} for _ in range(self.switch.num_pipes) ]
+
+    def _check_key(self, key):
+        msg = FakeTable._check_key(self, key)
+        if msg is None and key.fields['app_id'] >= self.switch.num_apps:
+            msg = 'app_id {} out of range'.format(key.fields['app_id'])
+        return msg
+
+    def _check_entry(self, pipe, key, data):
+        port = data.fields.get('pipe_local_source_port')
+        if port is not None and port not in self.switch.pktgen_ports:
+            return 'pipe_local_source_port {} is not a pktgen port'.format(port)
+        return None
+
+    def _app(self, pipe, key):
+        return self.state[pipe].setdefault(key.fields['app_id'], _AppState())
+
+    def _store(self, pipe, key, data, merge):
+        app = self._app(pipe, key)
+        now = self.switch.clock()
+        old = self.entries[pipe].get(key._ident())
+
+        # freeze the running counters before any field changes
+        if old is not None:
+            app.base = self._counters(pipe, old[0], old[1], now)
+            if app.enabled_at is not None:
+                app.enabled_at = now
+                app.events = []
+
+        fields = dict(data.fields)
+        for name in self.COUNTERS:
+            if name in fields:
+                app.base[name] = fields.pop(name) or 0
+
+        FakeTable._store(self, pipe, key, _Data(self, fields, data.action_name), merge)
+
+        enabled = self.entries[pipe][key._ident()][1].fields.get('app_enable')
+        if enabled and app.enabled_at is None:
+            app.enabled_at = now
+            app.events = []
+        elif not enabled:
+            app.enabled_at = None
+
+    def _deleted(self, pipe, key):
+        self.state[pipe].pop(key.fields['app_id'], None)
+
+    def _triggers(self, pipe, app, fields, action, now):
+        if app.enabled_at is None:
+            return 0
+        elapsed = now - app.enabled_at
+        timer = fields.get('timer_nanosec') or 0
+        if action.endswith('TIMER_ONE_SHOT') or action.endswith('timer_one_shot'):
+            return 1 if elapsed >= timer else 0
+        if action.endswith('TIMER_PERIODIC') or action.endswith('timer_periodic'):
+            period = max(timer, self._emission_ns(fields))
+            return int(elapsed // period) if period else 0
+        return len([ t for t in app.events if t <= now ])
+
+    def _emission_ns(self, fields):
+        # time the port needs to push one trigger's worth of packets
+        pkt_len = (fields.get('pkt_len') or 0) + 6
+        packets = ((fields.get('packets_per_batch_cfg') or 0) + 1)
+        batches = ((fields.get('batch_count_cfg') or 0) + 1)
+        wire_ns = (pkt_len + 20) * 8 / self.switch.port_gbps
+        ipg = fields.get('ipg') or 0
+        ibg = fields.get('ibg') or 0
+        return batches * (packets * max(wire_ns, ipg)) + (batches - 1) * ibg
+
+    def _counters(self, pipe, key, data, now):
+        app = self._app(pipe, key)
+        fields = data.fields
+        triggers = self._triggers(pipe, app, fields, data.action_name or '', now)
+        batches = triggers * ((fields.get('batch_count_cfg') or 0) + 1)
+        packets = batches * ((fields.get('packets_per_batch_cfg') or 0) + 1)
+        return {
+            'batch_counter': app.base['batch_counter'] + batches,
+            'pkt_counter': app.base['pkt_counter'] + packets,
+            'trigger_counter': app.base['trigger_counter'] + triggers,
+        }
+
+    def _read(self, pipe, key, data, from_hw):
+        fields = dict(data.fields)
+        counters = self._counters(pipe, key, data, self.switch.clock())
+        if not from_hw:
+            counters = dict(self._app(pipe, key).base)
+        fields.update(counters)
+        return _Data(self, fields, data.action_name)
+
+
+_COMMON_APP_FIELDS = {
+    'app_enable': 1,
+    'pkt_len': 14,
+    'pkt_buffer_offset': 14,
+    'pipe_local_source_port': 7,
+    'increment_source_port': 1,
+    'batch_count_cfg': 16,
+    'packets_per_batch_cfg': 16,
+    'ibg': 32,
+    'ibg_jitter': 32,
+    'ipg': 32,
+    'ipg_jitter': 32,
+    'batch_counter': 64,
+    'pkt_counter': 64,
+    'trigger_counter': 64,
+}
+
+_TRIGGER_FIELDS = {
+    'trigger_timer_one_shot': { 'timer_nanosec': 32 },
+    'trigger_timer_periodic': { 'timer_nanosec': 32 },
+    'trigger_port_down': { 'port_mask_sel': 1 },
+    'trigger_recirc_pattern': { 'pattern_value': 32, 'pattern_mask': 32 },
+    'trigger_dprsr': { 'pattern_value': 32, 'pattern_mask': 32 },
+    'trigger_pfc': {
+        'pfc_hdr': 128, 'pfc_timer_enable': 1, 'pfc_timer': 16, 'pfc_max_msgs': 10
+    },
+}
+
+
+class FakeSwitch(object):
+    """
+    One emulated device. Holds the tables, the RPC counters and the knobs
+    used to shape the emulation.
+    """
+
+    def __init__(self, num_pipes=4, num_apps=8, buffer_size=16384,
+                 buffer_alignment=16, port_gbps=100, rpc_latency=0.0):
+        self.num_pipes = num_pipes
+        self.num_apps = num_apps
+        self.buffer_size = buffer_size
+        self.buffer_alignment = buffer_alignment
+        self.port_gbps = port_gbps
+        self.rpc_latency = rpc_latency
+        self.pktgen_ports = range(68, 72)
+        self.lock = threading.RLock()
+        self.rpc_counts = {}
+        self.buffers = [ bytearray(buffer_size) for _ in range(num_pipes) ]
+        self.tables = {}
+
+        app_actions = {}
+        for name, fields in _TRIGGER_FIELDS.items():
+            app_actions[name] = fields
+            app_actions['$PKTGEN_' + name.upper()] = fields
+
+        self._add(PortCfgTable(self, 'port_cfg', { 'dev_port': 9 }, {
+            'pktgen_enable': 1, 'recirculation_enable': 1, 'clear_port_down_enable': 1
+        }), '$PKTGEN_PORT_CFG')
+        self._add(AppCfgTable(self, 'app_cfg', { 'app_id': 4 }, _COMMON_APP_FIELDS,
+                              app_actions), '$PKTGEN_APPLICATION_CFG')
+        self._add(PktBufferTable(self, 'pkt_buffer', {
+            'pkt_buffer_offset': 14, 'pkt_buffer_size': 14
+        }, { 'buffer': buffer_size * 8 }), '$PKTGEN_PKT_BUFFER')
+        self._add(FakeTable(self, 'port_mask', { 'port_mask_sel': 1 }, { 'mask': 72 }),
+                  '$PKTGEN_PORT_MASK')
+
+    def _add(self, table, alias=None):
+        self.tables[table.name] = table
+        if alias is not None:
+            self.tables[alias] = table
+
+    def add_table(self, name, key_fields, data_fields=None, actions=None, size=None):
+        """Add a generic exact-match table, e.g. to exercise Table.bulk_load."""
+        table = FakeTable(self, name, key_fields, data_fields, actions, size)
+        self.tables[name] = table
+        return table
+
+    def clock(self):
+        return time.monotonic_ns()
+
+    def _rpc(self, table, op, n):
+        with self.lock:
+            k = (table, op)
+            self.rpc_counts[k] = self.rpc_counts.get(k, 0) + 1
+        if self.rpc_latency:
+            time.sleep(self.rpc_latency)
+
+    def rpc_total(self):
+        return sum(self.rpc_counts.values())
+
+    def reset_rpc_counts(self):
+        with self.lock:
+            self.rpc_counts = {}
+
+    def fire_trigger(self, pipe, app_id, at=None):
+        """
+        Record an external event (port down, recirculated pattern, ...) for
+        an event triggered app. It only counts while the app is enabled.
+        """
+        table = self.tables['app_cfg']
+        with self.lock:
+            app = table.state[pipe].get(app_id)
+            if app is not None and app.enabled_at is not None:
+                app.events.append(self.clock() if at is None else at)
+
+
+class _BfRtInfo(object):
+
+    def __init__(self, switch, p4_name):
+        self.switch = switch
+        self.p4_name = p4_name
+
+    def table_get(self, name):
+        try:
+            return self.switch.tables[name]
+        except KeyError:
+            raise BfruntimeException('Table {} not found'.format(name))
+
+    def table_name_list_get(self):
+        return list(self.switch.tables)
+
+
+class ClientInterface(object):
+
+    def __init__(self, grpc_addr, client_id=0, device_id=0, notifications=None,
+                 timeout=1, num_tries=5, perform_subscribe=True):
+        self.grpc_addr = grpc_addr
+        self.client_id = client_id
+        self.device_id = device_id
+        self.p4_name = None
+        self.switch = switch(grpc_addr)
+
+    def bind_pipeline_config(self, p4_name):
+        self.p4_name = p4_name
+
+    def bfrt_info_get(self, p4_name=None):
+        return _BfRtInfo(self.switch, p4_name or self.p4_name)
+
+    def tear_down_stream(self):
+        pass
+
+
+_switches = {}
+
+
+def switch(grpc_addr='localhost:50052', **kwargs):
+    """
+    Return the FakeSwitch behind grpc_addr, creating it on first use with
+    kwargs passed to FakeSwitch.
+    """
+    if grpc_addr not in _switches:
+        _switches[grpc_addr] = FakeSwitch(**kwargs)
+    return _switches[grpc_addr]
+
+
+def install():
+    """
+    Register this module as bfrt_grpc.client (and empty bfrt_grpc.bfruntime_pb2
+    and grpc modules when the real ones are missing).
+    """
+    package = types.ModuleType('bfrt_grpc')
+    package.__path__ = []
+    package.client = sys.modules[__name__]
+    package.bfruntime_pb2 = types.ModuleType('bfrt_grpc.bfruntime_pb2')
+
+    sys.modules['bfrt_grpc'] = package
+    sys.modules['bfrt_grpc.client'] = package.client
+    sys.modules['bfrt_grpc.bfruntime_pb2'] = package.bfruntime_pb2
+
+    try:
+        import grpc
+    except ImportError:
+        sys.modules['grpc'] = types.ModuleType('grpc')
@@ -1,21 +1,150 @@
 from scapy.all import *
-from scapy.utils import PcapWriter
+
+import random
+import socket
+import struct
 
 from random import randint
+from collections import OrderedDict
+
+from bfutil.Capture import RingCapture, TIMESTAMP_TRAILER_FMT, TIMESTAMP_TRAILER_LEN
 
 def port_to_pipe(port):
     local_port = port & 0x7F
     pipe = port >> 7
     return pipe
 
-def simple_eth_pkt(pktlen, dmac=None):
+def simple_eth_pkt(pktlen, dmac=None, smac=None):
     if dmac:
-        pkt = Ether(dst=dmac)
+        pkt = Ether(dst=dmac) if smac is None else Ether(dst=dmac, src=smac)
     else:
         pkt = Ether(src='AA:AA:AA:AA:AA:AA',dst='FF:FF:FF:FF:FF:FF') / IP() / UDP()
     pkt = pkt / Raw('\x00' * (pktlen - len(pkt)))
     return pkt
 
+ETH_HDR_LEN = 14
+IPV4_HDR_LEN = 20
+UDP_HDR_LEN = 8
+
+ETH_TYPE_IPV4 = 0x0800
+# what scapy puts in an Ether with no known payload
+ETH_TYPE_LOOP = 0x9000
+
+def mac_to_bytes(mac):
+    if isinstance(mac, (bytes, bytearray)):
+        return bytes(mac)
+    return bytes(int(octet, 16) for octet in mac.split(':'))
+
+def inet_checksum(data, initial=0):
+    """The 16 bit one's complement checksum of IP, UDP and TCP."""
+    if len(data) % 2:
+        data = bytes(data) + b'\x00'
+
+    total = initial + sum(struct.unpack('!{}H'.format(len(data) // 2), data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+
+    return ~total & 0xFFFF
+
+def eth_ipv4_udp_pkt(pktlen, dmac='ff:ff:ff:ff:ff:ff', smac='aa:aa:aa:aa:aa:aa',
+                     src_ip='127.0.0.1', dst_ip='127.0.0.1', sport=53, dport=53,
+                     ttl=64, ip_id=1):
+    """
+    Ethernet/IPv4/UDP packet of pktlen bytes with a zero payload and both
+    checksums, as a bytearray. The defaults are scapy's, so
+    eth_ipv4_udp_pkt(n) is bytes(simple_eth_pkt(n)) without scapy.
+    """
+    ip_len = pktlen - ETH_HDR_LEN
+    udp_len = ip_len - IPV4_HDR_LEN
+    assert udp_len >= UDP_HDR_LEN
+
+    src = socket.inet_aton(src_ip)
+    dst = socket.inet_aton(dst_ip)
+
+    pkt = bytearray(pktlen)
+    pkt[0:6] = mac_to_bytes(dmac)
+    pkt[6:12] = mac_to_bytes(smac)
+    struct.pack_into('!H', pkt, 12, ETH_TYPE_IPV4)
+
+    struct.pack_into('!BBHHHBBH4s4s', pkt, ETH_HDR_LEN,
+                     0x45, 0, ip_len, ip_id, 0, ttl, socket.IPPROTO_UDP, 0, src, dst)
+    struct.pack_into('!H', pkt, ETH_HDR_LEN + 10,
+                     inet_checksum(pkt[ETH_HDR_LEN:ETH_HDR_LEN + IPV4_HDR_LEN]))
+
+    udp = ETH_HDR_LEN + IPV4_HDR_LEN
+    struct.pack_into('!HHHH', pkt, udp, sport, dport, udp_len, 0)
+
+    pseudo = struct.pack('!4s4sBBH', src, dst, 0, socket.IPPROTO_UDP, udp_len)
+    checksum = inet_checksum(bytes(pkt[udp:]), sum(struct.unpack('!6H', pseudo)))
+    struct.pack_into('!H', pkt, udp + 6, checksum or 0xFFFF)
+
+    return pkt
+
+def simple_eth_bytes(pktlen, dmac=None, smac=None):
+    """
+    bytes(simple_eth_pkt(pktlen, dmac, smac)), built without scapy. With
+    a dmac and no smac, scapy is only asked for the source MAC it would
+    pick (that of the interface routing to dmac).
+    """
+    if not dmac:
+        return eth_ipv4_udp_pkt(pktlen)
+
+    if smac is None:
+        smac = Ether(dst=dmac).src
+
+    pkt = bytearray(pktlen)
+    pkt[0:6] = mac_to_bytes(dmac)
+    pkt[6:12] = mac_to_bytes(smac)
+    struct.pack_into('!H', pkt, 12, ETH_TYPE_LOOP)
+    return pkt
+
+class PktBufferCache():
+    """
+    LRU cache of pkt_buffer contents, keyed by (pktlen, dmac, smac).
+
+    Building a packet is by far the most expensive part of
+    programming an app, and the same few lengths get written over and over
+    when sweeping packet sizes; the default size holds every length from
+    64 to 1518 bytes (about 1.2MB). Entries hold the bytes as they go into the
+    'buffer' field: the packet without its first 6 bytes, which pktgen
+    replaces with its own header. get() returns the cached bytearray
+    itself, so callers must not modify it.
+    """
+
+    def __init__(self, maxsize=2048):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, pktlen, dmac=None, smac=None):
+        key = (pktlen, dmac, smac)
+
+        buf = self.entries.get(key)
+        if buf is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return buf
+
+        self.misses += 1
+        buf = simple_eth_bytes(pktlen, dmac, smac)[6:]
+
+        self.entries[key] = buf
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+        return buf
+
+    def clear(self):
+        self.entries.clear()
+
 def pgen_timer_hdr_to_dmac(pipe_id, app_id, batch_id, packet_id):
     """
     Given the fields of a 6-byte packet-gen header return an Ethernet MAC address
@@ -29,23 +158,189 @@ def pgen_timer_hdr_to_dmac(pipe_id, app_id, batch_id, packet_id):
                                             packet_id >> 8,
                                             packet_id & 0xFF)
 
+def pktgen_pkt_template(app_cfg):
+    """
+    The packet an app of app_cfg sends, as a bytearray: the custom packet
+    of set_packet or the default Ethernet/IPv4/UDP one, the same bytes
+    Pktgen writes to pkt_buffer. Its first 6 bytes are left for the
+    pktgen header.
+    """
+    cfg = app_cfg.get_config()
+
+    if cfg['pkt_buffer'] is not None:
+        return bytearray(cfg['pkt_buffer'])
+    return eth_ipv4_udp_pkt(cfg['pkt_len'])
+
 def build_expected_pkts(app_cfg, pktgen_pipe_id, g_timer_app_id):
-    cfg = app_cfg.get_cfg()
+    buf, pktlen = build_expected_pkt_buffer(app_cfg, pktgen_pipe_id, g_timer_app_id)
+    return [ Ether(bytes(pkt)) for pkt in iter_pkt_buffer(buf, pktlen) ]
+
+def pgen_timer_hdr_pack_into(buf, offset, pipe_id, app_id, batch_id, packet_id):
+    """Write the 6 bytes pgen_timer_hdr_to_dmac encodes at buf[offset]."""
+    pipe_shift = 3
+    struct.pack_into('!BBHH', buf, offset, (pipe_id << pipe_shift) | app_id, 0, batch_id, packet_id)
+
+def build_expected_pkt_buffer(app_cfg, pktgen_pipe_id, g_timer_app_id):
+    """
+    The packets of build_expected_pkts as raw bytes, back to back in one
+    bytearray, without scapy: the template is built once and only the
+    pktgen header of each copy is patched. Returns the buffer and the packet
+    length; packet i is buf[i * pktlen:(i + 1) * pktlen], and
+    iter_pkt_buffer hands them out as memoryviews.
+    """
+    cfg = app_cfg.get_config()
 
     pktlen = cfg['pkt_len']
     p_count = cfg['packets_per_batch_cfg']
     b_count = cfg['batch_count_cfg']
 
-    pkt_lst = []
-    pkt_len = [pktlen] * p_count * b_count
+    buf = pktgen_pkt_template(app_cfg) * (p_count * b_count)
 
+    offset = 0
     for batch in range(b_count):
         for pkt_num in range(p_count):
-            dmac = pgen_timer_hdr_to_dmac(pktgen_pipe_id, g_timer_app_id, batch, pkt_num)
-            p_exp = simple_eth_pkt(pktlen=pktlen, dmac=dmac)
-            pkt_lst.append(p_exp)
+            pgen_timer_hdr_pack_into(buf, offset, pktgen_pipe_id, g_timer_app_id, batch, pkt_num)
+            offset += pktlen
+
+    return buf, pktlen
+
+def iter_pkt_buffer(buf, pktlen):
+    """Generator of memoryviews of the packets of a packet buffer."""
+    view = memoryview(buf)
+    for offset in range(0, len(buf), pktlen):
+        yield view[offset:offset + pktlen]
+
+def pgen_timer_hdr_decode(pkt):
+    """
+    (pipe_id, app_id, batch_id, packet_id) of the 6-byte pktgen timer
+    header at the start of pkt, which is also what pgen_timer_hdr_to_dmac
+    encodes in a dmac.
+    """
+    pipe_shift = 3
+    first, _, batch_id, packet_id = struct.unpack_from('!BBHH', pkt)
+    return first >> pipe_shift, first & ((1 << pipe_shift) - 1), batch_id, packet_id
+
+class ExpectedPkts():
+    """
+    The packets one trigger of a timer app sends, as build_expected_pkts
+    makes them, without storing them: packet i is built when asked for and
+    a received packet is matched by decoding its pktgen header, in constant
+    time whatever the batch sizes.
+
+    check() tracks what was received in bitmaps of one bit per expected
+    packet: seen, duplicated and reordered (arrived after a packet that
+    comes later). Whatever is not seen at the end is lost.
+
+        expected = ExpectedPkts(config, pipe, app_id)
+        for pkt in received:
+            expected.check(pkt)
+        print(expected.report())
+    """
+
+    def __init__(self, app_cfg, pktgen_pipe_id, g_timer_app_id, check_payload=True):
+        cfg = app_cfg.get_config()
+
+        self.pipe_id = pktgen_pipe_id
+        self.app_id = g_timer_app_id
+        self.pktlen = cfg['pkt_len']
+        self.p_count = cfg['packets_per_batch_cfg']
+        self.b_count = cfg['batch_count_cfg']
+        self.check_payload = check_payload
 
-    return pkt_lst
+        self.template = pktgen_pkt_template(app_cfg)
+        self.reset()
+
+    def reset(self):
+        """Forget what was received, e.g. before the next trigger."""
+        n = len(self)
+        self.seen = bytearray((n + 7) // 8)
+        self.duplicated = bytearray((n + 7) // 8)
+        self.reordered = bytearray((n + 7) // 8)
+        self.highest = -1
+        self.received = 0
+        self.duplicates = 0
+        self.reorders = 0
+        self.unexpected = 0
+
+    def __len__(self):
+        return self.p_count * self.b_count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('packet {} of {}'.format(i, len(self)))
+
+        pkt = bytearray(self.template)
+        pgen_timer_hdr_pack_into(pkt, 0, self.pipe_id, self.app_id, i // self.p_count, i % self.p_count)
+        return pkt
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def index(self, pkt):
+        """Position of pkt in the expected sequence, or None if it is not one of them."""
+        if len(pkt) != self.pktlen:
+            return None
+
+        pipe_id, app_id, batch_id, packet_id = pgen_timer_hdr_decode(pkt)
+        if pipe_id != self.pipe_id or app_id != self.app_id:
+            return None
+        if batch_id >= self.b_count or packet_id >= self.p_count:
+            return None
+        if self.check_payload and memoryview(pkt)[6:] != memoryview(self.template)[6:]:
+            return None
+
+        return batch_id * self.p_count + packet_id
+
+    def check(self, pkt):
+        """
+        Account for a received packet. Returns 'ok', 'duplicate',
+        'reordered' or 'unexpected'.
+        """
+        i = self.index(pkt)
+        if i is None:
+            self.unexpected += 1
+            return 'unexpected'
+
+        byte, bit = i >> 3, 1 << (i & 7)
+        self.received += 1
+
+        if self.seen[byte] & bit:
+            self.duplicated[byte] |= bit
+            self.duplicates += 1
+            return 'duplicate'
+
+        self.seen[byte] |= bit
+
+        if i < self.highest:
+            self.reordered[byte] |= bit
+            self.reorders += 1
+            return 'reordered'
+
+        self.highest = i
+        return 'ok'
+
+    def _bits(self, bitmap, value):
+        for i in range(len(self)):
+            if bool(bitmap[i >> 3] & (1 << (i & 7))) == value:
+                yield i
+
+    def lost(self):
+        """Generator of the positions of the packets not received."""
+        return self._bits(self.seen, False)
+
+    def report(self):
+        n_seen = sum(bin(byte).count('1') for byte in self.seen)
+        return {
+            'expected': len(self),
+            'received': self.received,
+            'lost': len(self) - n_seen,
+            'duplicates': self.duplicates,
+            'reordered': self.reorders,
+            'unexpected': self.unexpected,
+        }
 
 def random_mac():
     return '02:00:00:{:02x}:{:02x}:{:02x}'.format(
@@ -62,6 +357,10 @@ def random_port():
     return random.randint(1,10000)
 
 def create_random_flows(n):
+    """
+    List of n random flows as dicts. For large flow sets use
+    bfutil.Flows.FlowGenerator, which makes them in NumPy arrays.
+    """
     flows = []
     for i in range(n):
         flows.append({
@@ -73,8 +372,8 @@ def create_random_flows(n):
     return flows
 
 def get_timestamped_pkt_from_iface(iface):
-    pkts = sniff(iface=iface, count=1)
-    pkt = bytes(pkts[0])
+    with RingCapture(iface, block_nr=4) as capture:
+        _, pkt = next(capture.packets())
 
     print(pkt)
 
@@ -83,7 +382,7 @@ def get_timestamped_pkt_from_iface(iface):
     ts_ingress_mac, ts_ingress_global, \
         ts_enqueue, ts_dequeue_delta, \
         ts_egress_global, ts_egress_tx = \
-        struct.unpack("!QQIIQQ", pkt[-40:])
+        struct.unpack(TIMESTAMP_TRAILER_FMT, pkt[-TIMESTAMP_TRAILER_LEN:])
 
     ns = 1000000000.0
     print("Timestamps")
@@ -0,0 +1,32 @@
+import os
+import sys
+
+# the tests run against the in-process bfrt_grpc stand-in
+os.environ['BFUTIL_FAKE_BFRT'] = '1'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+
+from bfutil import fake_bfrt
+from bfutil.Pktgen import Pktgen
+
+import bfrt_grpc.client as gc
+
+@pytest.fixture
+def bfrt(request):
+    """A fresh FakeSwitch, a client bound to it and its bfrt_info."""
+    addr = 'test:{}'.format(request.node.name)
+    fake_bfrt._switches.pop(addr, None)
+    switch = fake_bfrt.switch(addr)
+
+    client = gc.ClientInterface(addr, 0, 0)
+    client.bind_pipeline_config('test')
+
+    yield switch, client, client.bfrt_info_get('test')
+
+    fake_bfrt._switches.pop(addr, None)
+
+@pytest.fixture
+def pktgen(bfrt):
+    switch, client, bfrt_info = bfrt
+    return Pktgen(client, bfrt_info)
@@ -0,0 +1,74 @@
+import pytest
+
+from bfutil.Pktgen import PktBufferAllocator, PktBufferExhausted
+
+def test_alloc_aligned_and_disjoint():
+    buffers = PktBufferAllocator(size=1024, alignment=16)
+    offsets = [ buffers.alloc(owner, 100) for owner in range(5) ]
+
+    assert all(offset % 16 == 0 for offset in offsets)
+    spans = sorted((offset, offset + 112) for offset in offsets)
+    assert all(a[1] <= b[0] for a, b in zip(spans, spans[1:]))
+
+def test_same_template_shares_region():
+    buffers = PktBufferAllocator()
+    a = buffers.alloc('a', 100, template=(100, None))
+    b = buffers.alloc('b', 100, template=(100, None))
+
+    assert a == b
+    assert buffers.users(a) == 2
+
+    buffers.free('a')
+    assert buffers.users(b) == 1
+    buffers.free('b')
+    assert buffers.regions == {}
+
+def test_realloc_releases_previous_region():
+    buffers = PktBufferAllocator(size=256)
+    buffers.alloc('a', 200)
+    buffers.alloc('a', 256)
+
+    assert len(buffers.regions) == 1
+    assert buffers.free_bytes() == 0
+
+def test_exhausted_keeps_previous_region():
+    buffers = PktBufferAllocator(size=256)
+    offset = buffers.alloc('a', 100)
+    buffers.alloc('b', 100)
+
+    with pytest.raises(PktBufferExhausted):
+        buffers.alloc('a', 200)
+    assert buffers.offset_of('a') == offset
+
+def test_fragmented_then_compact():
+    buffers = PktBufferAllocator(size=64 * 4, alignment=16)
+    for owner in range(4):
+        buffers.alloc(owner, 64)
+    buffers.free(0)
+    buffers.free(2)
+
+    with pytest.raises(PktBufferExhausted, match='fragmented'):
+        buffers.alloc('big', 128)
+
+    moves = buffers.compact()
+    assert sorted(moves.values()) == [ 0, 64 ]
+    assert buffers.alloc('big', 128) == 128
+
+def test_reserve_overlap():
+    buffers = PktBufferAllocator()
+    buffers.reserve('a', 0, 100)
+
+    with pytest.raises(ValueError):
+        buffers.reserve('b', 96, 100)
+    with pytest.raises(ValueError):
+        buffers.reserve('b', 8, 100)
+    assert buffers.reserve('b', 112, 100) == 112
+
+def test_transfer():
+    buffers = PktBufferAllocator()
+    old = buffers.alloc('a', 100)
+    new = buffers.alloc(('a', 'update'), 200)
+
+    assert buffers.transfer(('a', 'update'), 'a') == new
+    assert buffers.offset_of('a') == new
+    assert old not in buffers.regions
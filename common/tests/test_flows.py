@@ -0,0 +1,27 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from bfutil.Flows import FlowGenerator, Sequential
+
+def sample(distribution, start, n):
+    return distribution.sample(None, start, n).tolist()
+
+def test_sequential_wraps():
+    assert sample(Sequential(10, 14, step=2), 0, 7) == [ 10, 12, 14, 11, 13, 10, 12 ]
+
+def test_sequential_negative_step():
+    assert sample(Sequential(10, 14, start=12, step=-1), 0, 6) == [ 12, 11, 10, 14, 13, 12 ]
+    # same values whatever chunk they are made in
+    assert sample(Sequential(10, 14, start=12, step=-1), 3, 3) == [ 14, 13, 12 ]
+
+def test_sequential_full_range_does_not_overflow():
+    values = sample(Sequential(0, 0xFFFFFFFF, start=0xFFFFFFFF, step=0xFFFFFFFF), 10 ** 6, 3)
+    assert values == [ (0xFFFFFFFF * (1 + i)) % (1 << 32) for i in range(10 ** 6, 10 ** 6 + 3) ]
+
+def test_flow_generator_is_reproducible():
+    flows = FlowGenerator(100, seed=3, chunk_size=30, dst_port=Sequential(1, 8))
+    first = flows.array()
+    assert len(first) == 100
+    assert np.array_equal(first, flows.array())
+    assert first['dst_port'].tolist() == [ 1 + i % 8 for i in range(100) ]
@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+from bfutil.Latency import LatencyHistogram
+
+def test_exact_below_precision():
+    histogram = LatencyHistogram(precision=7)
+    for value in range(128):
+        histogram.record(value)
+
+    assert histogram.count == 128
+    assert histogram.percentile(50) == 63
+    assert histogram.percentile(100) == 127
+    assert histogram.min == 0 and histogram.max == 127
+
+@pytest.mark.parametrize('p', [ 50, 90, 99, 99.9 ])
+def test_percentile_relative_error(p):
+    rng = random.Random(1)
+    values = sorted(rng.randrange(1, 10 ** 9) for _ in range(10000))
+
+    histogram = LatencyHistogram(precision=7)
+    histogram.record_many(values)
+
+    exact = values[max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1)]
+    assert abs(histogram.percentile(p) - exact) <= exact / 2 ** 6
+
+def test_record_many_matches_record():
+    values = [ 0, 1, 127, 128, 129, 1000, 123456789, 2 ** 40 + 3 ]
+
+    one = LatencyHistogram()
+    for value in values:
+        one.record(value)
+    many = LatencyHistogram()
+    many.record_many(values)
+
+    assert one.counts == many.counts
+    assert one.stats() == many.stats()
+
+def test_merge():
+    a = LatencyHistogram()
+    a.record_many([ 10, 20, 30 ])
+    b = LatencyHistogram()
+    b.record_many([ 5, 1000 ])
+
+    a.merge(b)
+    assert a.count == 5
+    assert a.min == 5 and a.max == 1000
+    assert a.total == 1065
+
+def test_empty():
+    assert LatencyHistogram().percentile(50) is None
@@ -0,0 +1,64 @@
+import struct
+
+import pytest
+
+from bfutil.Pcap import PcapFile, write_pcap, write_pcapng
+
+PACKETS = [ bytes([ i ]) * (60 + i) for i in range(5) ]
+TIMESTAMPS = [ 1000000000 * i + 7000 * i for i in range(5) ]
+
+@pytest.mark.parametrize('write', [ write_pcap, write_pcapng ])
+def test_round_trip(tmp_path, write):
+    path = str(tmp_path / 'trace')
+    with open(path, 'wb') as f:
+        assert write(f, PACKETS, TIMESTAMPS) == len(PACKETS)
+
+    with PcapFile(path) as pcap:
+        read = [ (ts, bytes(pkt)) for ts, pkt in pcap ]
+
+    assert [ pkt for _, pkt in read ] == PACKETS
+    if write is write_pcapng:
+        assert [ ts for ts, _ in read ] == TIMESTAMPS
+    else:
+        # pcap keeps microseconds
+        assert [ ts for ts, _ in read ] == [ ts // 1000 * 1000 for ts in TIMESTAMPS ]
+
+def test_pcapng_large_timestamps_are_exact(tmp_path):
+    path = str(tmp_path / 'trace.pcapng')
+    timestamps = [ 10 ** 18 + i for i in range(3) ]
+    with open(path, 'wb') as f:
+        write_pcapng(f, PACKETS[:3], timestamps)
+
+    with PcapFile(path) as pcap:
+        assert [ ts for ts, _ in pcap ] == timestamps
+
+@pytest.mark.parametrize('write', [ write_pcap, write_pcapng ])
+def test_close_after_early_exit(tmp_path, write):
+    path = str(tmp_path / 'trace')
+    with open(path, 'wb') as f:
+        write(f, PACKETS, TIMESTAMPS)
+
+    with PcapFile(path) as pcap:
+        for ts, pkt in pcap:
+            break
+        started = iter(pcap)
+        next(started)
+
+    # packets outlive the file, and the iterations left are over
+    assert pkt == PACKETS[0]
+    assert list(started) == []
+
+def test_pcapng_packet_before_interface(tmp_path):
+    path = str(tmp_path / 'trace.pcapng')
+    with open(path, 'wb') as f:
+        write_pcapng(f, PACKETS, TIMESTAMPS)
+
+    data = open(path, 'rb').read()
+    shb_len = struct.unpack_from('<I', data, 4)[0]
+    idb_len = struct.unpack_from('<I', data, shb_len + 4)[0]
+    with open(path, 'wb') as f:
+        f.write(data[:shb_len] + data[shb_len + idb_len:])
+
+    with pytest.raises(ValueError, match='interface'):
+        with PcapFile(path) as pcap:
+            list(pcap)
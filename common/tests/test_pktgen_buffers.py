@@ -0,0 +1,92 @@
+import pytest
+
+from bfutil import fake_bfrt
+from bfutil.Pktgen import PktgenConfig, PktgenTrigger
+
+import bfrt_grpc.client as gc
+
+def packet_config(fill, length=100):
+    config = PktgenConfig()
+    config.set_packet(bytes([ fill ]) * length)
+    return config
+
+def hw_offset(switch, app_id, pipe=0):
+    for key, data in switch.tables['app_cfg'].entries[pipe].values():
+        if key.fields['app_id'] == app_id:
+            return data.fields['pkt_buffer_offset']
+
+def failing_write(*args, **kwargs):
+    raise gc.BfruntimeRpcException([ (0, fake_bfrt._Error(fake_bfrt.INVALID_ARGUMENT, 'injected')) ])
+
+def check_kept_old_region(pktgen, switch, old):
+    assert pktgen.buffers.offset_of(0) == old
+    assert pktgen.apps[0]['pkt_buffer_offset'] == old
+    assert hw_offset(switch, 0) == old
+    assert set(pktgen.buffers.owners) == { 0, 2 }
+
+    # the region is still taken: a new app does not get it
+    pktgen.set_app(1, 68, packet_config(3), PktgenTrigger.PERIODIC)
+    assert pktgen.apps[1]['pkt_buffer_offset'] != old
+
+def test_set_app_failure_keeps_region(bfrt, pktgen, monkeypatch):
+    switch = bfrt[0]
+    pktgen.set_app(0, 68, packet_config(1), PktgenTrigger.PERIODIC)
+    # right after app 0, so a longer packet for it goes elsewhere
+    pktgen.set_app(2, 68, packet_config(4), PktgenTrigger.PERIODIC)
+    old = pktgen.apps[0]['pkt_buffer_offset']
+
+    with monkeypatch.context() as patch:
+        patch.setattr(pktgen.app_cfg, 'entry_mod', failing_write)
+        with pytest.raises(gc.BfruntimeRpcException):
+            pktgen.set_app(0, 68, packet_config(2, length=200), PktgenTrigger.PERIODIC)
+
+    check_kept_old_region(pktgen, switch, old)
+
+def test_set_apps_failure_keeps_region(bfrt, pktgen, monkeypatch):
+    switch = bfrt[0]
+    pktgen.set_apps([
+        (0, 68, packet_config(1), PktgenTrigger.PERIODIC),
+        (2, 68, packet_config(4), PktgenTrigger.PERIODIC),
+    ])
+    old = pktgen.apps[0]['pkt_buffer_offset']
+
+    with monkeypatch.context() as patch:
+        patch.setattr(pktgen.app_cfg, 'entry_mod', failing_write)
+        report = pktgen.set_apps([ (0, 68, packet_config(2, length=200), PktgenTrigger.PERIODIC) ])
+
+    assert [ error[:2] for error in report['errors'] ] == [ ('app_cfg', 0) ]
+    check_kept_old_region(pktgen, switch, old)
+
+def test_set_apps_new_app_failure_frees_region(pktgen, monkeypatch):
+    with monkeypatch.context() as patch:
+        patch.setattr(pktgen.app_cfg, 'entry_add', failing_write)
+        pktgen.set_apps([ (0, 68, packet_config(1), PktgenTrigger.PERIODIC) ])
+
+    assert pktgen.apps == {}
+    assert pktgen.buffers.regions == {}
+
+def test_set_apps_shared_buffer_failure_fails_every_sharer(pktgen, monkeypatch):
+    config = packet_config(1)
+    with monkeypatch.context() as patch:
+        patch.setattr(pktgen.pkt_buffer, 'entry_add', failing_write)
+        report = pktgen.set_apps([
+            (0, 68, config, PktgenTrigger.PERIODIC),
+            (1, 69, config, PktgenTrigger.PERIODIC),
+        ])
+
+    assert sorted(error[1] for error in report['errors']) == [ 0, 1 ]
+    assert pktgen.apps == {}
+    assert pktgen.buffers.regions == {}
+
+def test_set_app_rewrites_its_own_offset(bfrt, pktgen):
+    switch = bfrt[0]
+    pktgen.set_app(0, 68, packet_config(1), PktgenTrigger.PERIODIC)
+    old = pktgen.apps[0]['pkt_buffer_offset']
+
+    config = packet_config(2)
+    config.set_pkt_buffer_offset(old)
+    pktgen.set_app(0, 68, config, PktgenTrigger.PERIODIC)
+
+    assert pktgen.buffers.offset_of(0) == old
+    assert hw_offset(switch, 0) == old
+    assert bytes(switch.buffers[0][old:old + 94]) == bytes([ 2 ]) * 94
@@ -0,0 +1,50 @@
+import pytest
+
+from bfutil.Pktgen import Pktgen, PktgenConfig, PktgenTrigger, PktgenVerifyError, VERIFY_SHADOW
+
+from test_pktgen_buffers import packet_config, hw_offset
+from test_pktgen_verify import corrupt_reads
+
+def test_update_app_moves_packet(bfrt, pktgen):
+    switch = bfrt[0]
+    pktgen.set_app(0, 68, packet_config(1), PktgenTrigger.PERIODIC)
+    old = pktgen.apps[0]['pkt_buffer_offset']
+
+    pktgen.update_app(0, packet_config(2))
+
+    new = pktgen.apps[0]['pkt_buffer_offset']
+    assert new != old
+    assert pktgen.buffers.offset_of(0) == new
+    assert hw_offset(switch, 0) == new
+    assert bytes(switch.buffers[0][new:new + 94]) == bytes([ 2 ]) * 94
+    assert set(pktgen.buffers.owners) == { 0 }
+
+def test_update_app_same_offset_new_packet_rejected(bfrt, pktgen):
+    switch = bfrt[0]
+    pktgen.set_app(0, 68, packet_config(1), PktgenTrigger.PERIODIC)
+    old = pktgen.apps[0]['pkt_buffer_offset']
+
+    config = packet_config(2)
+    config.set_pkt_buffer_offset(old)
+    with pytest.raises(ValueError, match='set_app'):
+        pktgen.update_app(0, config)
+
+    assert pktgen.buffers.offset_of(0) == old
+    assert set(pktgen.buffers.owners) == { 0 }
+    assert hw_offset(switch, 0) == old
+    assert bytes(switch.buffers[0][old:old + 94]) == bytes([ 1 ]) * 94
+
+def test_update_app_verify_failure_keeps_new_region(bfrt, monkeypatch):
+    switch, client, bfrt_info = bfrt
+    pktgen = Pktgen(client, bfrt_info, verify=VERIFY_SHADOW)
+    pktgen.set_app(0, 68, packet_config(1), PktgenTrigger.PERIODIC)
+
+    corrupt_reads(switch, monkeypatch, False)
+    with pytest.raises(PktgenVerifyError):
+        pktgen.update_app(0, packet_config(2, length=200))
+
+    # the entry_mod went through, so the app owns the region it points at
+    new = hw_offset(switch, 0)
+    assert pktgen.buffers.offset_of(0) == new
+    assert pktgen.apps[0]['pkt_buffer_offset'] == new
+    assert set(pktgen.buffers.owners) == { 0 }
@@ -0,0 +1,46 @@
+import pytest
+
+from bfutil import fake_bfrt
+from bfutil.Pktgen import Pktgen, PktgenConfig, PktgenTrigger, PktgenVerifyError, \
+    VERIFY_NONE, VERIFY_SHADOW, VERIFY_HARDWARE
+
+def corrupt_reads(switch, monkeypatch, from_hw):
+    """Make reads of app_cfg (from the driver or from hardware) see a different pkt_len."""
+    table = switch.tables['app_cfg']
+    read = table._read
+
+    def bad_read(pipe, key, data, hw):
+        data = read(pipe, key, data, hw)
+        if hw == from_hw:
+            data = fake_bfrt._Data(table, dict(data.fields, pkt_len=1), data.action_name)
+        return data
+
+    monkeypatch.setattr(table, '_read', bad_read)
+
+@pytest.mark.parametrize('verify, from_hw', [ (VERIFY_SHADOW, False), (VERIFY_HARDWARE, True) ])
+def test_set_app_mismatch_raises(bfrt, monkeypatch, verify, from_hw):
+    switch, client, bfrt_info = bfrt
+    pktgen = Pktgen(client, bfrt_info, verify=verify)
+    corrupt_reads(switch, monkeypatch, from_hw)
+
+    with pytest.raises(PktgenVerifyError, match='pkt_len'):
+        pktgen.set_app(0, 68, PktgenConfig(), PktgenTrigger.PERIODIC)
+
+@pytest.mark.parametrize('verify', [ VERIFY_SHADOW, VERIFY_HARDWARE ])
+def test_set_apps_mismatch_reported(bfrt, monkeypatch, verify):
+    switch, client, bfrt_info = bfrt
+    pktgen = Pktgen(client, bfrt_info, verify=verify)
+    corrupt_reads(switch, monkeypatch, verify == VERIFY_HARDWARE)
+
+    report = pktgen.set_apps([ (0, 68, PktgenConfig(), PktgenTrigger.PERIODIC) ])
+    assert [ error[:2] for error in report['errors'] ] == [ ('app_cfg', 0) ]
+    assert pktgen.apps == {}
+
+def test_verify_none_does_not_read(bfrt, monkeypatch):
+    switch, client, bfrt_info = bfrt
+    pktgen = Pktgen(client, bfrt_info, verify=VERIFY_NONE)
+    corrupt_reads(switch, monkeypatch, False)
+
+    switch.reset_rpc_counts()
+    pktgen.set_app(0, 68, PktgenConfig(), PktgenTrigger.PERIODIC)
+    assert ('app_cfg', 'get') not in switch.rpc_counts
@@ -0,0 +1,58 @@
+import threading
+
+from bfutil.Poller import CounterPoller
+
+class CountingPktgen():
+    """Every read sends 10 more packets of app 1."""
+
+    def __init__(self):
+        self.reads = 0
+        self.polled = threading.Event()
+
+    def get_reports(self, app_ids):
+        self.reads += 1
+        self.polled.set()
+        return { 1: { 'batch_counter': self.reads, 'pkt_counter': 10 * self.reads,
+                      'trigger_counter': self.reads } }
+
+    def get_app_packet_length(self, app_id):
+        return 100
+
+def test_stream_sees_polls_before_first_next():
+    pktgen = CountingPktgen()
+    poller = CounterPoller(pktgen, period=0.001)
+    poller.start()
+
+    samples = poller.stream()
+    pktgen.polled.clear()
+    pktgen.polled.wait(1)
+    poller.stop()
+
+    # the polls made before the stream was iterated were kept, and it ends
+    results = list(samples)
+    assert results
+    assert results[0][1].pkt_counter <= 10 * pktgen.reads
+
+def test_stream_after_stop_ends():
+    poller = CounterPoller(CountingPktgen(), period=0.001)
+    with poller:
+        pass
+
+    assert list(poller.stream()) == []
+    assert poller._streams == []
+
+def test_stop_with_full_stream_does_not_block():
+    pktgen = CountingPktgen()
+    poller = CounterPoller(pktgen, period=0.001)
+    poller.start()
+
+    samples = poller.stream(maxsize=2)
+    while pktgen.reads < 5:
+        pktgen.polled.clear()
+        pktgen.polled.wait(1)
+    poller.stop()
+
+    # the newest result is kept ahead of the end of the stream
+    results = list(samples)
+    assert len(results) == 1
+    assert results[0][1].pkt_counter == 10 * pktgen.reads
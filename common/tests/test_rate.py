@@ -0,0 +1,40 @@
+import pytest
+
+from bfutil.Rate import solve_rate, line_rate_pps, ETH_FCS_LEN, MIN_TIMER_NANOSEC
+
+@pytest.mark.parametrize('frame_size', [ 64, 512, 1518 ])
+@pytest.mark.parametrize('pps', [ 1e3, 1.234567e6, 8e6 ])
+def test_solve_rate_within_error(frame_size, pps):
+    plan = solve_rate(frame_size, 100, pps=pps)
+
+    assert plan.timer_nanosec > 0
+    assert abs(plan.error) <= 1e-4
+    assert plan.packets_per_batch * plan.batch_count * 1e9 / plan.timer_nanosec == \
+        pytest.approx(plan.achieved_pps)
+    assert plan.burst_pps <= line_rate_pps(frame_size, 100) * (1 + 1e-9)
+
+def test_solve_rate_gbps():
+    plan = solve_rate(100 + ETH_FCS_LEN, 100, gbps=10)
+    assert plan.achieved_gbps == pytest.approx(10, rel=1e-4)
+
+def test_solve_rate_line_rate():
+    plan = solve_rate(64, 100, pps=line_rate_pps(64, 100) * 2)
+    assert plan.timer_nanosec == 0
+    assert plan.achieved_pps == pytest.approx(line_rate_pps(64, 100))
+
+def test_solve_rate_min_timer():
+    plan = solve_rate(64, 100, pps=100e6, min_timer_nanosec=1000)
+    assert plan.timer_nanosec >= 1000
+    assert abs(plan.error) <= 1e-4
+
+def test_solve_rate_too_slow():
+    with pytest.raises(ValueError):
+        solve_rate(64, 100, pps=0.01, max_packets_per_tick=1)
+
+def test_solve_rate_default_min_timer():
+    # 100 Mpps would be one packet every 10 ns
+    plan = solve_rate(64, 100, pps=100e6)
+    assert plan.timer_nanosec >= MIN_TIMER_NANOSEC
+
+    plan = solve_rate(64, 100, pps=100e6, min_timer_nanosec=0)
+    assert plan.timer_nanosec < MIN_TIMER_NANOSEC
@@ -0,0 +1,42 @@
+from bfutil.Shadow import ShadowState
+
+KEY = { 'app_id': 1 }
+
+def test_diff_unknown_entry_is_everything():
+    shadow = ShadowState()
+    assert shadow.diff('app_cfg', KEY, { 'a': 1, 'b': 2 }) == { 'a': 1, 'b': 2 }
+
+def test_diff_only_changed_fields():
+    shadow = ShadowState()
+    shadow.update('app_cfg', KEY, { 'a': 1, 'b': 2 })
+
+    assert shadow.diff('app_cfg', KEY, { 'a': 1, 'b': 3 }) == { 'b': 3 }
+    assert shadow.diff('app_cfg', KEY, { 'a': 1, 'c': 0 }) == { 'c': 0 }
+
+def test_all_pipes_write_answers_for_each_pipe():
+    shadow = ShadowState()
+    shadow.update('app_cfg', KEY, { 'a': 1 })
+
+    assert shadow.get('app_cfg', KEY, pipe=2) == { 'a': 1 }
+
+    # a single pipe write splits that pipe off, keeping the other fields
+    shadow.update('app_cfg', KEY, { 'b': 2 }, pipe=2)
+    assert shadow.get('app_cfg', KEY, pipe=2) == { 'a': 1, 'b': 2 }
+
+def test_all_pipes_write_replaces_single_pipes():
+    shadow = ShadowState()
+    shadow.update('app_cfg', KEY, { 'a': 1 }, pipe=0)
+    shadow.update('app_cfg', KEY, { 'a': 2 }, pipe=1)
+    shadow.update('app_cfg', KEY, { 'a': 3 })
+
+    assert shadow.get('app_cfg', KEY, pipe=0) == { 'a': 3 }
+    assert shadow.get('app_cfg', KEY, pipe=1) == { 'a': 3 }
+
+def test_invalidate():
+    shadow = ShadowState()
+    shadow.update('app_cfg', KEY, { 'a': 1 })
+    shadow.update('port_cfg', { 'dev_port': 68 }, { 'pktgen_enable': True })
+
+    shadow.invalidate('app_cfg')
+    assert shadow.get('app_cfg', KEY) is None
+    assert shadow.get('port_cfg', { 'dev_port': 68 }) == { 'pktgen_enable': True }
@@ -0,0 +1,73 @@
+import pytest
+
+import bfrt_grpc.client as gc
+
+from bfutil.Table import Table
+
+class ForwardTable(Table):
+
+    def __init__(self, client, bfrt_info):
+        super(ForwardTable, self).__init__(client, bfrt_info)
+        self.table = bfrt_info.table_get('forward')
+
+@pytest.fixture
+def table(bfrt):
+    switch, client, bfrt_info = bfrt
+    switch.add_table('forward', { 'dst': 32 }, actions={ 'set_port': { 'port': 9 } }, size=100)
+    return ForwardTable(client, bfrt_info)
+
+def entries(n, start=0):
+    return [ ({ 'dst': i }, { 'port': i % 512 }) for i in range(start, start + n) ]
+
+def test_bulk_load_batches(bfrt, table):
+    switch = bfrt[0]
+    result = table.bulk_load(entries(90), action='set_port', batch_size=32)
+
+    assert result['entries'] == 90
+    assert result['failed'] == []
+    assert result['rpcs'] == 3
+    assert switch.rpc_counts[('forward', 'add')] == 3
+    assert len(switch.tables['forward'].entries[0]) == 90
+
+def test_bulk_load_reports_rejected_entries(table):
+    table.bulk_load(entries(90), action='set_port')
+    result = table.bulk_load(entries(20, start=90), action='set_port', batch_size=8)
+
+    # the table holds 100 entries
+    assert result['entries'] == 10
+    assert [ key['dst'] for key, _ in result['failed'] ] == list(range(100, 110))
+
+def test_write_entry_only_writes_changes(bfrt, table):
+    switch = bfrt[0]
+    assert table.write_entry({ 'dst': 1 }, { 'port': 3 }, 'set_port') == { 'port': 3 }
+
+    switch.reset_rpc_counts()
+    assert table.write_entry({ 'dst': 1 }, { 'port': 3 }, 'set_port') == {}
+    assert switch.rpc_total() == 0
+
+    assert table.write_entry({ 'dst': 1 }, { 'port': 4 }, 'set_port') == { 'port': 4 }
+    assert switch.rpc_counts == { ('forward', 'mod'): 1 }
+    assert table.read_entry({ 'dst': 1 }, from_hw=True)['port'] == 4
+
+def test_clear(table):
+    table.bulk_load(entries(50), action='set_port')
+    table.clear(batch_size=16)
+    assert list(table.iter_entries()) == []
+
+def test_write_entry_modifies_unknown_existing_entry(bfrt, table):
+    switch = bfrt[0]
+    table.bulk_load(entries(1), action='set_port')
+
+    # bulk_load does not fill the shadow, so the add fails and is retried
+    assert table.write_entry({ 'dst': 0 }, { 'port': 7 }, 'set_port') == { 'port': 7 }
+    assert switch.rpc_counts[('forward', 'mod')] == 1
+    assert table.read_entry({ 'dst': 0 }, from_hw=True)['port'] == 7
+
+def test_write_entry_full_table_raises(bfrt, table):
+    switch = bfrt[0]
+    table.bulk_load(entries(100), action='set_port')
+
+    switch.reset_rpc_counts()
+    with pytest.raises(gc.BfruntimeRpcException):
+        table.write_entry({ 'dst': 100 }, { 'port': 1 }, 'set_port')
+    assert ('forward', 'mod') not in switch.rpc_counts
@@ -0,0 +1,27 @@
+import pytest
+
+from scapy.all import Ether
+
+from bfutil.util import PktBufferCache, simple_eth_bytes, simple_eth_pkt
+
+@pytest.mark.parametrize('pktlen', [ 64, 100, 1514 ])
+def test_simple_eth_bytes_default_matches_scapy(pktlen):
+    assert bytes(simple_eth_bytes(pktlen)) == bytes(simple_eth_pkt(pktlen))
+
+@pytest.mark.parametrize('smac', [ None, '02:00:00:00:00:01' ])
+def test_simple_eth_bytes_dmac_matches_scapy(smac):
+    dmac = '10:00:01:02:03:04'
+    pkt = simple_eth_bytes(64, dmac, smac)
+    assert bytes(pkt) == bytes(simple_eth_pkt(64, dmac, smac))
+    assert Ether(bytes(pkt)).src == (smac or Ether(dst=dmac).src)
+
+def test_pkt_buffer_cache_keys_smac():
+    cache = PktBufferCache()
+    dmac = '10:00:01:02:03:04'
+    a = cache.get(64, dmac, '02:00:00:00:00:01')
+    b = cache.get(64, dmac, '02:00:00:00:00:02')
+
+    assert a != b
+    assert a[:6] == bytes.fromhex('020000000001')
+    assert cache.get(64, dmac, '02:00:00:00:00:01') is a
+    assert (cache.hits, cache.misses) == (1, 2)
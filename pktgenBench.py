@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import json
+import argparse
+import logging
+import platform
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of values, p in [0, 100]."""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, int(round(p / 100.0 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def summarize(latencies, rpcs=None, ops=None):
+    """Latency statistics in milliseconds, and RPCs per operation."""
+    ops = ops or len(latencies)
+    result = {
+        'count': len(latencies),
+        'mean_ms': 1e3 * sum(latencies) / len(latencies) if latencies else None,
+        'p50_ms': 1e3 * percentile(latencies, 50) if latencies else None,
+        'p99_ms': 1e3 * percentile(latencies, 99) if latencies else None,
+        'max_ms': 1e3 * max(latencies) if latencies else None,
+    }
+    if rpcs is not None:
+        result['rpcs'] = sum(rpcs.values())
+        result['rpcs_per_op'] = sum(rpcs.values()) / ops if ops else None
+        result['rpcs_by_op'] = dict(rpcs)
+    return result
+
+
+class PktgenBench:
+
+    def __init__(self, bfutil, client, bfrt_info, logger, repeat, num_pipes, profiler=None):
+        self.bfutil = bfutil
+        self.client = client
+        self.bfrt_info = bfrt_info
+        self.logger = logger
+        self.repeat = repeat
+        self.num_pipes = num_pipes
+        self.profiler = profiler
+
+    def _pktgen(self):
+        """A fresh Pktgen, with no apps registered, counting its RPCs by operation."""
+        counts = {}
+
+        def count(record):
+            counts[record.op] = counts.get(record.op, 0) + 1
+
+        pktgen = self.bfutil.Pktgen(self.client, self.bfrt_info, self.num_pipes)
+        self.bfutil.instrument(pktgen, [ count ])
+        if self.profiler is not None:
+            self.profiler.attach(pktgen)
+        return pktgen, counts
+
+    def _apps(self, n_apps, pps=1e6):
+        apps = []
+        for i in range(n_apps):
+            config = self.bfutil.PktgenConfig()
+            config.set_rate(pps)
+            apps.append((i % 8, 68 + i % 4, config, self.bfutil.PktgenTrigger.PERIODIC, i // 8))
+        return apps
+
+    def cold_setup(self, app_counts):
+        """Programming N apps on a fresh Pktgen, one by one and batched."""
+        results = {}
+
+        for n_apps in app_counts:
+            for mode in ('set_app', 'set_apps'):
+                latencies = []
+                rpcs = {}
+
+                for _ in range(self.repeat):
+                    pktgen, counts = self._pktgen()
+                    apps = self._apps(n_apps)
+
+                    start = time.perf_counter()
+                    if mode == 'set_app':
+                        for app in apps:
+                            pktgen.set_app(*app)
+                    else:
+                        pktgen.set_apps(apps)
+                    latencies.append(time.perf_counter() - start)
+
+                    for op, n in counts.items():
+                        rpcs[op] = rpcs.get(op, 0) + n
+
+                results['{}/{}'.format(mode, n_apps)] = summarize(latencies, rpcs, self.repeat)
+
+        return results
+
+    def reprogram(self, iterations):
+        """Reprogramming one app, alternating packet length and rate."""
+        pktgen, counts = self._pktgen()
+        app_id, local_port, config, trigger, _ = self._apps(1)[0]
+        pktgen.set_app(app_id, local_port, config, trigger)
+        counts.clear()
+
+        latencies = []
+        for i in range(iterations):
+            config.set_packet_length(64 + (i % 2) * 64)
+            config.set_rate(1e6 + i % 2)
+
+            start = time.perf_counter()
+            pktgen.set_app(app_id, local_port, config, trigger)
+            latencies.append(time.perf_counter() - start)
+
+        result = summarize(latencies, counts)
+        result['per_second'] = len(latencies) / sum(latencies)
+        return result
+
+    def first_packet(self, timeout=1.0):
+        """Time from calling start to the first pkt_counter increment."""
+        pktgen, counts = self._pktgen()
+        app_id, local_port, config, trigger, _ = self._apps(1, pps=1e8)[0]
+        pktgen.set_app(app_id, local_port, config, trigger)
+
+        latencies = []
+        polls = []
+        for _ in range(self.repeat):
+            before = pktgen.get_report(app_id)['pkt_counter']
+            counts.clear()
+
+            start = time.perf_counter()
+            pktgen.start(app_id)
+            n = 0
+            while pktgen.get_report(app_id)['pkt_counter'] == before:
+                n += 1
+                if time.perf_counter() - start > timeout:
+                    self.logger.error('No packets {}s after start'.format(timeout))
+                    break
+            latencies.append(time.perf_counter() - start)
+            polls.append(n + 1)
+
+            pktgen.stop(app_id)
+
+        result = summarize(latencies)
+        result['polls_p50'] = percentile(polls, 50)
+        return result
+
+    def poll_rate(self, app_counts, duration):
+        """Sustained get_reports of N apps for `duration` seconds."""
+        results = {}
+
+        for n_apps in app_counts:
+            pktgen, counts = self._pktgen()
+            pktgen.set_apps(self._apps(n_apps))
+            counts.clear()
+
+            latencies = []
+            end = time.perf_counter() + duration
+            while time.perf_counter() < end:
+                start = time.perf_counter()
+                pktgen.get_reports()
+                latencies.append(time.perf_counter() - start)
+
+            result = summarize(latencies, counts)
+            result['polls_per_second'] = len(latencies) / duration
+            results[str(n_apps)] = result
+
+        return results
+
+
+def main():
+
+    # set up options
+    argparser = argparse.ArgumentParser(
+        description="Tofino pktgen controller benchmarks.")
+    argparser.add_argument('--program_name',
+                           type=str,
+                           default='b_2pt_sender_tofino',
+                           help='P4 program name')
+    argparser.add_argument('--grpc_server',
+                           type=str,
+                           default='localhost',
+                           help='GRPC server name/address')
+    argparser.add_argument('--grpc_port',
+                           type=int,
+                           default=50052,
+                           help='GRPC server port')
+    argparser.add_argument('--fake',
+                           action='store_true',
+                           help='Run against the in-process fake backend')
+    argparser.add_argument('--rpc_latency_ms',
+                           type=float,
+                           default=0.0,
+                           help='RPC latency injected by the fake backend')
+    argparser.add_argument('--num_pipes', type=int, default=4,
+                           help='Pipes of the device')
+    argparser.add_argument('--apps', type=int, nargs='+', default=[1, 8, 32],
+                           help='App counts of the setup and poll scenarios')
+    argparser.add_argument('--repeat', type=int, default=20,
+                           help='Repetitions of each measurement')
+    argparser.add_argument('--duration', type=float, default=2.0,
+                           help='Seconds of sustained polling')
+    argparser.add_argument('--output', type=str, default=None,
+                           help='Write the JSON results here instead of stdout')
+    argparser.add_argument('--profile', action='store_true',
+                           help='Log a per table and operation report of the RPCs')
+    argparser.add_argument('--trace', type=str, default=None,
+                           help='Write a Chrome trace of every RPC here')
+    args = argparser.parse_args()
+
+    if args.fake:
+        os.environ['BFUTIL_FAKE_BFRT'] = '1'
+
+    # bfutil picks the backend when it is first imported
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'common'))
+    import bfutil
+    import bfrt_grpc.client as gc
+
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger('pktgenBench')
+
+    grpc_addr = '{}:{}'.format(args.grpc_server, args.grpc_port)
+    if args.fake:
+        bfutil.fake_bfrt.switch(grpc_addr, num_pipes=args.num_pipes,
+                                rpc_latency=args.rpc_latency_ms / 1e3)
+
+    c = gc.ClientInterface(grpc_addr, 0, 0)
+    c.bind_pipeline_config(args.program_name)
+    bfrt_info = c.bfrt_info_get(args.program_name)
+
+    profiler = None
+    if args.profile or args.trace:
+        profiler = bfutil.RpcProfiler()
+
+    bench = PktgenBench(bfutil, c, bfrt_info, logger, args.repeat, args.num_pipes, profiler)
+    max_apps = 8 * args.num_pipes
+    app_counts = [ n for n in args.apps if n <= max_apps ]
+
+    results = {
+        'meta': {
+            'backend': 'fake' if args.fake else grpc_addr,
+            'rpc_latency_ms': args.rpc_latency_ms if args.fake else None,
+            'program_name': args.program_name,
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'host': platform.node(),
+        },
+        'cold_setup': bench.cold_setup(app_counts),
+        'reprogram': bench.reprogram(args.repeat * 10),
+        'first_packet': bench.first_packet(),
+        'poll_rate': bench.poll_rate(app_counts, args.duration),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if args.profile:
+        sys.stderr.write(profiler.format_report() + '\n')
+    if args.trace:
+        with open(args.trace, 'w') as f:
+            profiler.write_chrome_trace(f)
+
+    c.tear_down_stream()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,217 +7,74 @@ import argparse
 import logging
 from enum import Enum
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'common'))
+from bfutil.Instrument import InstrumentedBfrtInfo
+from bfutil.Metrics import MetricsExporter, RpcMetrics
+from bfutil.Poller import CounterPoller
+from bfutil.Pktgen import Pktgen, PktgenConfig, PktgenTrigger, VERIFY_SHADOW
+
 import bfrt_grpc.bfruntime_pb2 as bfruntime_pb2
 import bfrt_grpc.client as gc
 import grpc
 
-
 class PktGenTrigger(Enum):
     """
-    Trigger types for packet generation.
-    I have only tested the TIMER_ONE_SHOT packet generation.
-    The other ones are here for completion sake,
-    but I have not tested them.
-    Good luck!
-    Types of trigger:
-        trigger_timer_one_shot
-        trigger_timer_periodic
-        trigger_port_down        
-        trigger_recirc_pattern   
-        trigger_dprsr            
-        trigger_pfc              
+    Trigger types for packet generation, under the names this script has
+    always used; TRIGGERS maps them to bfutil.PktgenTrigger, which has
+    the fields each one needs.
     """
 
-    # These first two are tested in p4_16-examples/pktgen
     TIMER_ONE_SHOT = "$PKTGEN_TRIGGER_TIMER_ONE_SHOT"
     TIMER_PERIODIC = '$PKTGEN_TRIGGER_TIMER_PERIODIC'
-
-    # These only appear briefly in bf-drivers/pdfixed_thrift/gen-py/conn_mgr_pd_rpc/ttypes.py
-    # I have no idea if they even work, or what they need to work
     PORT_DOWN = '$PKTGEN_TRIGGER_PORT_DOWN'
     RECIRCULATION = '$PKTGEN_TRIGGER_RECIRC_PATTERN'
     DEPARSER = '$PKTGEN_TRIGGER_DPRSR'
     PFC = '$PKTGEN_TRIGGER_PFC'
 
 
+TRIGGERS = {
+    PktGenTrigger.TIMER_ONE_SHOT: PktgenTrigger.ONE_SHOT,
+    PktGenTrigger.TIMER_PERIODIC: PktgenTrigger.PERIODIC,
+    PktGenTrigger.PORT_DOWN: PktgenTrigger.PORT_DOWN,
+    PktGenTrigger.RECIRCULATION: PktgenTrigger.RECIRCULATION,
+    PktGenTrigger.DEPARSER: PktgenTrigger.DEPARSER,
+    PktGenTrigger.PFC: PktgenTrigger.PFC,
+}
+
+
 class PktGenPriv:
+    """
+    A single pktgen app, configured from a config dict (see main), on top
+    of bfutil.Pktgen: the table and action names ($PKTGEN_* or not) are
+    detected from bfrt_info, and verify picks how writes are checked,
+    none, read-back from the driver (shadow, the default) or from hardware.
+    """
 
-    def __init__(self, gc, bfrt_info, logger):
+    def __init__(self, gc, bfrt_info, logger, verify=VERIFY_SHADOW):
         self.gc = gc
         self.bfrt_info = bfrt_info
-        self.app_cfg_table = self.bfrt_info.table_get(
-            "$PKTGEN_APPLICATION_CFG")
-        self.pkt_buffer_table = self.bfrt_info.table_get("$PKTGEN_PKT_BUFFER")
-        self.port_cfg_table = self.bfrt_info.table_get("$PKTGEN_PORT_CFG")
+        self.pktgen = Pktgen(gc, bfrt_info, verify=verify)
         self.logger = logger
         self.has_started = False
 
-    def _enable_port_pktgen(self):
+    def _pktgen_config(self):
         """
-        Enable the packet generation in a specific port.
-        For Tofino1 the port must be in [68..71];
-        for Tofino2 the port must be in [0..7].
+        The PktgenConfig of the config dict. Its "pkt_len" is the app_cfg
+        one, the length of "pkt_buffer", which pktgen sends after its 6
+        byte header.
         """
+        assert len(self.config["pkt_buffer"]) == self.config["pkt_len"]
 
-        self.logger.info("Enabling pktgen port config")
-        assert self.port_cfg_table
-
-        port = self.config["port"]
-        assert port in range(68, 72)
-
-        key = self.port_cfg_table.make_key([gc.KeyTuple("dev_port", port)])
-        value = self.port_cfg_table.make_data(
-            [gc.DataTuple("pktgen_enable", bool_val=True)])
-        self.port_cfg_table.entry_add(self.target, [key], [value])
-
-        # Check that the values were written correctly
-        get_value = self.port_cfg_table.make_data(
-            [gc.DataTuple("pktgen_enable")], get=True)
-        resp = self.port_cfg_table.entry_get(self.target, [key],
-                                             {"from_hw": False}, get_value)
-
-        data_dict = next(resp)[0].to_dict()
-        assert data_dict["pktgen_enable"]
-
-        self.logger.info("Pktgen port config was successful")
-
-    def _config_app(self):
-        """
-        Setup the app configuration, depending on the config dict passed before.
-        """
-        self.logger.info("Setting up pktgen app config")
-
-        # Config keys' meaning:
-        # "app_id" = app id
-        # "port" = sender port
-        # "timer_nanosec" = timer delay to start, in ns
-        # "pkt_len" = len of the packet to generate
-        # "pkt_buffer_offset" = buffer offset to start reading packet data
-        # "pkt_buffer" = bytearray to be copied into each generated packet
-        # "pkt_buffer_size" = bytearray to be copied into each generated packet
-        # "increment_source_port" = boolean, should pktgen increment the port in the packet
-        # "batch_count_cfg" = how many batches should we generate (starting at 1)
-        # "packets_per_batch_cfg" = how many packets per batch should pktgen generate (starting at 1)
-        # "ibg" = idk
-        # "ibg_jitter" = idk
-        # "ipg" = idk
-        # "ipg_jitter" = idk
-        cfg = [
-            gc.DataTuple('timer_nanosec', self.config['timer_nanosec']),
-            gc.DataTuple('pkt_len', self.config['pkt_len']),
-            gc.DataTuple('pkt_buffer_offset',
-                         self.config['pkt_buffer_offset']),
-            gc.DataTuple('pipe_local_source_port', self.config["port"]),
-            gc.DataTuple('increment_source_port',
-                         bool_val=self.config['increment_source_port']),
-            gc.DataTuple('batch_count_cfg',
-                         self.config['batch_count_cfg'] - 1),
-            gc.DataTuple('packets_per_batch_cfg',
-                         self.config['packets_per_batch_cfg'] - 1),
-            gc.DataTuple('ibg', self.config['ibg']),
-            gc.DataTuple('ibg_jitter', self.config['ibg_jitter']),
-            gc.DataTuple('ipg', self.config['ipg']),
-            gc.DataTuple('ipg_jitter', self.config['ipg_jitter']),
-
-            # We want the pktgen functionality disabled by default
-            gc.DataTuple('app_enable', bool_val=False),
-
-            # These counters will be incremented when pktgen is executing,
-            # they probably should not be modified beforehand.
-            gc.DataTuple('batch_counter', 0),
-            gc.DataTuple('pkt_counter', 0),
-            gc.DataTuple('trigger_counter', 0)
-        ]
-
-        key = self.app_cfg_table.make_key(
-            [gc.KeyTuple("app_id", self.config["app_id"])])
-
-        data = self.app_cfg_table.make_data(cfg,
-                                            self.config["pktgen_type"].value)
-        self.app_cfg_table.entry_add(self.target, [key], [data])
-
-        # Check if the entries we care about are correct
-        resp = self.app_cfg_table.entry_get(
-            self.target, [key], {"from_hw": False},
-            self.app_cfg_table.make_data([
-                gc.DataTuple('timer_nanosec'),
-                gc.DataTuple('app_enable'),
-                gc.DataTuple('pkt_len'),
-                gc.DataTuple('pkt_buffer_offset'),
-                gc.DataTuple('pipe_local_source_port'),
-                gc.DataTuple('increment_source_port'),
-                gc.DataTuple('batch_count_cfg'),
-                gc.DataTuple('packets_per_batch_cfg'),
-                gc.DataTuple('ibg'),
-                gc.DataTuple('ibg_jitter'),
-                gc.DataTuple('ipg'),
-                gc.DataTuple('ipg_jitter')
-            ],
-                                         self.config["pktgen_type"].value,
-                                         get=True))
-        resp_dict = next(resp)[0].to_dict()
-
-        keys_to_check = [
-            "timer_nanosec", "pkt_len", "pkt_buffer_offset",
-            "increment_source_port", "ibg", "ibg_jitter", "ipg", "ipg_jitter"
-        ]
-
-        for key in keys_to_check:
-            assert resp_dict[key] == self.config[
-                key], f"Key is different: {key}\tExpected: {self.config[key]}\tGot: {resp_dict[key]}"
-
-        self.logger.info("Pktgen app config finished correctly")
-
-    def _set_packet_buffer(self):
-        """
-        Set the packet buffer correctly
-        NOTE: we reuse the pkt_len attribute for the pkt_buffer_size;
-        these don't necessarily have to be the same, but idc
-        """
-        self.logger.info("Setting up the packet buffer in pktgen")
-        key = self.pkt_buffer_table.make_key([
-            gc.KeyTuple("pkt_buffer_offset", self.config["pkt_buffer_offset"]),
-            gc.KeyTuple("pkt_buffer_size", self.config["pkt_len"])
-        ])
-        self.pkt_buffer_table.entry_add(self.target, [key], [
-            self.pkt_buffer_table.make_data(
-                [gc.DataTuple("buffer", self.config["pkt_buffer"])])
-        ])
-        # NOTE: I wanted to check if the buffer and everything was set correctly, but the operation
-        # is invalid for some fucking reason that I don't want to know
-        self.logger.info("Pktgen buffer setup correctly")
-
-    def _enable_pktgen(self):
-        """
-        Enable the packet generation mechanism
-        This should only be called after calling all the previous setup methods
-        """
-        self.logger.info("Enabling pktgen")
-        self.app_cfg_table.entry_mod(self.target, [
-            self.app_cfg_table.make_key(
-                [gc.KeyTuple('app_id', self.config["app_id"])])
-        ], [
-            self.app_cfg_table.make_data(
-                [gc.DataTuple('app_enable', bool_val=True)],
-                self.config["pktgen_type"].value)
-        ])
-        self.logger.info("Pktgen was enabled successfully")
-
-    def _disable_pktgen(self):
-        """
-        Disable the packet generation mechanism
-        This should only be called after enabling it
-        """
-        self.logger.info("Disabling pktgen")
-        self.app_cfg_table.entry_mod(self.target, [
-            self.app_cfg_table.make_key(
-                [gc.KeyTuple('app_id', self.config["app_id"])])
-        ], [
-            self.app_cfg_table.make_data(
-                [gc.DataTuple('app_enable', bool_val=False)],
-                self.config["pktgen_type"].value)
-        ])
-        self.logger.info("Pktgen was disabled successfully")
+        config = PktgenConfig()
+        config.set_packet(bytes(6) + bytes(self.config["pkt_buffer"]))
+        config.set_pkt_buffer_offset(self.config["pkt_buffer_offset"])
+        config.get_config().update({
+            name: self.config[name] for name in (
+                "timer_nanosec", "increment_source_port", "batch_count_cfg",
+                "packets_per_batch_cfg", "ibg", "ibg_jitter", "ipg", "ipg_jitter"
+            )
+        })
+        return config
 
     def set_app(self, config):
         """
@@ -226,11 +83,10 @@ class PktGenPriv:
 
         self.logger.info("Setting up pktgen")
         self.config = config
-        self.target = self.gc.Target(device_id=0, pipe_id=0xffff)
 
-        self._enable_port_pktgen()
-        self._config_app()
-        self._set_packet_buffer()
+        self.pktgen.set_app(self.config["app_id"], self.config["port"],
+                            self._pktgen_config(),
+                            TRIGGERS[self.config["pktgen_type"]])
         self.logger.info("Pktgen finished setup correctly")
 
     def start(self):
@@ -241,7 +97,7 @@ class PktGenPriv:
         if self.has_started:
             self.logger.fatal("pktgen is already running")
         self.has_started = True
-        self._enable_pktgen()
+        self.pktgen.start(self.config["app_id"])
         self.logger.info("Started pktgen")
 
     def stop(self):
@@ -252,23 +108,21 @@ class PktGenPriv:
         if not self.has_started:
             self.logger.fatal("pktgen is not running")
         self.has_started = False
-        self._disable_pktgen()
+        self.pktgen.stop(self.config["app_id"])
         self.logger.info("Stopped pktgen")
 
     def get_counters(self):
-        key = self.app_cfg_table.make_key(
-            [self.gc.KeyTuple('app_id', self.config["app_id"])])
-        data = self.app_cfg_table.make_data([
-            self.gc.DataTuple('batch_counter'),
-            self.gc.DataTuple('pkt_counter'),
-            self.gc.DataTuple('trigger_counter')
-        ],
-                                            self.config["pktgen_type"].value,
-                                            get=True)
-        resp = self.app_cfg_table.entry_get(self.target, [key],
-                                            {"from_hw": True}, data)
-        resp_dict = next(resp)[0].to_dict()
-        return resp_dict
+        return self.pktgen.get_report(self.config["app_id"])
+
+    def get_reports(self, app_ids=None):
+        """
+        Counters of the configured app, keyed by app_id, for CounterPoller
+        """
+        return self.pktgen.get_reports([self.config["app_id"]])
+
+    def get_app_packet_length(self, app_id):
+        # pktgen prepends its 6 byte header to the buffer
+        return self.pktgen.get_app_packet_length(app_id)
 
 
 def main():
@@ -289,6 +143,21 @@ def main():
                            default=50052,
                            help='GRPC server port')
     argparser.add_argument('--topology', type=str, help='Topology file')
+    argparser.add_argument('--poll_ms',
+                           type=float,
+                           default=None,
+                           help='Print the TX rate every POLL_MS milliseconds '
+                           'instead of waiting for input')
+    argparser.add_argument('--verify',
+                           choices=['none', 'shadow', 'hardware'],
+                           default='shadow',
+                           help='How pktgen writes are checked: not at all, '
+                           'read back from the driver, or read back from hardware')
+    argparser.add_argument('--metrics_port',
+                           type=int,
+                           default=None,
+                           help='Serve Prometheus metrics of the app counters and '
+                           'the bfrt RPC times on this port')
     args = argparser.parse_args()
 
     PROGRAM_NAME = args.program_name
@@ -308,7 +177,12 @@ def main():
     # Get all protobuf tables for program
     bfrt_info = c.bfrt_info_get(PROGRAM_NAME)
 
-    pktgen = PktGenPriv(gc, bfrt_info, logger)
+    rpc_metrics = None
+    if args.metrics_port is not None:
+        rpc_metrics = RpcMetrics()
+        bfrt_info = InstrumentedBfrtInfo(bfrt_info, [rpc_metrics])
+
+    pktgen = PktGenPriv(gc, bfrt_info, logger, verify=args.verify)
 
     config = {
         # I have no idea how to get the app_id, I just set it to 1 and roll with it
@@ -336,11 +210,39 @@ def main():
     print(f"{d}")
     pktgen.start()
 
-    s = input("> ")
-    while s != "quit":
-        d = pktgen.get_counters()
-        print(f"{d}")
+    poller = None
+    exporter = None
+    if args.poll_ms is not None or args.metrics_port is not None:
+        period = args.poll_ms / 1000.0 if args.poll_ms is not None else 1.0
+        poller = CounterPoller(pktgen, period=period)
+
+    if args.metrics_port is not None:
+        exporter = MetricsExporter(poller, pktgen.pktgen, rpc_metrics,
+                                   port=args.metrics_port)
+        exporter.start()
+
+    if poller is not None:
+        poller.start()
+
+    if args.poll_ms is not None:
+        try:
+            for samples in poller.stream():
+                for sample in samples.values():
+                    print(f"app {sample.app_id}: {sample.pkt_counter} pkts, "
+                          f"{sample.pps:.0f} pps, {sample.bps / 1e9:.3f} Gbps")
+        except KeyboardInterrupt:
+            pass
+    else:
         s = input("> ")
+        while s != "quit":
+            d = pktgen.get_counters()
+            print(f"{d}")
+            s = input("> ")
+
+    if poller is not None:
+        poller.stop()
+    if exporter is not None:
+        exporter.stop()
     pktgen.stop()
 
     # flush logs, stdout, stderr